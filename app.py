@@ -3,8 +3,7 @@
 # ----------------------------------------------------------------------------#
 
 import json
-import dateutil.parser
-import babel
+import hashlib
 from flask import (
     Flask,
     render_template,
@@ -15,15 +14,13 @@ from flask import (
     url_for,
     jsonify,
     abort,
+    stream_with_context,
 )
-from flask_moment import Moment
-from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import logging
 from logging import Formatter, FileHandler
-from flask_wtf import Form
-from forms import *
+
+# The WTForms forms are imported by the HTML views using them, not on boot
 import collections
 import collections.abc
 
@@ -35,12 +32,41 @@ import ssl
 ssl._create_default_https_context = ssl._create_unverified_context
 
 # import database's models
-from models import db, setup_db, Actor, Movie
+from sqlalchemy.orm.exc import StaleDataError
+from models import db, setup_db, Actor, Movie, row_count, change_count
+from search import search, MAX_SEARCH_ITEMS_PER_PAGE
+from search_index import search_engine, suggest_index
+from bulk import bulk_insert, read_rows
+from casting import assign_actors, read_actor_ids, unassign_actors
+from cache import response_cache
+from includes import include_related, requested_includes
+from fields import as_dict, requested_fields
+from readmodels import get_row, get_rows, iter_rows
+from listing import (
+    ITEMS_PER_PAGE,
+    MAX_ITEMS_PER_PAGE,
+    decode_cursor,
+    list_filters,
+    list_query,
+    paginate_items,
+    search_page,
+)
+from serialization import Encoded, JSONEncoder, dumps, fragments, json_response
+from writes import delete_row, read_patch, update_row
+from graph import cast_graph
+from routing import replicas
 
 # Auth0 authenticator
-from auth.auth import AuthError, requires_auth
+from auth.auth import AuthError, requires_auth, token_cache
+
+import metrics
+
+SUGGEST_ITEMS = 10
+MAX_SUGGEST_ITEMS = 50
 
-ITEMS_PER_PAGE = 10
+# Rows fetched per round trip when streaming a whole table
+STREAM_BATCH_SIZE = 1000
+NDJSON_MIMETYPE = "application/x-ndjson"
 
 # Get token from env
 ASSISTANT_TOKEN = os.getenv("ASSISTANT_TOKEN", "")
@@ -48,24 +74,299 @@ DIRECTOR_TOKEN = os.getenv("DIRECTOR_TOKEN", "")
 PRODUCER_TOKEN = os.getenv("PRODUCER_TOKEN", "")
 
 
-def paginate_items(request, selection):
-    page = request.args.get("page", 1, type=int)
-    start = (page - 1) * ITEMS_PER_PAGE
-    end = start + ITEMS_PER_PAGE
+def accepts_ndjson(request):
+    return any(mimetype == NDJSON_MIMETYPE for mimetype, _ in request.accept_mimetypes)
+
+
+def wants_stream(request):
+    """Streaming is asked for with `Accept: application/x-ndjson` or ?stream=1"""
+    return request.args.get("stream", 0, type=int) == 1 or accepts_ndjson(request)
+
+
+def stream_items(request, query, model, key, fields=None):
+    """
+    Streams every row of the query matching the list filters, reading it
+    through a server-side cursor and writing each record as soon as it is
+    serialized. Rows are streamed in id order, after the ?after=<cursor>,
+    so an interrupted sync can resume.
+    """
+    id_column = model.__table__.c.id
+    query = query.filter(*list_filters(request, model))
+    after = request.args.get("after")
+    if after:
+        query = query.filter(id_column > decode_cursor(after))
+    rows = iter_rows(model, query.order_by(id_column), STREAM_BATCH_SIZE)
+
+    ndjson = accepts_ndjson(request)
+
+    def generate():
+        if ndjson:
+            for item in rows:
+                yield dumps(as_dict(item, fields)) + b"\n"
+            return
+
+        yield b'{"success": true, "%s": [' % key.encode("ascii")
+        separator = b""
+        for item in rows:
+            yield separator + dumps(as_dict(item, fields))
+            separator = b", "
+        yield b"]}"
+
+    mimetype = NDJSON_MIMETYPE if ndjson else "application/json"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def item_version(model, item_id):
+    """Reads the version column of one row, without loading the row"""
+    return db.session.query(model.version).filter(model.id == item_id).scalar()
 
-    items = [items.format() for item in selection]
-    current_items = items[start:end]
 
-    return current_items
+def items_by_id(model, ids):
+    """Loads the rows of `ids` with one query; returns {id: to_dict()}"""
+    if not ids:
+        return {}
+    return {item.id: item.to_dict() for item in get_rows(model, ids)}
+
+
+def item_etag(model, item_id, version):
+    return "{}-{}-{}".format(model.__tablename__.lower(), item_id, version)
+
+
+def list_etag(request, model, changes):
+    """
+    ETag of a list response: the table's change counter, plus a digest of
+    the query string and headers that shape the response.
+    """
+    variant = "|".join(
+        (
+            request.full_path,
+            request.headers.get("Content-Type", ""),
+            request.headers.get("Accept", ""),
+        )
+    )
+    digest = hashlib.sha1(variant.encode("utf-8")).hexdigest()[:16]
+    return "{}-{}-{}".format(model.__tablename__.lower(), changes, digest)
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def check_if_match(request, model, item_id, version):
+    """Aborts with 412 when If-Match is sent and isn't the row's current ETag"""
+    if request.if_match and not request.if_match.contains(
+        item_etag(model, item_id, version)
+    ):
+        abort(412)  # Precondition failed
+
+
+def if_match_versions(request, model, item_id):
+    """
+    The versions of the row If-Match allows: None for any (no header, or
+    *), else those of the row's ETags it lists
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    prefix = item_etag(model, item_id, "")
+    return [
+        int(tag[len(prefix) :])
+        for tag in request.if_match
+        if tag.startswith(prefix) and tag[len(prefix) :].isdigit()
+    ]
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
     app.secret_key = os.urandom(24)
-    moment = Moment(app)
+    # orjson-backed jsonify when orjson is installed
+    app.json_encoder = JSONEncoder
+    # BOOT_MODE=production leaves the schema to Alembic and boots without
+    # the imports no request needs
+    app.config["BOOT_MODE"] = os.getenv("BOOT_MODE", "development")
+    if app.config["BOOT_MODE"] != "production":
+        # No template uses its moment() helper: they load moment.js themselves
+        from flask_moment import Moment
+
+        moment = Moment(app)
     setup_db(app)
 
+    # SEARCH_ENGINE=memory answers searches from in-process trigram indexes
+    app.config["SEARCH_ENGINE"] = os.getenv("SEARCH_ENGINE", "database")
+    if app.config["SEARCH_ENGINE"] == "memory":
+        search_engine.init_app(app)
+    suggest_index.init_app(app)
+    response_cache.init_app(app)
+    cast_graph.init_app(app)
+    fragments.init_app(app)
+
+    # COUNT_STRATEGY=estimate reports Postgres' reltuples instead of the exact
+    # maintained counters, for very large tables
+    app.config["COUNT_STRATEGY"] = os.getenv("COUNT_STRATEGY", "exact")
+
+    def total_count(model):
+        return row_count(model, estimate=app.config["COUNT_STRATEGY"] == "estimate")
+
+    def set_total_count(response, model):
+        """
+        X-Total-Count of a list, from the table's row counter. Filtered lists
+        get none rather than a count of their own.
+        """
+        if not list_filters(request, model):
+            response.headers["X-Total-Count"] = str(total_count(model))
+
+    def include_tag(model):
+        """Change counters of the tables pulled in by ?include=, for ETags"""
+        return "".join(
+            "+{}.{}".format(name, change_count(related))
+            for name, related in sorted(requested_includes(request, model).items())
+        )
+
+    def list_cache_tag(model):
+        """ETag of a JSON or streamed list of `model`; HTML pages get none"""
+        if (
+            wants_stream(request)
+            or request.headers.get("Content-Type") == "application/json"
+        ):
+            changes = "{}{}".format(change_count(model), include_tag(model))
+            return list_etag(request, model, changes)
+        return None
+
+    def list_response(model, key, data, fields, next_cursor):
+        """
+        JSON page of a list: whole rows are written from their encoded
+        fragments, sparse or compound ones are encoded here
+        """
+        if fields is None and not requested_includes(request, model):
+            items = fragments.encode_list(model, data)
+        else:
+            items = [as_dict(item, fields) for item in data]
+            items = include_related(request, model, items)
+        return json_response({"success": True, key: items, "next_cursor": next_cursor})
+
+    def item_response(model, key, row):
+        """JSON of one row, from its encoded fragment unless ?include= is used"""
+        if requested_includes(request, model):
+            item = include_related(request, model, [row.to_dict()])[0]
+        else:
+            item = Encoded(fragments.encode(model, row))
+        return json_response({"success": True, key: item})
+
+    def patch_item(model, item_id):
+        """
+        Applies the fields of the JSON body to the row with one UPDATE;
+        returns the updated row
+        """
+        try:
+            values = read_patch(model, request.get_json(silent=True))
+        except ValueError:
+            abort(400)  # Bad request
+        versions = if_match_versions(request, model, item_id)
+
+        try:
+            row = update_row(model, item_id, values, versions)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Updating %s %s failed", model.__name__, item_id)
+            abort(500)  # Internal server error
+        finally:
+            db.session.close()
+
+        if row is None:
+            missing = versions is None or item_version(model, item_id) is None
+            abort(404 if missing else 412)  # Not found / Precondition failed
+        return row
+
+    def remove_item(model, item_id):
+        """Deletes the row with one DELETE; returns the deleted row"""
+        try:
+            item_id = int(item_id)
+        except ValueError:
+            abort(404)  # Not found
+        versions = if_match_versions(request, model, item_id)
+
+        try:
+            row = delete_row(model, item_id, versions)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Deleting %s %s failed", model.__name__, item_id)
+            abort(500)  # Internal server error
+        finally:
+            db.session.close()
+
+        if row is None:
+            missing = versions is None or item_version(model, item_id) is None
+            abort(404 if missing else 412)  # Not found / Precondition failed
+        return row
+
+    def list_fields(model):
+        """?fields= of a JSON or streamed list; the HTML pages show every field"""
+        if (
+            wants_stream(request)
+            or request.headers.get("Content-Type") == "application/json"
+        ):
+            return requested_fields(request, model)
+        return None
+
+    def run_search(model, search_term, limit, page):
+        if app.config["SEARCH_ENGINE"] == "memory":
+            limit = max(1, min(limit, MAX_SEARCH_ITEMS_PER_PAGE))
+            index = search_engine.get(model)
+            return index.search(search_term, limit, max(1, page))
+        return search(model, search_term, limit, page)
+
+    def bulk_create(model):
+        try:
+            ids, errors = bulk_insert(model, read_rows(request))
+        except ValueError:
+            abort(400)  # Bad request
+        except Exception:
+            app.logger.exception("Bulk create of %s failed", model.__name__)
+            abort(500)  # Internal server error
+
+        return jsonify(
+            {"success": True, "created": len(ids), "ids": ids, "errors": errors}
+        )
+
+    def update_cast(movie_id, operation):
+        """
+        Changes the movie's cast, checking If-Match in the recount's UPDATE;
+        returns the changed actor ids and the movie's actor_count
+        """
+        try:
+            actor_ids = read_actor_ids(request.get_json(silent=True))
+        except ValueError:
+            abort(400)  # Bad request
+        versions = if_match_versions(request, Movie, movie_id)
+
+        try:
+            changed, movie = operation(movie_id, actor_ids, versions)
+            if movie is None:
+                db.session.rollback()
+            else:
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Updating the cast of movie %s failed", movie_id)
+            abort(500)  # Internal server error
+        finally:
+            db.session.close()
+
+        if movie is None:
+            missing = versions is None or item_version(Movie, movie_id) is None
+            abort(404 if missing else 412)  # Not found / Precondition failed
+        return changed, movie.actor_count
+
+    def suggest(model):
+        prefix = request.args.get("q", "")
+        limit = request.args.get("limit", SUGGEST_ITEMS, type=int)
+        limit = max(1, min(limit, MAX_SUGGEST_ITEMS))
+        return suggest_index.get(model).suggest(prefix, limit)
+
     # Set up CORS. Allow '*' for origins.
     CORS(app)
 
@@ -73,11 +374,13 @@ def create_app(test_config=None):
     @app.after_request
     def after_request(response):
         response.headers.add(
-            "Access-Control-Allow-Headers", "Content-Type, Authorization, true"
+            "Access-Control-Allow-Headers",
+            "Content-Type, Authorization, If-Match, If-None-Match, true",
         )
         response.headers.add(
             "Access-Control-Allow-Headers", "GET, POST, PATCH, DELETE, OPTIONS"
         )
+        response.headers.add("Access-Control-Expose-Headers", "ETag, X-Total-Count")
         return response
 
     # ----------------------------------------------------------------------------#
@@ -93,24 +396,52 @@ def create_app(test_config=None):
     def index():
         return render_template("pages/home.html")
 
+    # In-process counters (caches, pools, indexes)
+    # ----------------------------------------------------------------
+    metrics.register("token_cache", token_cache.stats)
+
+    @app.route("/metrics")
+    def show_metrics():
+        return jsonify(metrics.snapshot())
+
     # Get actors
     # ----------------------------------------------------------------
     @app.route("/actors")
     @requires_auth("get:actors")
+    @response_cache.cached(Actor, related=(Movie,))
     def actors(jwt):
-        data = Actor.query.order_by(Actor.id).all()
+        etag = list_cache_tag(Actor)
+        if etag and request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        fields = list_fields(Actor)
+        query = list_query(request, Actor, fields)
+
+        if wants_stream(request):
+            response = stream_items(request, query, Actor, "actors", fields)
+            set_total_count(response, Actor)
+            response.set_etag(etag)
+            return response
+
+        data, next_cursor = paginate_items(request, query, Actor)
 
         if request.headers.get("Content-Type") == "application/json":
-            return jsonify(
-                {"success": True, "actors": [actor.to_dict() for actor in data]}
-            )
-        return render_template("pages/actors.html", actors=data)
+            response = list_response(Actor, "actors", data, fields, next_cursor)
+            set_total_count(response, Actor)
+            response.set_etag(etag)
+            return response
+        return render_template(
+            "pages/actors.html", actors=data, next_cursor=next_cursor
+        )
 
     # Search for an actor
     # ----------------------------------------------------------------
     @app.route("/actors/search", methods=["POST"])
+    @replicas.read_only
     @requires_auth("post:actors")
+    @response_cache.cached(Actor, related=(Movie,))
     def search_actors(jwt):
+        body = None
         if request.headers.get("Content-Type") == "application/json":
             body = request.get_json()
             search_term = body.get("search_term", None)
@@ -118,24 +449,28 @@ def create_app(test_config=None):
             search_term = request.form.get("search_term", "").strip()
 
         if search_term:
-            results = Actor.query.filter(
-                Actor.name.ilike("%{}%".format(search_term))
-            ).all()
+            limit, page = search_page(request, body)
+            results, total = run_search(Actor, search_term, limit, page)
 
             actor_list = []
             for actor in results:
                 actor_list.append(
-                    {"id": actor.id, "name": actor.name, "num_movies": None}
+                    {
+                        "id": actor["id"],
+                        "name": actor["name"],
+                        "num_movies": actor["movie_count"],
+                    }
                 )
 
-            response = {"count": len(results), "data": actor_list}
+            response = {"count": total, "data": actor_list}
 
             if request.headers.get("Content-Type") == "application/json":
                 return jsonify(
                     {
                         "success": True,
-                        "total": len(results),
-                        "actors": [actor.to_dict() for actor in results],
+                        "total": total,
+                        "page": page,
+                        "actors": include_related(request, Actor, results),
                     }
                 )
 
@@ -147,36 +482,96 @@ def create_app(test_config=None):
         else:
             abort(404)  # Actor searching not found
 
+    # Autocomplete actor names
+    # ----------------------------------------------------------------
+    @app.route("/actors/suggest")
+    @requires_auth("get:actors")
+    def suggest_actors(jwt):
+        return jsonify({"success": True, "actors": suggest(Actor)})
+
     # Shows the actor page with the given actor_id
     # ----------------------------------------------------------------
     @app.route("/actors/<int:actor_id>")
     @requires_auth("get:actors")
+    @response_cache.cached(Actor, id_arg="actor_id", related=(Movie,))
     def show_actor(jwt, actor_id):
+        if request.headers.get("Content-Type") == "application/json":
+            included = include_tag(Actor)
+            version = item_version(Actor, actor_id)
+            etag = item_etag(Actor, actor_id, "{}{}".format(version, included))
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+
         try:
-            actor = Actor.query.get(actor_id)
-            data = actor.to_dict()
+            actor = get_row(Actor, actor_id)
 
-            # movies = list(Actor.movies)
-            # movie_count = len(movies)
-            # data["movie_count"] = movie_count
             if request.headers.get("Content-Type") == "application/json":
-                return jsonify(
-                    {
-                        "success": True,
-                        "actor": data,
-                    }
-                )
+                response = item_response(Actor, "actor", actor)
+                version = "{}{}".format(actor.version, included)
+                response.set_etag(item_etag(Actor, actor.id, version))
+                return response
             # @todo: refactor the page
-            return render_template("pages/show_actor.html", actor=data)
+            return render_template("pages/show_actor.html", actor=actor.to_dict())
         except:
             abort(422)  # Unprocessable
 
+    # Actors who played in a movie with the given actor_id
+    # ----------------------------------------------------------------
+    @app.route("/actors/<int:actor_id>/costars")
+    @requires_auth("get:actors")
+    def actor_costars(jwt, actor_id):
+        if item_version(Actor, actor_id) is None:
+            abort(404)  # Actor not found
+
+        limit = request.args.get("limit", ITEMS_PER_PAGE, type=int)
+        limit = max(1, min(limit, MAX_ITEMS_PER_PAGE))
+        costars = cast_graph.costars(actor_id)
+        actors = items_by_id(Actor, [costar_id for costar_id, _ in costars[:limit]])
+        return jsonify(
+            {
+                "success": True,
+                "actor_id": actor_id,
+                "total": len(costars),
+                "costars": [
+                    dict(actors[costar_id], shared_movies=shared)
+                    for costar_id, shared in costars[:limit]
+                    if costar_id in actors
+                ],
+            }
+        )
+
+    # Shortest chain of co-stars between two actors
+    # ----------------------------------------------------------------
+    @app.route("/actors/<int:actor_id>/path/<int:other_id>")
+    @requires_auth("get:actors")
+    def actor_path(jwt, actor_id, other_id):
+        for item_id in (actor_id, other_id):
+            if item_version(Actor, item_id) is None:
+                abort(404)  # Actor not found
+
+        path = cast_graph.path(actor_id, other_id)
+        if path is None:
+            abort(404)  # Not connected
+
+        actors = items_by_id(Actor, path[::2])
+        movies = items_by_id(Movie, path[1::2])
+        return jsonify(
+            {
+                "success": True,
+                "degrees": len(path) // 2,
+                "actors": [actors.get(item_id) for item_id in path[::2]],
+                "movies": [movies.get(item_id) for item_id in path[1::2]],
+            }
+        )
+
     # Create Actor
     # ----------------------------------------------------------------
     @app.route("/actors/create", methods=["GET"])
     @requires_auth("post:actors")
     def create_actor_form():
         # @todo: refactor
+        from forms import ActorForm
+
         form = ActorForm(request.form, meta={"csrf": False})
         return render_template("forms/new_actor.html", form=form)
 
@@ -191,6 +586,8 @@ def create_app(test_config=None):
             actor.gender = body.get("gender", None)
             actor.image_link = body.get("image_link", None)
         else:
+            from forms import ActorForm
+
             form = ActorForm(request.form, meta={"csrf": False})
             if not form.validate():
                 message = []
@@ -208,9 +605,8 @@ def create_app(test_config=None):
             actor.insert()
             flash("Actor: {0} created successfully!".format(actor.name))
 
-            # Get list of actors after insert
-            selection = Actor.query.all()
             data = actor.to_dict()
+            total = total_count(Actor)
 
         except Exception as err:
             db.session.rollback()
@@ -229,40 +625,46 @@ def create_app(test_config=None):
                 {
                     "success": True,
                     "actor": data,
-                    "total": len(selection),
+                    "total": total,
                 }
             )
         return render_template("pages/home.html")
 
+    # Bulk create actors from a JSON array or NDJSON body
+    # ----------------------------------------------------------------
+    @app.route("/actors/bulk", methods=["POST"])
+    @requires_auth("post:actors")
+    def bulk_create_actors(jwt):
+        return bulk_create(Actor)
+
     # Delete actor
     # ----------------------------------------------------------------
     @app.route("/actors/<actor_id>", methods=["DELETE"])
     @requires_auth("delete:actors")
     def delete_actor(jwt, actor_id):
-        try:
-            actor = Actor.query.get(actor_id)
-            actor_name = actor.name
+        actor = remove_item(Actor, actor_id)
+        flash("Successfully removed actor {0}.".format(actor.name))
+        return jsonify(
+            {"success": True, "actor_id": actor_id, "actor": actor.to_dict()}
+        )
 
-            # Delete the selected actor
-            actor.delete()
-            flash("Successfully removed actor {0}.".format(actor_name))
-        except Exception as err:
-            db.session.rollback()
-            flash(
-                "An error occurred removing the Actor: {0}. Error: {1}".format(
-                    actor_name, err
-                )
-            )
-            abort(500)  # Internal server error
-        finally:
-            db.session.close()
-        return jsonify({"success": True, "actor_id": actor_id})
+    # Partially update actor
+    # ----------------------------------------------------------------
+    @app.route("/actors/<int:actor_id>", methods=["PATCH"])
+    @requires_auth("patch:actors")
+    def patch_actor(jwt, actor_id):
+        actor = patch_item(Actor, actor_id)
+        response = item_response(Actor, "actor", actor)
+        response.set_etag(item_etag(Actor, actor.id, actor.version))
+        return response
 
     # Update actor
     # ----------------------------------------------------------------
     @app.route("/actors/<int:actor_id>/edit", methods=["GET"])
     @requires_auth("patch:actors")
     def edit_actor(actor_id):
+        from forms import ActorForm
+
         form = ActorForm(request.form)
         actor = Actor.query.get(actor_id)
         actor = actor.to_dict()
@@ -272,31 +674,41 @@ def create_app(test_config=None):
     @app.route("/actors/<int:actor_id>/edit", methods=["POST"])
     @requires_auth("patch:actors")
     def edit_actor_submission(jwt, actor_id):
-        actor = Actor.query.get(actor_id)
         if request.headers.get("Content-Type") == "application/json":
-            body = request.get_json()
-            actor.name = body.get("name", None)
-            actor.age = body.get("age", None)
-            actor.gender = body.get("gender", None)
-            actor.image_link = body.get("image_link", None)
-        else:
-            form = ActorForm(request.form, meta={"csrf": False})
-            if not form.validate():
-                message = []
-                for field, err in form.errors.items():
-                    message.append(field + " - " + "|".join(err))
-                flash("Errors " + str(message))
-                return redirect(url_for("edit_actor_submission", actor_id=actor_id))
+            # A partial update, as PATCH /actors/<id>
+            actor = patch_item(Actor, actor_id)
+            flash("Actor: {0} updated successfully".format(actor.name))
+            response = jsonify({"success": True, "actor": actor.to_dict()})
+            response.set_etag(item_etag(Actor, actor.id, actor.version))
+            return response
 
-            actor.name = form.name.data
-            actor.age = form.age.data
-            actor.gender = form.gender.data
-            actor.image_link = form.image_link.data
+        actor = Actor.query.get(actor_id)
+        if actor is None:
+            abort(404)  # Actor not found
+        check_if_match(request, Actor, actor.id, actor.version)
+        from forms import ActorForm
+
+        form = ActorForm(request.form, meta={"csrf": False})
+        if not form.validate():
+            message = []
+            for field, err in form.errors.items():
+                message.append(field + " - " + "|".join(err))
+            flash("Errors " + str(message))
+            return redirect(url_for("edit_actor_submission", actor_id=actor_id))
+
+        actor.name = form.name.data
+        actor.age = form.age.data
+        actor.gender = form.gender.data
+        actor.image_link = form.image_link.data
 
         try:
             # Update actor info to database
             actor.update()
             flash("Actor: {0} updated successfully".format(actor.name))
+        except StaleDataError:
+            # Changed by someone else since it was read
+            db.session.rollback()
+            abort(412)  # Precondition failed
         except Exception as err:
             db.session.rollback()
             print(sys.exc_info())
@@ -309,33 +721,46 @@ def create_app(test_config=None):
         finally:
             db.session.close()
 
-        if request.headers.get("Content-Type") == "application/json":
-            return jsonify(
-                {
-                    "success": True,
-                    "actor": actor.to_dict(),
-                }
-            )
         return redirect(url_for("show_actor", actor_id=actor_id))
 
     # Get Movies
     # ----------------------------------------------------------------
     @app.route("/movies")
     @requires_auth("get:movies")
+    @response_cache.cached(Movie, related=(Actor,))
     def movies(jwt):
-        data = Movie.query.order_by(Movie.id).all()
+        etag = list_cache_tag(Movie)
+        if etag and request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+        fields = list_fields(Movie)
+        query = list_query(request, Movie, fields)
+
+        if wants_stream(request):
+            response = stream_items(request, query, Movie, "movies", fields)
+            set_total_count(response, Movie)
+            response.set_etag(etag)
+            return response
+
+        data, next_cursor = paginate_items(request, query, Movie)
 
         if request.headers.get("Content-Type") == "application/json":
-            return jsonify(
-                {"success": True, "movies": [movie.to_dict() for movie in data]}
-            )
-        return render_template("pages/movies.html", movies=data)
+            response = list_response(Movie, "movies", data, fields, next_cursor)
+            set_total_count(response, Movie)
+            response.set_etag(etag)
+            return response
+        return render_template(
+            "pages/movies.html", movies=data, next_cursor=next_cursor
+        )
 
     # Search for an movie
     # ----------------------------------------------------------------
     @app.route("/movies/search", methods=["POST"])
+    @replicas.read_only
     @requires_auth("post:movies")
+    @response_cache.cached(Movie, related=(Actor,))
     def search_movies(jwt):
+        body = None
         if request.headers.get("Content-Type") == "application/json":
             body = request.get_json()
             search_term = body.get("search_term", None)
@@ -343,30 +768,30 @@ def create_app(test_config=None):
             search_term = request.form.get("search_term", "").strip()
 
         if search_term:
-            results = Movie.query.filter(
-                Movie.title.ilike("%{}%".format(search_term))
-            ).all()
+            limit, page = search_page(request, body)
+            results, total = run_search(Movie, search_term, limit, page)
 
             movie_list = []
             for movie in results:
                 movie_list.append(
                     {
-                        "id": movie.id,
-                        "title": movie.title,
-                        "release_date": movie.release_date,
-                        "image_link": movie.image_link,
-                        "actors": None,  # @todo
+                        "id": movie["id"],
+                        "title": movie["title"],
+                        "release_date": movie["release_date"],
+                        "image_link": movie["image_link"],
+                        "num_actors": movie["actor_count"],
                     }
                 )
 
-            response = {"count": len(movie_list), "data": movie_list}
+            response = {"count": total, "data": movie_list}
 
             if request.headers.get("Content-Type") == "application/json":
                 return jsonify(
                     {
                         "success": True,
-                        "total": len(results),
-                        "movies": [movie.to_dict() for movie in results],
+                        "total": total,
+                        "page": page,
+                        "movies": include_related(request, Movie, results),
                     }
                 )
             return render_template(
@@ -377,23 +802,35 @@ def create_app(test_config=None):
         else:
             abort(404)  # Not found
 
+    # Autocomplete movie titles
+    # ----------------------------------------------------------------
+    @app.route("/movies/suggest")
+    @requires_auth("get:movies")
+    def suggest_movies(jwt):
+        return jsonify({"success": True, "movies": suggest(Movie)})
+
     # Show movie by ID
     # ----------------------------------------------------------------
     @app.route("/movies/<int:movie_id>")
     @requires_auth("get:movies")
+    @response_cache.cached(Movie, id_arg="movie_id", related=(Actor,))
     def show_movie(jwt, movie_id):
+        if request.headers.get("Content-Type") == "application/json":
+            included = include_tag(Movie)
+            version = item_version(Movie, movie_id)
+            etag = item_etag(Movie, movie_id, "{}{}".format(version, included))
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+
         try:
-            movie = Movie.query.get(movie_id)
-            data = movie.to_dict()
+            movie = get_row(Movie, movie_id)
 
             if request.headers.get("Content-Type") == "application/json":
-                return jsonify(
-                    {
-                        "success": True,
-                        "movie": data,
-                    }
-                )
-            return render_template("pages/show_movie.html", movie=data)
+                response = item_response(Movie, "movie", movie)
+                version = "{}{}".format(movie.version, included)
+                response.set_etag(item_etag(Movie, movie.id, version))
+                return response
+            return render_template("pages/show_movie.html", movie=movie.to_dict())
         except:
             abort(422)  # Unprocessable
 
@@ -402,6 +839,8 @@ def create_app(test_config=None):
     @app.route("/movies/create", methods=["GET"])
     @requires_auth("post:movies")
     def create_movie_form():
+        from forms import MovieForm
+
         form = MovieForm(request.form, meta={"csrf": False})
         return render_template("forms/new_movie.html", form=form)
 
@@ -415,6 +854,8 @@ def create_app(test_config=None):
             movie.release_date = body.get("release_date", None)
             movie.image_link = body.get("image_link", None)
         else:
+            from forms import MovieForm
+
             form = MovieForm(request.form, meta={"csrf": False})
 
             if not form.validate():
@@ -432,8 +873,8 @@ def create_app(test_config=None):
             movie.insert()
             flash("Movie: {0} created successfully".format(movie.title))
 
-            # Get list of movies after insert
-            selection = Movie.query.all()
+            data = movie.to_dict()
+            total = total_count(Movie)
         except Exception as err:
             db.session.rollback()
             print(sys.exc_info())
@@ -447,39 +888,72 @@ def create_app(test_config=None):
             db.session.close()
 
         if request.headers.get("Content-Type") == "application/json":
-            return jsonify(
-                {"success": True, "movie": [movie.to_dict()], "total": len(selection)}
-            )
-        return render_template("pages/home.html")  # Delete movie
+            return jsonify({"success": True, "movie": [data], "total": total})
+        return render_template("pages/home.html")
+
+    # Bulk create movies from a JSON array or NDJSON body
+    # ----------------------------------------------------------------
+    @app.route("/movies/bulk", methods=["POST"])
+    @requires_auth("post:movies")
+    def bulk_create_movies(jwt):
+        return bulk_create(Movie)
+
+    # Assign / unassign the actors of a movie's cast in one transaction
+    # ----------------------------------------------------------------
+    @app.route("/movies/<int:movie_id>/cast", methods=["POST"])
+    @requires_auth("patch:movies")
+    def assign_movie_cast(jwt, movie_id):
+        added, actor_count = update_cast(movie_id, assign_actors)
+        return jsonify(
+            {
+                "success": True,
+                "movie_id": movie_id,
+                "added": added,
+                "actor_count": actor_count,
+            }
+        )
+
+    @app.route("/movies/<int:movie_id>/cast", methods=["DELETE"])
+    @requires_auth("patch:movies")
+    def unassign_movie_cast(jwt, movie_id):
+        removed, actor_count = update_cast(movie_id, unassign_actors)
+        return jsonify(
+            {
+                "success": True,
+                "movie_id": movie_id,
+                "removed": removed,
+                "actor_count": actor_count,
+            }
+        )
 
+    # Delete movie
     # ----------------------------------------------------------------
     @app.route("/movies/<movie_id>", methods=["DELETE"])
     @requires_auth("delete:movies")
     def delete_movie(jwt, movie_id):
-        try:
-            movie = Movie.query.get(movie_id)
-            movie_title = movie.title
+        movie = remove_item(Movie, movie_id)
+        flash("Successfully removed movie {0}.".format(movie.title))
+        return jsonify(
+            {"success": True, "movie_id": movie_id, "movie": movie.to_dict()}
+        )
 
-            # Delete selected movie from database
-            movie.delete()
-            flash("Successfully removed movie {0}.".format(movie_title))
-        except Exception as err:
-            db.session.rollback()
-            flash(
-                "An error occurred removing the Movie: {0}. Error: {1}".format(
-                    movie_title, err
-                )
-            )
-            abort(500)  # Internal server error
-        finally:
-            db.session.close()
-        return jsonify({"success": True, "movie_id": movie_id})
+    # Partially update movie
+    # ----------------------------------------------------------------
+    @app.route("/movies/<int:movie_id>", methods=["PATCH"])
+    @requires_auth("patch:movies")
+    def patch_movie(jwt, movie_id):
+        movie = patch_item(Movie, movie_id)
+        response = item_response(Movie, "movie", movie)
+        response.set_etag(item_etag(Movie, movie.id, movie.version))
+        return response
 
     # Update movie
     # ----------------------------------------------------------------
     @app.route("/movies/<int:movie_id>/edit", methods=["GET"])
     @requires_auth("patch:movies")
     def edit_movie(movie_id):
+        from forms import MovieForm
+
         form = MovieForm(request.form)
         movie = Movie.query.get(movie_id)
         movie = movie.to_dict()
@@ -489,28 +963,39 @@ def create_app(test_config=None):
     @app.route("/movies/<int:movie_id>/edit", methods=["POST"])
     @requires_auth("patch:movies")
     def edit_movie_submission(jwt, movie_id):
-        movie = Movie.query.get(movie_id)
         if request.headers.get("Content-Type") == "application/json":
-            body = request.get_json()
-            movie.title = body.get("title", None)
-            movie.release_date = body.get("release_date", None)
-            movie.image_link = body.get("image_link", None)
-        else:
-            form = MovieForm(request.form, meta={"csrf": False})
-            if not form.validate():
-                message = []
-                for field, err in form.errors.items():
-                    message.append(field + " - " + "|".join(err))
-                flash("Errors " + str(message))
-                return redirect(url_for("edit_movie_submission", movie_id=movie_id))
+            # A partial update, as PATCH /movies/<id>
+            movie = patch_item(Movie, movie_id)
+            flash("Movie: {0} updated successfully".format(movie.title))
+            response = jsonify({"success": True, "movie": [movie.to_dict()]})
+            response.set_etag(item_etag(Movie, movie.id, movie.version))
+            return response
 
-            movie.title = form.title.data
-            movie.release_date = form.release_date.data
-            movie.image_link = form.image_link.data
+        movie = Movie.query.get(movie_id)
+        if movie is None:
+            abort(404)  # Movie not found
+        check_if_match(request, Movie, movie.id, movie.version)
+        from forms import MovieForm
+
+        form = MovieForm(request.form, meta={"csrf": False})
+        if not form.validate():
+            message = []
+            for field, err in form.errors.items():
+                message.append(field + " - " + "|".join(err))
+            flash("Errors " + str(message))
+            return redirect(url_for("edit_movie_submission", movie_id=movie_id))
+
+        movie.title = form.title.data
+        movie.release_date = form.release_date.data
+        movie.image_link = form.image_link.data
         try:
             # Update movie info to database
             movie.update()
             flash("Movie: {0} updated successfully".format(movie.title))
+        except StaleDataError:
+            # Changed by someone else since it was read
+            db.session.rollback()
+            abort(412)  # Precondition failed
         except Exception as err:
             db.session.rollback()
             print(sys.exc_info())
@@ -523,8 +1008,6 @@ def create_app(test_config=None):
         finally:
             db.session.close()
 
-        if request.headers.get("Content-Type") == "application/json":
-            return jsonify({"success": True, "movie": [movie.to_dict()]})
         return redirect(url_for("show_movie", movie_id=movie_id))
 
     # Error Handlers
@@ -556,6 +1039,13 @@ def create_app(test_config=None):
             405,
         )
 
+    @app.errorhandler(412)
+    def precondition_failed(error):
+        return (
+            jsonify({"success": False, "error": 412, "message": "precondition failed"}),
+            412,
+        )
+
     @app.errorhandler(422)
     def unprocessable(error):
         return (
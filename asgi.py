@@ -0,0 +1,287 @@
+import os
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.responses import Response
+from starlette.routing import Route
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_etags, quote_etag
+
+import metrics
+from auth.auth import (
+    AuthError,
+    check_permissions,
+    token_cache,
+    token_from_header,
+    verify_and_cache,
+)
+from fields import as_dict, requested_fields
+from listing import list_filters, list_query, next_page, page_statement, search_page
+from models import database_path, Actor, Movie, TableCount
+from pools import pool_options, pool_stats
+from readmodels import make_rows, row_statement
+from search import search_statements
+from serialization import Encoded, encode_document, fragments
+
+"""
+asgi
+    asyncio variant of the JSON read endpoints, for many slow clients per
+    process
+
+        uvicorn --factory asgi:create_asgi_app
+
+    GET /actors, /movies, /actors/<id>, /movies/<id> and POST
+    /actors/search, /movies/search answer like the JSON API of app.py: same
+    permissions, query strings, bodies and errors. It runs on Starlette and
+    SQLAlchemy's asyncio engine, with asyncpg for Postgres and aiosqlite for
+    SQLite (ASYNC_DATABASE_URL, else DATABASE_URL with the async driver).
+    While a request waits on the database, or on the verification of a
+    token that isn't cached yet (run in a thread, as it may fetch the JWKS),
+    the event loop serves the others. Writes, HTML pages, ?include= and
+    streamed lists stay on the Flask app.
+"""
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+# Messages of the Flask app's error handlers
+ERROR_MESSAGES = {
+    400: "bad request",
+    401: "unathorized",
+    404: "resource not found",
+    405: "method not allowed",
+    412: "precondition failed",
+    422: "unprocessable",
+    500: "internal server error",
+}
+
+# What the listing and fields helpers read of a request
+QueryRequest = namedtuple("QueryRequest", "args")
+
+
+def async_database_url(url):
+    """`url` with the asyncio driver of its database"""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def query_request(request):
+    return QueryRequest(MultiDict(request.query_params.multi_items()))
+
+
+def json_document(document, status_code=200):
+    return Response(
+        encode_document(document),
+        status_code=status_code,
+        media_type="application/json",
+    )
+
+
+def error_response(status_code):
+    message = ERROR_MESSAGES.get(status_code, "error")
+    return json_document(
+        {"success": False, "error": status_code, "message": message}, status_code
+    )
+
+
+def requires_auth(permission=""):
+    """auth.auth.requires_auth for the async views, which get the payload"""
+
+    def requires_auth_decorator(f):
+        @wraps(f)
+        async def wrapper(request):
+            token = token_from_header(request.headers.get("Authorization"))
+            verified = token_cache.get(token)
+            if verified is None:
+                # Signature checks and JWKS fetches run off the event loop
+                verified = await run_in_threadpool(verify_and_cache, token)
+            payload, permissions = verified
+            check_permissions(permission, payload, permissions)
+            return await f(request, payload)
+
+        return wrapper
+
+    return requires_auth_decorator
+
+
+def create_asgi_app(database_url=None):
+    url = async_database_url(
+        database_url or os.getenv("ASYNC_DATABASE_URL") or database_path
+    )
+    options = {}
+    if url.get_backend_name() != "sqlite":
+        # Sized per DB_POOL_* like the Flask app's pools
+        options = pool_options({}, url.drivername)
+    engine = create_async_engine(url, **options)
+    metrics.register(
+        "async_db_pool", lambda: pool_stats({"primary": engine.sync_engine})
+    )
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await engine.dispose()
+
+    async def row_total(connection, model):
+        """The table's row counter, or a count while it isn't seeded"""
+        total = (
+            await connection.execute(
+                select(TableCount.row_count).where(
+                    TableCount.table_name == model.__tablename__
+                )
+            )
+        ).scalar()
+        if total is None:
+            total = (
+                await connection.execute(
+                    select(func.count()).select_from(model.__table__)
+                )
+            ).scalar()
+        return total
+
+    # ----------------------------------------------------------------------------#
+    # Controllers.
+    # ----------------------------------------------------------------------------#
+
+    async def list_items(request, model, key):
+        """A page of a list, as the JSON of app.py's list endpoints"""
+        args = query_request(request)
+        if "include" in args.args or args.args.get("stream"):
+            return error_response(400)  # Bad request: served by the Flask app only
+        fields = requested_fields(args, model)
+        statement, paging = page_statement(args, list_query(args, model, fields), model)
+
+        async with engine.connect() as connection:
+            items = make_rows(model, await connection.execute(statement))
+            total = None
+            if not list_filters(args, model):
+                total = await row_total(connection, model)
+
+        items, next_cursor = next_page(items, paging)
+        if fields is None:
+            data = fragments.encode_list(model, items)
+        else:
+            data = [as_dict(item, fields) for item in items]
+        response = json_document(
+            {"success": True, key: data, "next_cursor": next_cursor}
+        )
+        if total is not None:
+            response.headers["X-Total-Count"] = str(total)
+        return response
+
+    async def show_item(request, model, key):
+        item_id = request.path_params["item_id"]
+        async with engine.connect() as connection:
+            rows = make_rows(
+                model, await connection.execute(row_statement(model, item_id))
+            )
+        if not rows:
+            return error_response(422)  # Unprocessable, as app.py answers it
+        row = rows[0]
+        etag = "{}-{}-{}".format(model.__tablename__.lower(), row.id, row.version)
+        if parse_etags(request.headers.get("If-None-Match")).contains_weak(etag):
+            return Response(status_code=304, headers={"ETag": quote_etag(etag)})
+        response = json_document(
+            {"success": True, key: Encoded(fragments.encode(model, row))}
+        )
+        response.headers["ETag"] = quote_etag(etag)
+        return response
+
+    async def search_items(request, model, key):
+        try:
+            body = await request.json()
+        except ValueError:
+            return error_response(400)  # Bad request
+        if not isinstance(body, dict) or not body.get("search_term"):
+            return error_response(404)  # Searching not found
+        limit, page = search_page(query_request(request), body)
+
+        async with engine.connect() as connection:
+            # The statements depend on the database's extensions, probed once
+            page_rows, counted = await connection.run_sync(
+                search_statements, model, body["search_term"], limit, page
+            )
+            total = (await connection.execute(counted)).scalar()
+            rows = make_rows(model, await connection.execute(page_rows))
+
+        return json_document(
+            {
+                "success": True,
+                "total": total,
+                "page": page,
+                key: [row.to_dict() for row in rows],
+            }
+        )
+
+    @requires_auth("get:actors")
+    async def actors(request, jwt):
+        return await list_items(request, Actor, "actors")
+
+    @requires_auth("get:actors")
+    async def show_actor(request, jwt):
+        return await show_item(request, Actor, "actor")
+
+    @requires_auth("post:actors")
+    async def search_actors(request, jwt):
+        return await search_items(request, Actor, "actors")
+
+    @requires_auth("get:movies")
+    async def movies(request, jwt):
+        return await list_items(request, Movie, "movies")
+
+    @requires_auth("get:movies")
+    async def show_movie(request, jwt):
+        return await show_item(request, Movie, "movie")
+
+    @requires_auth("post:movies")
+    async def search_movies(request, jwt):
+        return await search_items(request, Movie, "movies")
+
+    async def show_metrics(request):
+        return json_document(metrics.snapshot())
+
+    # ----------------------------------------------------------------------------#
+    # Error Handlers.
+    # ----------------------------------------------------------------------------#
+
+    async def http_error(request, error):
+        # werkzeug's, raised by abort() in the shared helpers, or Starlette's
+        return error_response(getattr(error, "code", None) or error.status_code)
+
+    async def authorization_error(request, error):
+        return json_document(
+            {"success": False, "error": error.status_code, "message": error.error},
+            error.status_code,
+        )
+
+    async def server_error(request, error):
+        return error_response(500)
+
+    app = Starlette(
+        routes=[
+            Route("/actors", actors),
+            Route("/actors/search", search_actors, methods=["POST"]),
+            Route("/actors/{item_id:int}", show_actor),
+            Route("/movies", movies),
+            Route("/movies/search", search_movies, methods=["POST"]),
+            Route("/movies/{item_id:int}", show_movie),
+            Route("/metrics", show_metrics),
+        ],
+        exception_handlers={
+            HTTPException: http_error,
+            StarletteHTTPException: http_error,
+            AuthError: authorization_error,
+            500: server_error,
+        },
+        lifespan=lifespan,
+    )
+    # Drops the cached JSON of rows written through this process
+    fragments.init_app(app)
+    return app
@@ -4,12 +4,26 @@ import json
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
+from auth.jwks import JWKSStore, JWKSUnavailableError
+from auth.token_cache import TokenCache
 
 AUTH0_DOMAIN = os.environ.get("AUTH0_DOMAIN")
 ALGORITHMS = os.environ.get("ALGORITHMS")
 API_AUDIENCE = os.environ.get("API_AUDIENCE")
 
+# Signing keys are fetched once per process and refreshed in the background.
+# Set JWKS_FILE to verify tokens against a local JWKS document instead.
+jwks_store = JWKSStore(
+    url=f"https://{AUTH0_DOMAIN}/.well-known/jwks.json",
+    path=os.environ.get("JWKS_FILE"),
+    ttl=int(os.environ.get("JWKS_TTL", 600)),
+    algorithm=ALGORITHMS,
+)
+
+# Verified payloads, so a repeated bearer token skips signature verification.
+token_cache = TokenCache(maxsize=int(os.environ.get("TOKEN_CACHE_SIZE", 1024)))
+jwks_store.add_rotation_listener(token_cache.evict_kids)
+
 ## AuthError Exception
 """
 AuthError Exception
@@ -26,7 +40,11 @@ class AuthError(Exception):
 ## Auth Header
 def get_token_auth_header():
     """Obtains the Access Token from the Authorization Header"""
-    auth = request.headers.get("Authorization", None)
+    return token_from_header(request.headers.get("Authorization", None))
+
+
+def token_from_header(auth):
+    """The bearer token of an Authorization header value"""
     if not auth:
         raise AuthError(
             {
@@ -64,17 +82,19 @@ def get_token_auth_header():
     return token
 
 
-def check_permissions(permission, payload):
-    if "permissions" not in payload:
-        raise AuthError(
-            {
-                "code": "invalid_claims",
-                "description": "Permissions not included in JWT.",
-            },
-            400,
-        )
+def check_permissions(permission, payload, permissions=None):
+    if permissions is None:
+        if "permissions" not in payload:
+            raise AuthError(
+                {
+                    "code": "invalid_claims",
+                    "description": "Permissions not included in JWT.",
+                },
+                400,
+            )
+        permissions = payload["permissions"]
 
-    if permission not in payload["permissions"]:
+    if permission not in permissions:
         raise AuthError(
             {"code": "unauthorized", "description": "Permission not found."}, 403
         )
@@ -83,25 +103,24 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f"https://{AUTH0_DOMAIN}/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
     if "kid" not in unverified_header:
         raise AuthError(
             {"code": "invalid_header", "description": "Authorization malformed."}, 401
         )
 
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"],
-            }
-    if rsa_key:
+    try:
+        rsa_key = jwks_store.get_key(unverified_header["kid"])
+    except JWKSUnavailableError:
+        raise AuthError(
+            {
+                "code": "jwks_unavailable",
+                "description": "Unable to fetch the signing keys.",
+            },
+            503,
+        )
+
+    if rsa_key is not None:
         try:
             payload = jwt.decode(
                 token,
@@ -143,13 +162,28 @@ def verify_decode_jwt(token):
     )
 
 
+def verify_and_cache(token):
+    """Verifies a token that isn't cached; returns (payload, permissions)"""
+    payload = verify_decode_jwt(token)
+    kid = jwt.get_unverified_header(token)["kid"]
+    return payload, token_cache.put(token, kid, payload)
+
+
+def verify_token(token):
+    """Returns (payload, permissions), verifying the token only on a cache miss"""
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
+    return verify_and_cache(token)
+
+
 def requires_auth(permission=""):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            payload, permissions = verify_token(token)
+            check_permissions(permission, payload, permissions)
             return f(payload, *args, **kwargs)
 
         return wrapper
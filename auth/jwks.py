@@ -0,0 +1,182 @@
+import json
+import threading
+import time
+from urllib.request import urlopen
+
+from jose import jwk
+
+
+class JWKSUnavailableError(Exception):
+    """Raised when no signing keys can be obtained from the issuer"""
+
+
+"""
+JWKSStore
+    process-wide cache of the issuer's JSON Web Key Set
+
+    - keys are indexed by `kid` and the public key objects are built once
+    - the set is refetched after `ttl` seconds; a stale set is served for up
+      to `stale_ttl` more seconds while a background thread refreshes it
+    - an unknown `kid` forces one refetch, at most every `min_refetch_interval`
+    - after `failure_threshold` consecutive fetch errors the circuit opens and
+      the issuer is left alone for `reset_timeout` seconds
+    - when `path` is given the set is read from a local JWKS file instead
+    - rotation listeners are told which kids dropped out of the set
+"""
+
+
+class JWKSStore:
+    def __init__(
+        self,
+        url=None,
+        path=None,
+        ttl=600,
+        stale_ttl=86400,
+        min_refetch_interval=30,
+        failure_threshold=3,
+        reset_timeout=60,
+        fetch_timeout=5,
+        algorithm=None,
+    ):
+        self.url = url
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.min_refetch_interval = min_refetch_interval
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.fetch_timeout = fetch_timeout
+        self.algorithm = algorithm
+
+        self._lock = threading.Lock()
+        self._keys = {}
+        self._fetched_at = None
+        self._last_attempt = 0.0
+        self._failures = 0
+        self._opened_at = None
+        self._refreshing = False
+        self._rotation_listeners = []
+
+    # Key lookup
+    # ----------------------------------------------------------------
+
+    def get_key(self, kid):
+        """Returns the public key for `kid`, or None if the issuer has no such key"""
+        now = time.monotonic()
+        if self._fetched_at is None:
+            self.refresh()
+        elif now - self._fetched_at > self.ttl + self.stale_ttl:
+            self.refresh()
+        elif now - self._fetched_at > self.ttl:
+            self._refresh_in_background()
+
+        entry = self._keys.get(kid)
+        if entry is None and self._can_refetch(time.monotonic()):
+            self.refresh(force=True)
+            entry = self._keys.get(kid)
+        return entry[1] if entry else None
+
+    @property
+    def kids(self):
+        return set(self._keys)
+
+    # Loading
+    # ----------------------------------------------------------------
+
+    def load(self, jwks):
+        """Replaces the current key set with the given JWKS document"""
+        keys = {}
+        for key in jwks.get("keys", []):
+            if "kid" not in key or key.get("use", "sig") != "sig":
+                continue
+            algorithm = key.get("alg") or self._default_algorithm()
+            try:
+                keys[key["kid"]] = (key, jwk.construct(key, algorithm))
+            except Exception:
+                continue
+
+        with self._lock:
+            removed = set(self._keys) - set(keys)
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+        if removed:
+            for listener in self._rotation_listeners:
+                listener(removed)
+
+    def add_rotation_listener(self, listener):
+        """Calls `listener(kids)` whenever keys rotate out of the set"""
+        self._rotation_listeners.append(listener)
+
+    def refresh(self, force=False):
+        """Fetches the key set now, unless the circuit breaker is open"""
+        now = time.monotonic()
+        if not force and self._fetched_at is not None:
+            if now - self._fetched_at <= self.ttl:
+                return
+        if self._circuit_open(now):
+            if self._fetched_at is None:
+                raise JWKSUnavailableError("JWKS issuer is unavailable.")
+            return
+
+        self._last_attempt = now
+        try:
+            jwks = self._fetch()
+        except Exception as err:
+            self._record_failure(now)
+            if self._fetched_at is None:
+                raise JWKSUnavailableError(str(err))
+            return
+
+        self._failures = 0
+        self._opened_at = None
+        self.load(jwks)
+
+    def _fetch(self):
+        if self.path:
+            with open(self.path) as f:
+                return json.load(f)
+        with urlopen(self.url, timeout=self.fetch_timeout) as response:
+            return json.loads(response.read())
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except JWKSUnavailableError:
+                pass
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="jwks-refresh", daemon=True).start()
+
+    # Circuit breaker
+    # ----------------------------------------------------------------
+
+    def _record_failure(self, now):
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            self._opened_at = now
+
+    def _circuit_open(self, now):
+        if self._opened_at is None:
+            return False
+        if now - self._opened_at >= self.reset_timeout:
+            # Half-open: let a single attempt through
+            self._opened_at = now
+            return False
+        return True
+
+    def _can_refetch(self, now):
+        return now - self._last_attempt >= self.min_refetch_interval
+
+    def _default_algorithm(self):
+        algorithm = self.algorithm
+        if isinstance(algorithm, (list, tuple)):
+            algorithm = algorithm[0] if algorithm else None
+        return algorithm or "RS256"
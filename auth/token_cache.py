@@ -0,0 +1,81 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+"""
+TokenCache
+    bounded LRU cache of verified JWT payloads
+
+    - entries are keyed by the SHA-256 of the raw bearer token
+    - an entry expires at the token's `exp` claim
+    - entries signed by a key that rotated out of the JWKS are evicted
+    - the permission set of each payload is computed once, on insert
+"""
+
+
+class TokenCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token):
+        """Returns (payload, permissions) for a cached token, or None"""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, permissions, kid, exp = entry
+            if exp <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload, permissions
+
+    def put(self, token, kid, payload):
+        """Caches a verified payload until its expiry; returns its permission set"""
+        permissions = None
+        if "permissions" in payload:
+            permissions = frozenset(payload["permissions"])
+        exp = payload.get("exp")
+        if self.maxsize <= 0 or not isinstance(exp, (int, float)):
+            return permissions
+
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (payload, permissions, kid, exp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return permissions
+
+    def evict_kids(self, kids):
+        """Drops every entry signed by one of the given key ids"""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e[2] in kids]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,141 @@
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from flask import Flask
+from sqlalchemy import insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never the app's own database: its tables are emptied
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL") or "sqlite:///" + os.path.join(
+    tempfile.mkdtemp(), "bench.db"
+)
+os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+
+from models import db, setup_db, Actor, Movie
+from readmodels import fetch_rows, get_row, select_rows
+
+"""
+read_path
+    per-row CPU and memory of the list and detail reads: mapped instances
+    (Model.query) against the readmodels rows
+
+        python benchmarks/read_path.py [--rows 100000] [--lookups 2000]
+
+    Fills a scratch SQLite database, or the one of BENCH_DATABASE_URL (its
+    tables are emptied first), with --rows actors and movies. For each read
+    path it reports the best of --repeat runs of reading every row and
+    serializing it with to_dict(), and the memory held by the loaded rows
+    (tracemalloc peak).
+"""
+
+
+def fill(count):
+    for model, make in (
+        (
+            Actor,
+            lambda i: {
+                "name": "Actor {}".format(i),
+                "age": 20 + i % 60,
+                "gender": ("Male", "Female", "Other")[i % 3],
+                "image_link": "https://example.com/actors/{}.jpg".format(i),
+            },
+        ),
+        (
+            Movie,
+            lambda i: {
+                "title": "Movie {}".format(i),
+                "image_link": "https://example.com/movies/{}.jpg".format(i),
+            },
+        ),
+    ):
+        db.session.execute(model.__table__.delete())
+        for start in range(0, count, 10000):
+            rows = [make(i) for i in range(start, min(start + 10000, count))]
+            db.session.execute(insert(model.__table__), rows)
+    db.session.commit()
+
+
+def orm_rows(model):
+    rows = model.query.all()
+    db.session.expunge_all()
+    return rows
+
+
+def read_rows(model):
+    return fetch_rows(model, select_rows(model))
+
+
+def measure(load, model, repeat):
+    """Returns (best seconds to load and serialize, peak bytes of the loaded rows)"""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        for item in load(model):
+            item.to_dict()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    rows = load(model)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows
+    return best, peak
+
+
+def measure_lookups(get, model, ids):
+    started = time.perf_counter()
+    for item_id in ids:
+        get(item_id).to_dict()
+        db.session.expunge_all()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read path benchmark")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    setup_db(app, BENCH_DATABASE_URL)
+
+    with app.app_context():
+        fill(args.rows)
+        print("{} rows per table, {}".format(args.rows, db.engine.dialect.name))
+        print(
+            "{:<8} {:<10} {:>12} {:>14}".format("table", "path", "us/row", "bytes/row")
+        )
+        for model in (Actor, Movie):
+            for name, load in (("orm", orm_rows), ("readmodel", read_rows)):
+                seconds, peak = measure(load, model, args.repeat)
+                print(
+                    "{:<8} {:<10} {:>12.2f} {:>14.0f}".format(
+                        model.__tablename__,
+                        name,
+                        seconds / args.rows * 1e6,
+                        peak / args.rows,
+                    )
+                )
+
+        ids = [row.id for row in read_rows(Actor)[: args.lookups]]
+        print("\nlookups by id ({}), us/lookup".format(len(ids)))
+        for name, get in (
+            ("orm", Actor.query.get),
+            ("readmodel", lambda item_id: get_row(Actor, item_id)),
+        ):
+            seconds = measure_lookups(get, Actor, ids)
+            print("{:<10} {:>12.2f}".format(name, seconds / len(ids) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+"""
+startup
+    cold start of a worker, per boot mode: importing app.py, building the
+    app, and serving its first request
+
+        python benchmarks/startup.py [--runs 10] [--path /] [--token <jwt>]
+
+    Every run is a fresh interpreter, as a new gunicorn worker or dyno is.
+    Importing app.py also builds the app (app = create_app() at the
+    bottom), so the child runs app.py without that statement: the import
+    phase is everything else at module level, and construction is the one,
+    cold create_app() that follows. The first request goes to that app;
+    pass a --token for the endpoints that need one, e.g.
+    --path "/actors?limit=10".
+
+    The database is BENCH_DATABASE_URL, or a scratch SQLite file. Its schema
+    is created by the development boots, which run first: production boots
+    don't create it.
+"""
+
+BOOT_MODES = ("development", "production")
+PHASES = ("import", "construction", "first_request")
+
+
+def _builds_app(node):
+    """Whether a statement of app.py is its module-level app = create_app()"""
+    return (
+        isinstance(node, ast.Assign)
+        and isinstance(node.value, ast.Call)
+        and getattr(node.value.func, "id", None) == "create_app"
+    )
+
+
+def run_child(path, token):
+    """Times one boot in this interpreter, and prints the phases as JSON"""
+    # create_app() logs to error.log in the working directory
+    os.chdir(tempfile.mkdtemp())
+    sys.path.insert(0, ROOT)
+
+    source_path = os.path.join(ROOT, "app.py")
+    with open(source_path) as source:
+        tree = ast.parse(source.read(), source_path)
+    tree.body = [node for node in tree.body if not _builds_app(node)]
+    code = compile(tree, source_path, "exec")
+    module = types.ModuleType("app")
+    module.__file__ = source_path
+    sys.modules["app"] = module
+
+    started = time.perf_counter()
+    exec(code, module.__dict__)
+    imported = time.perf_counter()
+    app = module.create_app()
+    constructed = time.perf_counter()
+
+    headers = {"Authorization": "Bearer {}".format(token)} if token else {}
+    started_request = time.perf_counter()
+    res = app.test_client().get(path, headers=headers)
+    answered = time.perf_counter()
+
+    print(
+        json.dumps(
+            {
+                "import": imported - started,
+                "construction": constructed - imported,
+                "first_request": answered - started_request,
+                "status": res.status_code,
+            }
+        )
+    )
+
+
+def boot(mode, database_url, args):
+    env = dict(os.environ, BOOT_MODE=mode, DATABASE_URL=database_url)
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--child",
+        "--path",
+        args.path,
+    ]
+    if args.token:
+        command += ["--token", args.token]
+    output = subprocess.run(
+        command, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--token", default=os.getenv("PRODUCER_TOKEN", ""))
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.path, args.token)
+        return
+
+    database_url = os.getenv("BENCH_DATABASE_URL") or "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+    print("{} runs per mode, GET {}, median ms".format(args.runs, args.path))
+    print(
+        "{:<12} {:>10} {:>14} {:>14} {:>10} {:>7}".format(
+            "mode", "import", "construction", "first_request", "total", "status"
+        )
+    )
+    for mode in BOOT_MODES:
+        runs = [boot(mode, database_url, args) for _ in range(args.runs)]
+        medians = [
+            statistics.median(run[phase] for run in runs) * 1000 for phase in PHASES
+        ]
+        print(
+            "{:<12} {:>10.1f} {:>14.1f} {:>14.1f} {:>10.1f} {:>7}".format(
+                mode, *medians, sum(medians), runs[-1]["status"]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
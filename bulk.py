@@ -0,0 +1,228 @@
+import io
+import json
+from datetime import date
+
+from sqlalchemy import text
+from werkzeug.datastructures import MultiDict
+
+from models import (
+    db,
+    Actor,
+    Movie,
+    CAST_COUNTS,
+    Change,
+    notify_changes,
+    adjust_row_count,
+    parse_age,
+    parse_date,
+)
+
+"""
+bulk
+    validation and chunked writes for the bulk create endpoints
+
+    Rows are validated with the same rules as ActorForm / MovieForm and
+    written BULK_CHUNK_SIZE at a time, all in one transaction:
+    - Postgres: ids are drawn from the table's sequence, then the chunk is
+      loaded with COPY
+    - SQLite: the chunk's first row is inserted alone, which takes the
+      database's write lock, and the rest in one executemany with the ids
+      that follow it
+    - other databases: bulk_insert_mappings, which inserts row by row to
+      fetch the generated ids
+"""
+
+BULK_CHUNK_SIZE = 1000
+
+# The forms are named, and imported with the first bulk request rather than on boot
+BULK_FIELDS = {
+    Actor: ("ActorForm", ("name", "age", "gender", "image_link")),
+    Movie: ("MovieForm", ("title", "release_date", "image_link")),
+}
+
+# Typed columns, converted as their validators would (bulk writes skip them)
+BULK_PARSERS = {"age": parse_age, "release_date": parse_date}
+
+
+def read_rows(request):
+    """Yields the rows of a JSON array body, or of an NDJSON body line by line"""
+    if request.mimetype == "application/x-ndjson":
+        for line in request.stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+        return
+
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        raise ValueError("Expected a JSON array of records.")
+    yield from rows
+
+
+def _as_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)):
+        return ", ".join(str(item) for item in value)
+    return str(value)
+
+
+class RowValidator:
+    """
+    Validates rows with the model's form. A single form instance is bound
+    once and reprocessed for every row, which is most of the cost saved.
+    """
+
+    def __init__(self, model):
+        import forms
+
+        form_name, self.fields = BULK_FIELDS[model]
+        self.form = getattr(forms, form_name)(formdata=None, meta={"csrf": False})
+
+    def __call__(self, row):
+        """Returns (values, None) for a valid row, or (None, errors)"""
+        if not isinstance(row, dict):
+            return None, {"row": ["Expected a JSON object."]}
+
+        formdata = MultiDict()
+        for field in self.fields:
+            value = row.get(field)
+            for item in value if isinstance(value, (list, tuple)) else [value]:
+                if item is not None:
+                    formdata.add(field, str(item))
+
+        try:
+            self.form.process(formdata)
+            if not self.form.validate():
+                return None, dict(self.form.errors)
+            values = {}
+            for field in self.fields:
+                value = _as_text(row.get(field))
+                values[field] = (
+                    BULK_PARSERS[field](value) if field in BULK_PARSERS else value
+                )
+        except Exception:
+            # A row the validators choke on is rejected alone, not the batch
+            return None, {"row": ["Invalid record."]}
+        return values, None
+
+
+def _copy_value(value):
+    """Encodes a value for COPY's text format"""
+    if value is None:
+        return "\\N"
+    if not isinstance(value, str):
+        return value.isoformat() if isinstance(value, date) else str(value)
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy_chunk(model, fields, chunk):
+    table = model.__tablename__
+    connection = db.session.connection()
+    ids = (
+        connection.execute(
+            text(
+                "SELECT nextval(pg_get_serial_sequence(:table, 'id')) "
+                "FROM generate_series(1, :count)"
+            ),
+            {"table": '"{}"'.format(table), "count": len(chunk)},
+        )
+        .scalars()
+        .all()
+    )
+
+    buffer = io.StringIO()
+    for item_id, values in zip(ids, chunk):
+        values["id"] = item_id
+        line = [str(item_id)] + [_copy_value(values[field]) for field in fields]
+        buffer.write("\t".join(line) + "\n")
+    buffer.seek(0)
+
+    columns = ", ".join(("id",) + fields)
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert('COPY "{}" ({}) FROM STDIN'.format(table, columns), buffer)
+
+
+def _change_data(values):
+    """The to_dict() form of the values of an inserted row"""
+    return {
+        field: value.isoformat() if isinstance(value, date) else value
+        for field, value in values.items()
+    }
+
+
+def _sqlite_chunk(model, fields, chunk):
+    table = model.__table__
+    connection = db.session.connection()
+    first_id = connection.execute(table.insert(), chunk[0]).inserted_primary_key[0]
+    chunk[0]["id"] = first_id
+    # SQLite has one writer at a time: no other transaction can take these ids
+    # (a rowid is one past the largest) until this one commits
+    for item_id, values in enumerate(chunk[1:], first_id + 1):
+        values["id"] = item_id
+    if len(chunk) > 1:
+        connection.execute(table.insert(), chunk[1:])
+
+
+def _insert_chunk(model, fields, chunk):
+    db.session.bulk_insert_mappings(model, chunk, return_defaults=True)
+
+
+def _write_chunk(model, fields, chunk):
+    if db.engine.dialect.name == "postgresql":
+        _copy_chunk(model, fields, chunk)
+    elif db.engine.dialect.name == "sqlite":
+        _sqlite_chunk(model, fields, chunk)
+    else:
+        _insert_chunk(model, fields, chunk)
+    adjust_row_count(db.session.connection(), model, len(chunk))
+
+
+def bulk_insert(model, rows):
+    """
+    Validates and inserts the rows; returns (ids, errors) where errors
+    lists the index and form errors of every rejected row.
+    """
+    fields = BULK_FIELDS[model][1]
+    validate_row = RowValidator(model)
+
+    inserted, errors, chunk = [], [], []
+    try:
+        for index, row in enumerate(rows):
+            values, row_errors = validate_row(row)
+            if row_errors:
+                errors.append({"index": index, "errors": row_errors})
+                continue
+            chunk.append(values)
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                _write_chunk(model, fields, chunk)
+                inserted.extend(chunk)
+                chunk = []
+        if chunk:
+            _write_chunk(model, fields, chunk)
+            inserted.extend(chunk)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    count_column = CAST_COUNTS[model][0]
+    notify_changes(
+        [
+            Change(
+                model,
+                "insert",
+                values["id"],
+                dict(_change_data(values), **{count_column: 0}),
+            )
+            for values in inserted
+        ]
+    )
+    return [values["id"] for values in inserted], errors
@@ -0,0 +1,331 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+import metrics
+from models import db, on_change
+from singleflight import FileSingleFlight, SingleFlight
+
+"""
+cache
+    response cache of the read endpoints (lists, details and searches)
+
+    Only 200 JSON responses are stored. A key covers the endpoint, its URL
+    arguments, query string, body and content negotiation headers, and the
+    permission scope of the caller's token. It also embeds generations:
+    - the table generation, bumped by any write to the table, for lists and
+      searches
+    - the row generation, bumped by writes to that one row, for details
+    so a commit makes the affected entries unreachable at once, and they age
+    out of the backend. Generations are bumped from the commit-time change
+    notifications of models.py.
+
+    Backends:
+    - LRUBackend: in-process, bounded by the total size of the entries
+    - SharedBackend: any Redis-like client (get / set with ex / incr), so
+      every worker sees the same entries and generations
+    With the in-process backend, writes made by other workers are only seen
+    once entries expire (RESPONSE_CACHE_TTL).
+    Responses read from a replica (routing.py) aren't stored: the replica
+    may not have replayed a write yet, and its older rows would be cached
+    under the generation that write bumped.
+
+    Misses are coalesced with singleflight.py: concurrent identical requests
+    wait for the one computing the response and are served its bytes.
+"""
+
+RESPONSE_CACHE_TTL = 60
+RESPONSE_CACHE_BYTES = 32 * 1024 * 1024
+
+
+class LRUBackend:
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires <= time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        cost = len(key) + len(value)
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self.size += cost
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(key) + len(entry[0])
+
+    def get_counters(self, keys):
+        with self._lock:
+            return [self._counters.get(key, 0) for key in keys]
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class SharedBackend:
+    """Stores entries and generations in a Redis-like client, under `prefix`"""
+
+    def __init__(self, client, prefix="casting:cache:"):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+    def get_counters(self, keys):
+        return [int(self.client.get(self.prefix + key) or 0) for key in keys]
+
+    def incr(self, key):
+        self.client.incr(self.prefix + key)
+
+    def clear(self):
+        pass  # Generations are never reset, old entries expire on their own
+
+    def stats(self):
+        return {"backend": "shared"}
+
+
+def _encode(response):
+    headers = [
+        [name, value]
+        for name, value in response.headers.items()
+        if name.lower() not in ("content-length", "set-cookie")
+    ]
+    meta = json.dumps([response.status_code, response.mimetype, headers])
+    return meta.encode("utf-8") + b"\n" + response.get_data()
+
+
+def _decode(value):
+    meta, body = value.split(b"\n", 1)
+    status, mimetype, headers = json.loads(meta)
+    return Response(body, status=status, mimetype=mimetype, headers=headers)
+
+
+def _scope(payload):
+    """The permission scope of a token: who may see the response"""
+    return ",".join(sorted(payload.get("permissions", [])))
+
+
+class ResponseCache:
+    def __init__(self):
+        self.backend = None
+        self.flight = None
+        self.ttl = RESPONSE_CACHE_TTL
+        self.hits = 0
+        self.misses = 0
+        self.replica_reads = 0
+
+    def init_app(self, app, backend=None):
+        """
+        RESPONSE_CACHE picks the backend: "memory" (default), "redis" (needs
+        the redis package and REDIS_URL) or "off". SINGLE_FLIGHT picks how
+        misses are coalesced: "thread" (default, within the worker), "file"
+        (across workers, through lock files) or "off".
+        """
+        kind = app.config.setdefault(
+            "RESPONSE_CACHE", os.getenv("RESPONSE_CACHE", "memory")
+        )
+        self.ttl = int(os.getenv("RESPONSE_CACHE_TTL", RESPONSE_CACHE_TTL))
+        if backend is None and kind == "memory":
+            max_bytes = int(os.getenv("RESPONSE_CACHE_BYTES", RESPONSE_CACHE_BYTES))
+            backend = LRUBackend(max_bytes)
+        elif backend is None and kind == "redis":
+            import redis
+
+            backend = SharedBackend(redis.Redis.from_url(os.environ["REDIS_URL"]))
+        self.backend = backend
+
+        flight = app.config.setdefault(
+            "SINGLE_FLIGHT", os.getenv("SINGLE_FLIGHT", "thread")
+        )
+        if flight == "thread":
+            self.flight = SingleFlight()
+        elif flight == "file":
+            self.flight = FileSingleFlight(os.getenv("SINGLE_FLIGHT_DIR"))
+        else:
+            self.flight = None
+
+        on_change(self.invalidate)
+        metrics.register("response_cache", self.stats)
+        if self.flight is not None:
+            metrics.register("single_flight", self.flight.stats)
+
+    def cached(self, model, id_arg=None, related=()):
+        """
+        Caches the 200 JSON responses of a view of `model`. Views of one row
+        name its URL argument in `id_arg` and are keyed by that row's
+        generation instead of the table's. When ?include= pulls in rows of
+        the `related` models, their table generations are part of the key.
+        """
+
+        def decorator(f):
+            @wraps(f)
+            def wrapper(jwt, *args, **kwargs):
+                if self.backend is None and self.flight is None:
+                    return f(jwt, *args, **kwargs)
+
+                item_id = kwargs.get(id_arg) if id_arg else None
+                key = self._key(model, jwt, item_id, related)
+                value = self._lookup(key)
+                if value is not None:
+                    return _decode(value).make_conditional(request)
+                if self.flight is None:
+                    return self._compute(key, f, jwt, *args, **kwargs)[0]
+
+                def compute():
+                    # Another worker may have stored it while we waited for the lock
+                    value = self.backend.get(key) if self.backend else None
+                    if value is not None:
+                        return None, value
+                    return self._compute(key, f, jwt, *args, **kwargs)
+
+                (response, value), shared = self.flight.do(key, compute)
+                if response is not None and not shared:
+                    return response
+                if value is None:
+                    # Not shareable (e.g. HTML or an error), so make our own
+                    return f(jwt, *args, **kwargs)
+                return _decode(value).make_conditional(request)
+
+            return wrapper
+
+        return decorator
+
+    def _lookup(self, key):
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def _compute(self, key, f, *args, **kwargs):
+        """Runs the view; returns its response and, when shareable, its bytes"""
+        # Set by the replica routing before the view runs
+        from_replica = db.session.info.get("replica") is not None
+        response = f(*args, **kwargs)
+        if (
+            isinstance(response, Response)
+            and response.status_code == 200
+            and response.mimetype == "application/json"
+            and not response.is_streamed
+        ):
+            value = _encode(response)
+            if from_replica:
+                self.replica_reads += 1
+            elif self.backend is not None:
+                self.backend.set(key, value, self.ttl)
+            return response, value
+        return response, None
+
+    def _key(self, model, payload, item_id, related=()):
+        table = model.__tablename__
+        counter = table if item_id is None else "{}:{}".format(table, item_id)
+        counters = ["gen:" + counter]
+        if request.args.get("include"):
+            counters.extend("gen:" + other.__tablename__ for other in related)
+        generation = "0"
+        if self.backend is not None:
+            generation = ".".join(map(str, self.backend.get_counters(counters)))
+
+        variant = json.dumps(
+            [
+                request.endpoint,
+                request.view_args,
+                sorted(request.args.items(multi=True)),
+                request.get_data(as_text=True),
+                request.headers.get("Content-Type", ""),
+                request.headers.get("Accept", ""),
+                _scope(payload),
+            ],
+            sort_keys=True,
+        )
+        digest = hashlib.sha1(variant.encode("utf-8")).hexdigest()
+        return "resp:{}:{}:{}".format(counter, generation, digest)
+
+    def invalidate(self, changes):
+        if self.backend is None:
+            return
+        tables = set()
+        for change in changes:
+            table = change.model.__tablename__
+            tables.add(table)
+            if change.action != "insert":
+                self.backend.incr("gen:{}:{}".format(table, change.id))
+        for table in tables:
+            self.backend.incr("gen:" + table)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            # Responses not stored as they were read from a replica
+            "replica_reads": self.replica_reads,
+        }
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        return stats
+
+
+response_cache = ResponseCache()
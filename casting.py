@@ -0,0 +1,159 @@
+from sqlalchemy import and_, func, insert, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import (
+    db,
+    Actor,
+    Movie,
+    CAST_COUNTS,
+    Change,
+    adjust_row_count,
+    cast,
+    refresh_cast_counts,
+)
+from readmodels import ROW_TYPES, get_row
+
+"""
+casting
+    set-based updates of a movie's cast for the /movies/<id>/cast endpoints
+
+    A whole list of actors is assigned or unassigned with one statement:
+    - Postgres: INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING, or
+      DELETE ... RETURNING, so the changed links come back in the same trip
+    - other databases: one SELECT for the set difference, then the same
+      INSERT (ON CONFLICT DO NOTHING) or DELETE
+    The movie's actor_count is then recounted by an UPDATE whose WHERE
+    clause holds the versions allowed by If-Match, and which returns the
+    movie's row on Postgres: when it matches no row, the movie is missing or
+    was changed since it was read, and the caller rolls back. The actors
+    that changed are recounted in the same transaction. The caller commits.
+"""
+
+
+def read_actor_ids(body):
+    """The actor ids of a body: a JSON list, or {"actor_ids": [...]}"""
+    if isinstance(body, dict):
+        body = body.get("actor_ids")
+    if not isinstance(body, list) or not all(
+        isinstance(item, int) and not isinstance(item, bool) for item in body
+    ):
+        raise ValueError("Expected a list of actor ids.")
+    return set(body)
+
+
+def _linked_actors(movie_id, actor_ids):
+    """Returns {actor id: already cast?} for the existing actors in actor_ids"""
+    rows = db.session.execute(
+        select(Actor.id, cast.c.movie_id.isnot(None))
+        .select_from(Actor)
+        .outerjoin(cast, and_(cast.c.actor_id == Actor.id, cast.c.movie_id == movie_id))
+        .where(Actor.id.in_(actor_ids))
+    )
+    return dict(rows.all())
+
+
+def _cast_rows(movie_id, actor_ids):
+    """(actor id, movie id) of the existing actors, while the movie exists"""
+    movie = select(Movie.id).where(Movie.id == movie_id).exists()
+    return select(Actor.id, literal(movie_id)).where(Actor.id.in_(actor_ids), movie)
+
+
+def assign_actors(movie_id, actor_ids, versions=None):
+    """
+    Casts the existing actors of actor_ids in the movie, if its version is
+    one of `versions` (any version when None); returns (the added ids, the
+    movie's row), or (None, None) when no movie matched
+    """
+    if not actor_ids:
+        return _recount(movie_id, [], versions)
+    connection = db.session.connection()
+    rows = _cast_rows(movie_id, actor_ids)
+
+    if connection.dialect.name == "postgresql":
+        statement = (
+            pg_insert(cast)
+            .from_select(["actor_id", "movie_id"], rows)
+            .on_conflict_do_nothing()
+            .returning(cast.c.actor_id)
+        )
+        added = connection.execute(statement).scalars().all()
+    else:
+        linked = _linked_actors(movie_id, actor_ids)
+        added = [actor_id for actor_id, is_cast in linked.items() if not is_cast]
+        if added:
+            statement = insert(cast).from_select(
+                ["actor_id", "movie_id"], _cast_rows(movie_id, added)
+            )
+            connection.execute(statement.prefix_with("OR IGNORE", dialect="sqlite"))
+
+    return _recount(movie_id, added, versions)
+
+
+def unassign_actors(movie_id, actor_ids, versions=None):
+    """
+    Removes the actors of actor_ids from the movie, if its version is one of
+    `versions` (any version when None); returns (the removed ids, the
+    movie's row), or (None, None) when no movie matched
+    """
+    if not actor_ids:
+        return _recount(movie_id, [], versions)
+    connection = db.session.connection()
+    statement = cast.delete().where(
+        cast.c.movie_id == movie_id, cast.c.actor_id.in_(actor_ids)
+    )
+
+    if connection.dialect.name == "postgresql":
+        removed = connection.execute(statement.returning(cast.c.actor_id))
+        removed = removed.scalars().all()
+    else:
+        linked = _linked_actors(movie_id, actor_ids)
+        removed = [actor_id for actor_id, is_cast in linked.items() if is_cast]
+        if removed:
+            connection.execute(statement)
+
+    return _recount(movie_id, removed, versions)
+
+
+def recount_movie(movie_id, changed, versions=None):
+    """
+    Recounts the movie's actor_count after `changed` links changed, if its
+    version is one of `versions` (any version when None); returns the
+    movie's row, or None when no row matched
+    """
+    table = Movie.__table__
+    statement = table.update().where(table.c.id == movie_id)
+    if versions is not None:
+        statement = statement.where(table.c.version.in_(versions))
+    if changed:
+        _, own_key, _ = CAST_COUNTS[Movie]
+        count = select(func.count()).where(own_key == table.c.id).scalar_subquery()
+        statement = statement.values(actor_count=count, version=table.c.version + 1)
+    else:
+        # Only checks the version, and locks the row like a recount would
+        statement = statement.values(version=table.c.version)
+
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        row = connection.execute(statement.returning(*table.c)).first()
+        row = ROW_TYPES[Movie]._make(row) if row is not None else None
+    else:
+        updated = connection.execute(statement).rowcount
+        row = get_row(Movie, movie_id) if updated else None
+
+    if row is not None and changed:
+        adjust_row_count(connection, Movie, 0, 1)
+        # Reported with the other changes of the transaction once it commits
+        db.session.info.setdefault("pending_changes", []).append(
+            Change(Movie, "update", row.id, row.to_dict())
+        )
+    return row
+
+
+def _recount(movie_id, actor_ids, versions):
+    movie = recount_movie(movie_id, actor_ids, versions)
+    if movie is None:
+        return None, None
+    if actor_ids:
+        changes = refresh_cast_counts(db.session, {Actor: set(actor_ids)})
+        db.session.info.setdefault("pending_changes", []).extend(changes)
+    return sorted(actor_ids), movie
@@ -27,9 +27,11 @@ SET default_table_access_method = heap;
 CREATE TABLE public."Actor" (
     id integer NOT NULL,
     name character varying,
-    age character varying,
+    age integer,
     gender character varying,
-    image_link character varying(500)
+    image_link character varying(500),
+    version integer DEFAULT 1 NOT NULL,
+    movie_count integer DEFAULT 0 NOT NULL
 );
 
 
@@ -64,8 +66,10 @@ ALTER SEQUENCE public."Actor_id_seq" OWNED BY public."Actor".id;
 CREATE TABLE public."Movie" (
     id integer NOT NULL,
     title character varying,
-    release_date character varying(120),
-    image_link character varying(500)
+    release_date date,
+    image_link character varying(500),
+    version integer DEFAULT 1 NOT NULL,
+    actor_count integer DEFAULT 0 NOT NULL
 );
 
 
@@ -136,11 +140,11 @@ COPY public."Actor" (id, name, age, gender, image_link) FROM stdin;
 --
 
 COPY public."Movie" (id, title, release_date, image_link) FROM stdin;
-1	Avengers: Endgame 1	28/12/2019	https://prod-ripcut-delivery.disney-plus.net/v1/variant/disney/863E75A035911DBA10F8D7EE1E433A12A1BF4915670B66597AC31C585A291942/scale?width=1200&aspectRatio=1.78&format=jpeg
-2	Avengers: Endgame 2	28/12/2020	https://prod-ripcut-delivery.disney-plus.net/v1/variant/disney/863E75A035911DBA10F8D7EE1E433A12A1BF4915670B66597AC31C585A291942/scale?width=1200&aspectRatio=1.78&format=jpeg
-3	Avengers: Endgame 3	28/12/2021	https://prod-ripcut-delivery.disney-plus.net/v1/variant/disney/863E75A035911DBA10F8D7EE1E433A12A1BF4915670B66597AC31C585A291942/scale?width=1200&aspectRatio=1.78&format=jpeg
-4	Avengers: Endgame 4	28/12/2022	https://prod-ripcut-delivery.disney-plus.net/v1/variant/disney/863E75A035911DBA10F8D7EE1E433A12A1BF4915670B66597AC31C585A291942/scale?width=1200&aspectRatio=1.78&format=jpeg
-5	Avengers: Endgame 5	28/12/2023	https://prod-ripcut-delivery.disney-plus.net/v1/variant/disney/863E75A035911DBA10F8D7EE1E433A12A1BF4915670B66597AC31C585A291942/scale?width=1200&aspectRatio=1.78&format=jpeg
+1	Avengers: Endgame 1	2019-12-28	https://prod-ripcut-delivery.disney-plus.net/v1/variant/disney/863E75A035911DBA10F8D7EE1E433A12A1BF4915670B66597AC31C585A291942/scale?width=1200&aspectRatio=1.78&format=jpeg
+2	Avengers: Endgame 2	2020-12-28	https://prod-ripcut-delivery.disney-plus.net/v1/variant/disney/863E75A035911DBA10F8D7EE1E433A12A1BF4915670B66597AC31C585A291942/scale?width=1200&aspectRatio=1.78&format=jpeg
+3	Avengers: Endgame 3	2021-12-28	https://prod-ripcut-delivery.disney-plus.net/v1/variant/disney/863E75A035911DBA10F8D7EE1E433A12A1BF4915670B66597AC31C585A291942/scale?width=1200&aspectRatio=1.78&format=jpeg
+4	Avengers: Endgame 4	2022-12-28	https://prod-ripcut-delivery.disney-plus.net/v1/variant/disney/863E75A035911DBA10F8D7EE1E433A12A1BF4915670B66597AC31C585A291942/scale?width=1200&aspectRatio=1.78&format=jpeg
+5	Avengers: Endgame 5	2023-12-28	https://prod-ripcut-delivery.disney-plus.net/v1/variant/disney/863E75A035911DBA10F8D7EE1E433A12A1BF4915670B66597AC31C585A291942/scale?width=1200&aspectRatio=1.78&format=jpeg
 \.
 
 
@@ -191,6 +195,27 @@ ALTER TABLE ONLY public.alembic_version
     ADD CONSTRAINT alembic_version_pkc PRIMARY KEY (version_num);
 
 
+--
+-- Name: ix_Actor_age; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX "ix_Actor_age" ON public."Actor" USING btree (age);
+
+
+--
+-- Name: ix_Actor_gender_age; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX "ix_Actor_gender_age" ON public."Actor" USING btree (gender, age);
+
+
+--
+-- Name: ix_Movie_release_date; Type: INDEX; Schema: public; Owner: postgres
+--
+
+CREATE INDEX "ix_Movie_release_date" ON public."Movie" USING btree (release_date);
+
+
 --
 -- PostgreSQL database dump complete
 --
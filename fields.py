@@ -0,0 +1,45 @@
+from datetime import date
+
+from flask import abort
+
+from models import Actor, Movie
+
+"""
+fields
+    sparse fieldsets: ?fields=id,name on the list endpoints
+
+    A list asked for with ?fields= selects only those columns (see
+    readmodels.select_rows) and serializes only them. The id is always
+    returned, as the cursor and ?include= rely on it.
+"""
+
+FIELDS = {
+    Actor: ("id", "name", "age", "gender", "image_link", "movie_count"),
+    Movie: ("id", "title", "release_date", "image_link", "actor_count"),
+}
+
+
+def requested_fields(request, model):
+    """Returns the field names of ?fields=, or None for all of them"""
+    if "fields" not in request.args:
+        return None
+    fields = ["id"]
+    for name in request.args["fields"].split(","):
+        name = name.strip()
+        if not name or name in fields:
+            continue
+        if name not in FIELDS[model]:
+            abort(400)  # Bad request
+        fields.append(name)
+    return tuple(fields)
+
+
+def as_dict(item, fields=None):
+    """The to_dict() of a row, or only its `fields`"""
+    if fields is None:
+        return item.to_dict()
+    values = {}
+    for name in fields:
+        value = getattr(item, name)
+        values[name] = value.isoformat() if isinstance(value, date) else value
+    return values
@@ -3,11 +3,16 @@ from flask_wtf import Form
 from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
 from wtforms.validators import DataRequired, AnyOf, URL, Optional
 from wtforms.validators import Regexp, ValidationError, re
+from models import parse_date
 
 def isValidAge(form, field):
-    if not re.search(r'^[0-9\-\+]+$', field.data):
+    if field.data and not re.search(r'^[0-9\-\+]+$', field.data):
         raise ValidationError("Invalid age.")
 
+def isValidDate(form, field):
+    if field.data and parse_date(field.data) is None:
+        raise ValidationError("Invalid date.")
+
 class ActorForm(Form):
     name = StringField(
         'name', validators=[DataRequired()]
@@ -32,7 +37,7 @@ class MovieForm(Form):
         'title', validators=[DataRequired()]
     )
     release_date = StringField(
-        'release_date', validators=[DataRequired()]
+        'release_date', validators=[DataRequired(), isValidDate]
     )
     image_link = StringField(
         'image_link', validators=[Optional(), URL()]
@@ -0,0 +1,255 @@
+import sys
+import threading
+import time
+from array import array
+from collections import Counter
+
+from sqlalchemy import select
+
+import metrics
+from models import db, Actor, Movie, cast, change_count, on_change
+
+"""
+graph
+    in-memory co-star graph behind /actors/<id>/costars and
+    /actors/<a>/path/<b>
+
+    The cast table is held as two CSR-style adjacency structures, one per
+    side: sorted node ids, offsets into one flat array of neighbour ids.
+    Rows whose cast changed are reloaded into a small overlay that shadows
+    the arrays; once the overlay grows past OVERLAY_LIMIT the arrays are
+    rebuilt. Like the search indexes, the graph is resynced whenever the
+    tables' change counters move past the changes this worker has seen.
+"""
+
+OVERLAY_LIMIT = 1000
+MAX_PATH_DEPTH = 6
+
+
+class Adjacency:
+    """CSR adjacency of one side: node id -> sorted neighbour ids"""
+
+    def __init__(self, pairs=()):
+        """`pairs` are (node id, neighbour id) tuples sorted by node id, then neighbour"""
+        self.rows = {}
+        self.neighbours = array("q")
+        offsets = array("q")
+        for node, neighbour in pairs:
+            if node not in self.rows:
+                self.rows[node] = len(offsets)
+                offsets.append(len(self.neighbours))
+            self.neighbours.append(neighbour)
+        offsets.append(len(self.neighbours))
+        self.offsets = offsets
+
+    def get(self, node):
+        row = self.rows.get(node)
+        if row is None:
+            return ()
+        return self.neighbours[self.offsets[row] : self.offsets[row + 1]]
+
+    def memory(self):
+        return (
+            sys.getsizeof(self.rows)
+            + sys.getsizeof(self.neighbours)
+            + sys.getsizeof(self.offsets)
+        )
+
+
+class CastGraph:
+    def __init__(self, resync_interval=60, overlay_limit=OVERLAY_LIMIT):
+        self.resync_interval = resync_interval
+        self.overlay_limit = overlay_limit
+        self.app = None
+        self.watermark = None
+        self.rebuilds = 0
+        self._lock = threading.Lock()
+        self._built = False
+        self._adjacency = {Actor: Adjacency(), Movie: Adjacency()}
+        self._overlay = {Actor: {}, Movie: {}}
+        self._stale = {Actor: set(), Movie: set()}
+        self._checked_at = 0.0
+        self._resyncing = False
+
+    def init_app(self, app):
+        self.app = app
+        self._checked_at = time.monotonic()
+        on_change(self.apply)
+        metrics.register("cast_graph", self.stats)
+
+    def _watermark(self):
+        return change_count(Actor), change_count(Movie)
+
+    def rebuild(self):
+        watermark = self._watermark()
+        pairs = db.session.execute(
+            select(cast.c.actor_id, cast.c.movie_id).order_by(
+                cast.c.actor_id, cast.c.movie_id
+            )
+        ).all()
+        actors = Adjacency(pairs)
+        movies = Adjacency(sorted((movie, actor) for actor, movie in pairs))
+
+        with self._lock:
+            self._adjacency = {Actor: actors, Movie: movies}
+            self._overlay = {Actor: {}, Movie: {}}
+            self._stale = {Actor: set(), Movie: set()}
+            self.watermark = watermark
+            self._built = True
+            self.rebuilds += 1
+
+    def _refresh(self):
+        """Reloads the cast of the rows changed since the last lookup"""
+        with self._lock:
+            stale, self._stale = self._stale, {Actor: set(), Movie: set()}
+        if not any(stale.values()):
+            return
+
+        overlay = {Actor: {}, Movie: {}}
+        for model, own_key, other_key in (
+            (Actor, cast.c.actor_id, cast.c.movie_id),
+            (Movie, cast.c.movie_id, cast.c.actor_id),
+        ):
+            if not stale[model]:
+                continue
+            rows = db.session.execute(
+                select(own_key, other_key)
+                .where(own_key.in_(stale[model]))
+                .order_by(own_key, other_key)
+            )
+            links = {item_id: [] for item_id in stale[model]}
+            for item_id, other_id in rows:
+                links[item_id].append(other_id)
+            overlay[model] = {item_id: tuple(ids) for item_id, ids in links.items()}
+
+        with self._lock:
+            for model in overlay:
+                self._overlay[model].update(overlay[model])
+            overlay_size = sum(len(rows) for rows in self._overlay.values())
+        if overlay_size > self.overlay_limit:
+            self.rebuild()
+
+    def _prepare(self):
+        if not self._built:
+            self.rebuild()
+        else:
+            self._refresh()
+        self._maybe_resync()
+
+    def resync(self):
+        """Rebuilds the graph if the tables moved since it was built"""
+        with self.app.app_context():
+            if self._watermark() != self.watermark:
+                self.rebuild()
+            db.session.remove()
+
+    def _maybe_resync(self):
+        now = time.monotonic()
+        if self._resyncing or now - self._checked_at < self.resync_interval:
+            return
+        self._checked_at = now
+        self._resyncing = True
+
+        def run():
+            try:
+                self.resync()
+            finally:
+                self._resyncing = False
+
+        threading.Thread(target=run, name="cast-graph-resync", daemon=True).start()
+
+    def apply(self, changes):
+        with self._lock:
+            if not self._built:
+                return
+            seen = Counter()
+            for change in changes:
+                if change.model not in self._stale:
+                    continue
+                seen[change.model] += 1
+                if change.action == "delete":
+                    self._overlay[change.model][change.id] = ()
+                    self._stale[change.model].discard(change.id)
+                else:
+                    self._stale[change.model].add(change.id)
+            if self.watermark is not None:
+                actors, movies = self.watermark
+                self.watermark = actors + seen[Actor], movies + seen[Movie]
+
+    def _neighbours(self, model, item_id):
+        overlay = self._overlay[model]
+        if item_id in overlay:
+            return overlay[item_id]
+        return self._adjacency[model].get(item_id)
+
+    def costars(self, actor_id):
+        """Returns [(actor id, shared movies)], most shared movies first"""
+        self._prepare()
+        shared = Counter()
+        with self._lock:
+            for movie_id in self._neighbours(Actor, actor_id):
+                shared.update(self._neighbours(Movie, movie_id))
+        shared.pop(actor_id, None)
+        return sorted(shared.items(), key=lambda item: (-item[1], item[0]))
+
+    def path(self, source, target, max_depth=MAX_PATH_DEPTH):
+        """
+        Shortest chain of co-stars from `source` to `target`, found with a
+        bidirectional BFS. Returns [actor id, movie id, actor id, ...] or None
+        when they are not connected within max_depth movies.
+        """
+        self._prepare()
+        if source == target:
+            return [source]
+
+        with self._lock:
+            parents = {source: None}, {target: None}
+            frontiers = [source], [target]
+            for _ in range(max_depth):
+                # Grow the smaller side
+                side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+                seen, other = parents[side], parents[1 - side]
+                frontier = []
+                for actor_id in frontiers[side]:
+                    for movie_id in self._neighbours(Actor, actor_id):
+                        for costar in self._neighbours(Movie, movie_id):
+                            if costar in seen:
+                                continue
+                            seen[costar] = (actor_id, movie_id)
+                            if costar in other:
+                                return self._join(parents, costar)
+                            frontier.append(costar)
+                if not frontier:
+                    return None
+                frontiers = (
+                    (frontier, frontiers[1]) if side == 0 else (frontiers[0], frontier)
+                )
+        return None
+
+    @staticmethod
+    def _join(parents, meeting):
+        forward, backward = parents
+        path, node = [meeting], meeting
+        while forward[node] is not None:
+            node, movie_id = forward[node]
+            path[:0] = [node, movie_id]
+        node = meeting
+        while backward[node] is not None:
+            node, movie_id = backward[node]
+            path.extend([movie_id, node])
+        return path
+
+    def stats(self):
+        with self._lock:
+            actors, movies = self._adjacency[Actor], self._adjacency[Movie]
+            return {
+                "actors": len(actors.rows),
+                "movies": len(movies.rows),
+                "edges": len(actors.neighbours),
+                "overlay": sum(len(rows) for rows in self._overlay.values()),
+                "rebuilds": self.rebuilds,
+                "memory_bytes": actors.memory() + movies.memory(),
+            }
+
+
+cast_graph = CastGraph()
@@ -0,0 +1,68 @@
+from flask import abort
+
+from sqlalchemy import select
+
+from models import db, Actor, Movie, CAST_COUNTS, cast
+from readmodels import ROW_TYPES
+
+"""
+includes
+    compound documents: ?include=actors on the movie endpoints and
+    ?include=movies on the actor endpoints
+
+    Related rows are loaded for a whole page at once, with one query per
+    relation joining the cast table and filtering on the page's ids (IN),
+    so a page costs the same number of queries whatever its size. They are
+    read as readmodels rows.
+"""
+
+RELATIONS = {Actor: {"movies": Movie}, Movie: {"actors": Actor}}
+
+
+def requested_includes(request, model):
+    """Returns {name: related model} of ?include=, aborting on unknown names"""
+    includes = {}
+    for name in request.args.get("include", "").split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in RELATIONS[model]:
+            abort(400)  # Bad request
+        includes[name] = RELATIONS[model][name]
+    return includes
+
+
+def load_related(model, related, ids):
+    """Returns {id: [related to_dict()]} for the rows of `model` in ids"""
+    _, own_key, other_key = CAST_COUNTS[model]
+    table = related.__table__
+    rows = db.session.connection().execute(
+        select(own_key, table)
+        .select_from(cast)
+        .join(table, table.c.id == other_key)
+        .where(own_key.in_(ids))
+        .order_by(own_key, table.c.id)
+    )
+    make_row = ROW_TYPES[related]._make
+    loaded = {}
+    for item_id, *columns in rows:
+        loaded.setdefault(item_id, []).append(make_row(columns).to_dict())
+    return loaded
+
+
+def include_related(request, model, items):
+    """
+    Returns copies of the to_dict() `items` with the relations named in
+    ?include= added, or the items themselves when none are asked for.
+    """
+    includes = requested_includes(request, model)
+    if not includes or not items:
+        return items
+
+    ids = [item["id"] for item in items]
+    items = [dict(item) for item in items]
+    for name, related in includes.items():
+        loaded = load_related(model, related, ids)
+        for item in items:
+            item[name] = loaded.get(item["id"], [])
+    return items
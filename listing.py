@@ -0,0 +1,184 @@
+import base64
+import json
+from datetime import date
+from operator import ge, le
+
+from flask import abort
+from sqlalchemy import and_, or_
+
+from models import db, Actor, Movie, parse_date
+from readmodels import fetch_rows, select_rows
+from search import SEARCH_ITEMS_PER_PAGE
+
+"""
+listing
+    query string of the list and search endpoints, shared by the Flask app
+    and the ASGI one (asgi.py)
+
+    Helpers take a request with werkzeug's `args` (a MultiDict), and abort
+    with 400 on malformed values. A list page is built in two steps, so the
+    statement can run on either kind of connection: page_statement(), then
+    next_page() on the rows it read.
+"""
+
+ITEMS_PER_PAGE = 10
+MAX_ITEMS_PER_PAGE = 100
+
+# Columns the lists can be sorted on with ?sort=<column> or ?sort=-<column>
+SORT_COLUMNS = {
+    Actor: ("id", "name", "age"),
+    Movie: ("id", "title", "release_date"),
+}
+
+
+def encode_cursor(last_id, key=None):
+    """
+    Encodes the last row of a page as an opaque cursor: its id, and its
+    value of the sort column when the list is sorted on another column
+    """
+    position = {"id": last_id}
+    if key is not None:
+        position["k"] = key.isoformat() if isinstance(key, date) else key
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, with_key=False):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+        if with_key:
+            return int(position["id"]), position.get("k")
+        return int(position["id"])
+    except (ValueError, TypeError, KeyError, AttributeError):
+        abort(400)  # Bad request
+
+
+def list_filters(request, model):
+    """
+    Conditions of the list filters, aborting on malformed values:
+    - actors: ?gender=<gender>, ?min_age=<n>, ?max_age=<n>
+    - movies: ?released_after=<date>, ?released_before=<date> (inclusive)
+    Each one is served by an index of the column it filters on.
+    """
+    args = request.args
+    table = model.__table__
+    if model is Actor:
+        column, parse = table.c.age, int
+        bounds = (("min_age", ge), ("max_age", le))
+    else:
+        column, parse = table.c.release_date, parse_date
+        bounds = (("released_after", ge), ("released_before", le))
+
+    conditions = []
+    if model is Actor and args.get("gender"):
+        conditions.append(table.c.gender == args["gender"])
+    for name, compare in bounds:
+        if name not in args:
+            continue
+        try:
+            value = parse(args[name])
+        except ValueError:
+            value = None
+        if value is None:
+            abort(400)  # Bad request
+        conditions.append(compare(column, value))
+    return conditions
+
+
+def list_order(request, model):
+    """Returns (column, descending) of ?sort=, aborting on unknown columns"""
+    sort = request.args.get("sort", "id")
+    descending = sort.startswith("-")
+    name = sort.lstrip("-")
+    if name not in SORT_COLUMNS[model]:
+        abort(400)  # Bad request
+    return model.__table__.c[name], descending
+
+
+def after_position(model, column, descending, after):
+    """
+    Condition selecting the rows past the cursor `after`, in the list's
+    order: sort column (nulls last), then id.
+    """
+    id_column = model.__table__.c.id
+    if column is id_column:
+        last_id = decode_cursor(after)
+        return id_column < last_id if descending else id_column > last_id
+
+    last_id, key = decode_cursor(after, with_key=True)
+    if key is None:
+        # Past the last row with a value: only the null rows are left
+        return and_(column.is_(None), id_column > last_id)
+    if isinstance(column.type, db.Date):
+        try:
+            key = date.fromisoformat(key)
+        except (TypeError, ValueError):
+            abort(400)  # Bad request
+    beyond = column < key if descending else column > key
+    return or_(beyond, and_(column == key, id_column > last_id), column.is_(None))
+
+
+def page_statement(request, query, model):
+    """
+    Keyset pagination of a select() of the read models: ?limit=<n> and
+    ?after=<cursor>, in the order of ?sort= (the primary key by default),
+    on the rows matching the list filters. Returns the statement of the
+    page, which reads one row more than the page to tell if another page
+    follows, and the paging state next_page() needs.
+    """
+    limit = request.args.get("limit", ITEMS_PER_PAGE, type=int)
+    limit = max(1, min(limit, MAX_ITEMS_PER_PAGE))
+
+    query = query.filter(*list_filters(request, model))
+    column, descending = list_order(request, model)
+    after = request.args.get("after")
+    if after:
+        query = query.filter(after_position(model, column, descending, after))
+
+    id_column = model.__table__.c.id
+    if column is id_column:
+        order = (id_column.desc() if descending else id_column,)
+    else:
+        order = ((column.desc() if descending else column.asc()).nullslast(), id_column)
+    return query.order_by(*order).limit(limit + 1), (model, column, limit)
+
+
+def next_page(items, paging):
+    """Returns the rows of the page and the cursor of the next page (or None)"""
+    model, column, limit = paging
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        key = None if column is model.__table__.c.id else getattr(last, column.key)
+        next_cursor = encode_cursor(last.id, key)
+    return items, next_cursor
+
+
+def paginate_items(request, query, model):
+    """The rows of a page of the list, and the cursor of the next page (or None)"""
+    statement, paging = page_statement(request, query, model)
+    return next_page(fetch_rows(model, statement), paging)
+
+
+def list_query(request, model, fields):
+    """
+    Query of a list: every column, or only those of ?fields= (and the
+    ?sort= column the cursor is made of)
+    """
+    if fields is None:
+        return select_rows(model)
+    column, _ = list_order(request, model)
+    return select_rows(model, fields, extra=(column,))
+
+
+def search_page(request, body):
+    """Returns (limit, page) of a search, from the JSON body or the query string"""
+    args = body or {}
+    limit = args.get("limit", request.args.get("limit", SEARCH_ITEMS_PER_PAGE))
+    page = args.get("page", request.args.get("page", 1))
+    try:
+        return int(limit), int(page)
+    except (TypeError, ValueError):
+        abort(400)  # Bad request
@@ -0,0 +1,21 @@
+"""
+metrics
+    registry of in-process counters exposed by the /metrics endpoint
+
+    Components register a zero-argument callable returning a dict of their
+    current counters; snapshot() collects them all under their names.
+"""
+
+_sources = {}
+
+
+def register(name, source):
+    _sources[name] = source
+
+
+def unregister(name):
+    _sources.pop(name, None)
+
+
+def snapshot():
+    return {name: source() for name, source in sorted(_sources.items())}
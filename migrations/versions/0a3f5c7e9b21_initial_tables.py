@@ -0,0 +1,49 @@
+"""initial tables
+
+Revision ID: 0a3f5c7e9b21
+Revises:
+Create Date: 2026-10-18 17:05:44.630158
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a3f5c7e9b21'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# The tables as they were before 84e6429826cb, which the schema used to be
+# created from with db.create_all(). Databases stamped at 84e6429826cb or
+# later already have them.
+def upgrade():
+    op.create_table('People',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('catchphrase', sa.String(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('Actor',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('age', sa.String(), nullable=True),
+    sa.Column('gender', sa.String(), nullable=True),
+    sa.Column('image_link', sa.String(length=500), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('Movie',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(), nullable=True),
+    sa.Column('release_date', sa.String(length=120), nullable=True),
+    sa.Column('image_link', sa.String(length=500), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('Movie')
+    op.drop_table('Actor')
+    op.drop_table('People')
@@ -0,0 +1,72 @@
+"""trigram and full-text search indexes
+
+Revision ID: 45834fdcf0d0
+Revises: 84e6429826cb
+Create Date: 2026-10-18 09:12:31.402118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '45834fdcf0d0'
+down_revision = '84e6429826cb'
+branch_labels = None
+depends_on = None
+
+SEARCH_COLUMNS = (('Actor', 'name'), ('Movie', 'title'))
+
+
+def fts5_ddl(table, column):
+    fts = '{}_fts'.format(table)
+    return [
+        'CREATE VIRTUAL TABLE "{0}" USING fts5({2}, '
+        "content='{1}', content_rowid='id')".format(fts, table, column),
+        'CREATE TRIGGER "{0}_ai" AFTER INSERT ON "{1}" BEGIN '
+        'INSERT INTO "{0}"(rowid, {2}) VALUES (new.id, new.{2}); END'
+        .format(fts, table, column),
+        'CREATE TRIGGER "{0}_ad" AFTER DELETE ON "{1}" BEGIN '
+        'INSERT INTO "{0}"("{0}", rowid, {2}) '
+        "VALUES ('delete', old.id, old.{2}); END".format(fts, table, column),
+        'CREATE TRIGGER "{0}_au" AFTER UPDATE ON "{1}" BEGIN '
+        'INSERT INTO "{0}"("{0}", rowid, {2}) '
+        "VALUES ('delete', old.id, old.{2}); "
+        'INSERT INTO "{0}"(rowid, {2}) VALUES (new.id, new.{2}); END'
+        .format(fts, table, column),
+    ]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, column in SEARCH_COLUMNS:
+            op.execute(
+                'CREATE INDEX "ix_{0}_{1}_trgm" ON "{0}" '
+                'USING gin ({1} gin_trgm_ops)'.format(table, column)
+            )
+            op.execute(
+                'CREATE INDEX "ix_{0}_{1}_tsv" ON "{0}" '
+                "USING gin (to_tsvector('simple'::regconfig, coalesce({1}, '')))"
+                .format(table, column)
+            )
+    elif dialect == 'sqlite':
+        for table, column in SEARCH_COLUMNS:
+            for statement in fts5_ddl(table, column):
+                op.execute(statement)
+            op.execute(
+                'INSERT INTO "{0}_fts"("{0}_fts") VALUES (\'rebuild\')'.format(table)
+            )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    for table, column in SEARCH_COLUMNS:
+        if dialect == 'postgresql':
+            op.execute('DROP INDEX IF EXISTS "ix_{0}_{1}_trgm"'.format(table, column))
+            op.execute('DROP INDEX IF EXISTS "ix_{0}_{1}_tsv"'.format(table, column))
+        elif dialect == 'sqlite':
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute('DROP TRIGGER IF EXISTS "{0}_fts_{1}"'.format(table, suffix))
+            op.execute('DROP TABLE IF EXISTS "{0}_fts"'.format(table))
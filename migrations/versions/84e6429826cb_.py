@@ -1,7 +1,7 @@
 """empty message
 
 Revision ID: 84e6429826cb
-Revises: 
+Revises: 0a3f5c7e9b21
 Create Date: 2023-05-24 17:45:48.383560
 
 """
@@ -11,7 +11,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = '84e6429826cb'
-down_revision = None
+down_revision = '0a3f5c7e9b21'
 branch_labels = None
 depends_on = None
 
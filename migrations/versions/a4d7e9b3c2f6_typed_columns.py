@@ -0,0 +1,125 @@
+"""typed release_date and age columns
+
+Revision ID: a4d7e9b3c2f6
+Revises: f1c64be2a7d8
+Create Date: 2026-10-18 15:48:31.904217
+
+"""
+import re
+from datetime import datetime
+
+import dateutil.parser
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4d7e9b3c2f6'
+down_revision = 'f1c64be2a7d8'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+# Searchable column of the SQLite FTS5 tables of 45834fdcf0d0
+SEARCH_COLUMNS = {'Actor': 'name', 'Movie': 'title'}
+
+
+# Same tolerant parsing as models.parse_date / models.parse_age, frozen here
+# so the migration doesn't change with the models. Values that can't be read
+# become NULL.
+def parse_date(text):
+    text = (text or '').strip()
+    if not text:
+        return None
+    year_first = re.match(r'\d{4}\D', text) is not None
+    try:
+        parsed = dateutil.parser.parse(
+            text, dayfirst=not year_first, yearfirst=year_first,
+            default=datetime(2000, 1, 1)
+        )
+    except (ValueError, OverflowError):
+        return None
+    return parsed.date()
+
+
+def parse_age(text):
+    match = re.search(r'\d+', text or '')
+    return int(match.group()) if match else None
+
+
+def fts5_triggers(table, column):
+    fts = '{}_fts'.format(table)
+    return [
+        'CREATE TRIGGER "{0}_ai" AFTER INSERT ON "{1}" BEGIN '
+        'INSERT INTO "{0}"(rowid, {2}) VALUES (new.id, new.{2}); END'
+        .format(fts, table, column),
+        'CREATE TRIGGER "{0}_ad" AFTER DELETE ON "{1}" BEGIN '
+        'INSERT INTO "{0}"("{0}", rowid, {2}) '
+        "VALUES ('delete', old.id, old.{2}); END".format(fts, table, column),
+        'CREATE TRIGGER "{0}_au" AFTER UPDATE ON "{1}" BEGIN '
+        'INSERT INTO "{0}"("{0}", rowid, {2}) '
+        "VALUES ('delete', old.id, old.{2}); "
+        'INSERT INTO "{0}"(rowid, {2}) VALUES (new.id, new.{2}); END'
+        .format(fts, table, column),
+    ]
+
+
+def restore_search(table):
+    """
+    SQLite's batch mode recreates the table without its triggers: puts the
+    FTS5 triggers back and rebuilds the index from the new table
+    """
+    connection = op.get_bind()
+    fts = '{}_fts'.format(table)
+    exists = connection.execute(
+        sa.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {'name': fts},
+    ).scalar()
+    if not exists:
+        return
+    for statement in fts5_triggers(table, SEARCH_COLUMNS[table]):
+        op.execute(statement)
+    op.execute('INSERT INTO "{0}"("{0}") VALUES (\'rebuild\')'.format(fts))
+
+
+def convert(table, column, new_type, parse):
+    """Copies `column` into a new column of `new_type` through `parse`, then swaps them"""
+    connection = op.get_bind()
+    op.add_column(table, sa.Column(column + '_new', new_type, nullable=True))
+
+    source = sa.table(table, sa.column('id'), sa.column(column))
+    target = sa.table(table, sa.column('id'), sa.column(column + '_new'))
+    update = target.update().where(target.c.id == sa.bindparam('row_id')).values(
+        {column + '_new': sa.bindparam('value')}
+    )
+    rows = connection.execute(
+        sa.select(source.c.id, source.c[column]).where(source.c[column].isnot(None))
+    ).fetchall()
+    for start in range(0, len(rows), BATCH_SIZE):
+        params = []
+        for row_id, value in rows[start:start + BATCH_SIZE]:
+            params.append({'row_id': row_id, 'value': parse(value)})
+        connection.execute(update, params)
+
+    with op.batch_alter_table(table) as batch_op:
+        batch_op.drop_column(column)
+        batch_op.alter_column(column + '_new', new_column_name=column)
+    if connection.dialect.name == 'sqlite':
+        restore_search(table)
+
+
+def upgrade():
+    convert('Movie', 'release_date', sa.Date(), parse_date)
+    convert('Actor', 'age', sa.Integer(), parse_age)
+    op.create_index('ix_Movie_release_date', 'Movie', ['release_date'], unique=False)
+    op.create_index('ix_Actor_age', 'Actor', ['age'], unique=False)
+    op.create_index('ix_Actor_gender_age', 'Actor', ['gender', 'age'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_Actor_gender_age', table_name='Actor')
+    op.drop_index('ix_Actor_age', table_name='Actor')
+    op.drop_index('ix_Movie_release_date', table_name='Movie')
+    convert('Actor', 'age', sa.String(), str)
+    convert('Movie', 'release_date', sa.String(length=120), str)
@@ -0,0 +1,35 @@
+"""maintained row counters
+
+Revision ID: b7e21c4d9a3f
+Revises: 45834fdcf0d0
+Create Date: 2026-10-18 11:40:07.118532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e21c4d9a3f'
+down_revision = '45834fdcf0d0'
+branch_labels = None
+depends_on = None
+
+COUNTED_TABLES = ('Actor', 'Movie')
+
+
+def upgrade():
+    op.create_table('table_counts',
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('row_count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    for table in COUNTED_TABLES:
+        op.execute(
+            'INSERT INTO table_counts (table_name, row_count) '
+            'SELECT \'{0}\', COUNT(*) FROM "{0}"'.format(table)
+        )
+
+
+def downgrade():
+    op.drop_table('table_counts')
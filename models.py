@@ -1,32 +1,137 @@
 import os
-from sqlalchemy import Column, String, create_engine
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from flask_migrate import Migrate
-from sqlalchemy_utils import database_exists, create_database
+import re
+from sqlalchemy import Column, String, create_engine, event, DDL, func, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import attributes, validates
+from sqlalchemy.exc import IntegrityError
+import metrics
+from pools import pool_options, pool_stats
+from routing import RoutingSQLAlchemy, replicas
+from datetime import date, datetime
 import json
+from collections import namedtuple
 
-database_path = os.environ["DATABASE_URL"]
-if database_path.startswith("postgres://"):
-    database_path = database_path.replace("postgres://", "postgresql://", 1)
 
-db = SQLAlchemy()
+def database_url(url):
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    return url
+
+
+database_path = database_url(os.environ["DATABASE_URL"])
+# Comma separated URLs of read replicas of DATABASE_URL
+replica_paths = [
+    database_url(url.strip())
+    for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+    if url.strip()
+]
+
+db = RoutingSQLAlchemy()
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service. Reads of the safe
+    requests go to the replicas at `replica_paths`, if any (see routing),
+    and the engines' pools are sized per the DB_POOL_* settings (see pools).
+    Outside of BOOT_MODE=production, the database and its tables are also
+    created when missing.
 """
 
 
-def setup_db(app, database_path=database_path):
-    if not database_exists(database_path):
-        create_database(database_path)
+def setup_db(app, database_path=database_path, replica_paths=replica_paths):
+    production = app.config.get("BOOT_MODE") == "production"
+    if not production:
+        from sqlalchemy_utils import database_exists, create_database
+
+        if not database_exists(database_path):
+            create_database(database_path)
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    url = make_url(database_path)
+    if url.get_backend_name() != "sqlite":
+        # SQLite keeps Flask-SQLAlchemy's pools; the others are sized per DB_POOL_*
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = pool_options(
+            app.config, url.drivername
+        )
     db.app = app
     db.init_app(app)
-    migrate = Migrate(app, db)
-    db.create_all()
+    replicas.init_app(app, db, replica_paths)
+    # In production the schema is Alembic's alone (flask db upgrade), and
+    # Flask-Migrate is only needed by the flask command
+    if not production or os.environ.get("FLASK_RUN_FROM_CLI") == "true":
+        from flask_migrate import Migrate
+
+        migrate = Migrate(app, db)
+    if not production:
+        db.create_all()
+
+    def engines():
+        binds = ("primary", None), *((key, key) for key in replicas.keys)
+        return {name: db.get_engine(app, bind=bind) for name, bind in binds}
+
+    metrics.register("db_pool", lambda: pool_stats(engines()))
+
+
+"""
+parse_date(value) / parse_age(value)
+    tolerant parsing of release dates and ages as they were entered as text:
+    '28/12/2019', '2019-12-28', 'May 2020' or '2019' for dates (day first
+    unless the year comes first), '30' or '30+' for ages. Anything that
+    can't be read as one is None.
+"""
+
+
+def parse_date(value):
+    if value is None or isinstance(value, date):
+        return value
+    text = str(value).strip()
+    if not text:
+        return None
+    # Imported by the first date parsed rather than on boot
+    import dateutil.parser
+
+    year_first = re.match(r"\d{4}\D", text) is not None
+    try:
+        parsed = dateutil.parser.parse(
+            text,
+            dayfirst=not year_first,
+            yearfirst=year_first,
+            default=datetime(2000, 1, 1),
+        )
+    except (ValueError, OverflowError):
+        return None
+    return parsed.date()
+
+
+def parse_age(value):
+    if value is None or isinstance(value, int):
+        return value
+    match = re.search(r"\d+", str(value))
+    return int(match.group()) if match else None
+
+
+"""
+cast
+    association of actors with the movies they play in. The primary key
+    serves actor -> movies lookups, ix_cast_movie_actor movie -> actors.
+"""
+
+cast = db.Table(
+    "cast",
+    db.Column(
+        "actor_id",
+        db.Integer,
+        db.ForeignKey("Actor.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    db.Column(
+        "movie_id",
+        db.Integer,
+        db.ForeignKey("Movie.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    db.Index("ix_cast_movie_actor", "movie_id", "actor_id"),
+)
 
 
 class Actor(db.Model):
@@ -34,11 +139,23 @@ class Actor(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
-    age = db.Column(db.String)
+    age = db.Column(db.Integer, index=True)
     gender = db.Column(db.String)
     image_link = db.Column(db.String(500))
+    # Bumped on every UPDATE; a write based on a stale read fails (StaleDataError)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    # Number of cast rows of the actor, maintained by refresh_cast_counts()
+    movie_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
-    # movies = db.relationship('Movie', backref='actor', lazy=True)
+    __mapper_args__ = {"version_id_col": version}
+    __table_args__ = (db.Index("ix_Actor_gender_age", "gender", "age"),)
+
+    movies = db.relationship("Movie", secondary=cast, back_populates="actors")
+
+    @validates("age")
+    def validate_age(self, key, value):
+        return parse_age(value)
 
     def to_dict(self):
         return {
@@ -47,6 +164,7 @@ class Actor(db.Model):
             "age": self.age,
             "gender": self.gender,
             "image_link": self.image_link,
+            "movie_count": self.movie_count,
         }
 
     """
@@ -88,17 +206,31 @@ class Movie(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String)
-    release_date = db.Column(db.String(120))
+    release_date = db.Column(db.Date, index=True)
     image_link = db.Column(db.String(500))
+    # Bumped on every UPDATE; a write based on a stale read fails (StaleDataError)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    # Number of cast rows of the movie, maintained by refresh_cast_counts()
+    actor_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
-    # actors = db.relationship('Actor', backref='movie', lazy=True)
+    __mapper_args__ = {"version_id_col": version}
+
+    actors = db.relationship("Actor", secondary=cast, back_populates="movies")
+
+    @validates("release_date")
+    def validate_release_date(self, key, value):
+        return parse_date(value)
 
     def to_dict(self):
         return {
             "id": self.id,
             "title": self.title,
-            "release_date": self.release_date,
+            "release_date": (
+                self.release_date.isoformat() if self.release_date else None
+            ),
             "image_link": self.image_link,
+            "actor_count": self.actor_count,
         }
 
     """
@@ -133,3 +265,277 @@ class Movie(db.Model):
 
     def __repr__(self):
         return f"<Movie {self.id} {self.title}>"
+
+
+"""
+Change notifications
+    on_change(listener) registers `listener(changes)`, which is called after
+    every commit that inserted, updated or deleted Actor or Movie rows. Each
+    change is a Change(model, action, id, data) with data from to_dict().
+    Writes that bypass the ORM unit of work call notify_changes() themselves.
+"""
+
+Change = namedtuple("Change", "model action id data")
+TRACKED_MODELS = (Actor, Movie)
+_change_listeners = []
+
+
+def on_change(listener):
+    if listener not in _change_listeners:
+        _change_listeners.append(listener)
+    return listener
+
+
+def notify_changes(changes):
+    if changes:
+        for listener in list(_change_listeners):
+            listener(changes)
+
+
+@event.listens_for(db.session, "after_flush")
+def collect_changes(session, flush_context):
+    pending = session.info.setdefault("pending_changes", [])
+    for action, objects in (
+        ("insert", session.new),
+        ("update", session.dirty),
+        ("delete", session.deleted),
+    ):
+        for obj in objects:
+            if not isinstance(obj, TRACKED_MODELS):
+                continue
+            if action == "update" and not session.is_modified(obj):
+                continue
+            pending.append(Change(type(obj), action, obj.id, obj.to_dict()))
+
+
+@event.listens_for(db.session, "after_commit")
+def dispatch_changes(session):
+    notify_changes(session.info.pop("pending_changes", []))
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def discard_changes(session, previous_transaction):
+    session.info.pop("pending_changes", None)
+    session.info.pop("recount", None)
+
+
+"""
+Row counters
+    table_counts holds the row count of each tracked table and a change
+    counter bumped by every insert, update and delete. Both are adjusted in
+    the same transaction as the writes, so totals never need a COUNT(*) over
+    the table and the change counter works as a version of the whole table.
+    A missing row is seeded from COUNT(*) the first time it is read.
+"""
+
+
+class TableCount(db.Model):
+    __tablename__ = "table_counts"
+
+    table_name = db.Column(db.String(64), primary_key=True)
+    row_count = db.Column(db.BigInteger, nullable=False, default=0)
+    change_count = db.Column(
+        db.BigInteger, nullable=False, default=0, server_default="0"
+    )
+
+
+def adjust_row_count(connection, model, delta, changes=None):
+    """Adds `delta` rows and `changes` (default: abs(delta)) changes to `model`"""
+    changes = abs(delta) if changes is None else changes
+    if delta or changes:
+        connection.execute(
+            TableCount.__table__.update()
+            .where(TableCount.table_name == model.__tablename__)
+            .values(
+                row_count=TableCount.row_count + delta,
+                change_count=TableCount.change_count + changes,
+            )
+        )
+
+
+@event.listens_for(db.session, "after_flush")
+def count_rows(session, flush_context):
+    deltas = {}
+    for delta, objects in ((1, session.new), (0, session.dirty), (-1, session.deleted)):
+        for obj in objects:
+            if not isinstance(obj, TRACKED_MODELS):
+                continue
+            if not delta and not session.is_modified(obj):
+                continue
+            rows, changes = deltas.get(type(obj), (0, 0))
+            deltas[type(obj)] = (rows + delta, changes + 1)
+    for model, (delta, changes) in deltas.items():
+        adjust_row_count(session.connection(), model, delta, changes)
+
+
+def table_counter(model):
+    """Returns the TableCount row of `model`, seeding it if it is missing"""
+    counter = db.session.get(TableCount, model.__tablename__)
+    if counter is not None:
+        return counter
+
+    # Databases built by create_all() rather than the migrations start without
+    # it. It is seeded on a primary connection of its own, which counts the
+    # committed rows: a getter never commits the request's session, which may
+    # hold uncommitted writes or be reading from a replica.
+    try:
+        with db.engine.begin() as connection:
+            count = connection.execute(select(func.count(model.id))).scalar()
+            connection.execute(
+                TableCount.__table__.insert().values(
+                    table_name=model.__tablename__, row_count=count, change_count=0
+                )
+            )
+    except IntegrityError:
+        # Seeded concurrently by another worker
+        return db.session.get(TableCount, model.__tablename__)
+    return TableCount(table_name=model.__tablename__, row_count=count, change_count=0)
+
+
+def row_count(model, estimate=False):
+    """
+    Returns the number of rows of `model`. With estimate=True, Postgres'
+    planner estimate (pg_class.reltuples) is used when the table has been
+    analyzed, which costs nothing even on very large tables.
+    """
+    if estimate and db.engine.dialect.name == "postgresql":
+        reltuples = db.session.execute(
+            text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+            {"table": '"{}"'.format(model.__tablename__)},
+        ).scalar()
+        if reltuples is not None and reltuples >= 0:
+            return int(reltuples)
+    return table_counter(model).row_count
+
+
+def change_count(model):
+    """Returns the number of writes made to `model`'s table so far"""
+    return table_counter(model).change_count
+
+
+"""
+Cast counts
+    Actor.movie_count and Movie.actor_count are recounted from the cast
+    table with a correlated subquery, in the transaction that changed the
+    cast, for every actor and movie whose cast links changed. A recount
+    bumps the row's version and is reported as an update, like any other
+    change to the row.
+"""
+
+CAST_COUNTS = {
+    Actor: ("movie_count", cast.c.actor_id, cast.c.movie_id),
+    Movie: ("actor_count", cast.c.movie_id, cast.c.actor_id),
+}
+
+
+def refresh_cast_counts(session, ids):
+    """
+    Recounts the cast links of the rows in `ids` ({model: set of ids});
+    returns the Changes of the rows that still exist.
+    """
+    changes = []
+    for model, item_ids in ids.items():
+        if not item_ids:
+            continue
+        column, own_key, _ = CAST_COUNTS[model]
+        count = (
+            select(func.count())
+            .where(own_key == model.__table__.c.id)
+            .scalar_subquery()
+        )
+        session.connection().execute(
+            model.__table__.update()
+            .where(model.__table__.c.id.in_(item_ids))
+            .values({column: count, "version": model.__table__.c.version + 1})
+        )
+        rows = (
+            session.query(model)
+            .filter(model.id.in_(item_ids))
+            .populate_existing()
+            .all()
+        )
+        adjust_row_count(session.connection(), model, 0, len(rows))
+        changes.extend(Change(model, "update", row.id, row.to_dict()) for row in rows)
+    return changes
+
+
+def _cast_ids(session, model, item_id):
+    """Ids of the rows linked to one row through the cast table"""
+    _, own_key, other_key = CAST_COUNTS[model]
+    return set(session.execute(select(other_key).where(own_key == item_id)).scalars())
+
+
+@event.listens_for(db.session, "before_flush")
+def collect_deleted_casts(session, flush_context, instances):
+    # A deleted row takes its cast links with it; recount the other side
+    recount = session.info.setdefault("recount", {Actor: set(), Movie: set()})
+    for obj in session.deleted:
+        if isinstance(obj, TRACKED_MODELS) and obj.id is not None:
+            other = Movie if isinstance(obj, Actor) else Actor
+            recount[other] |= _cast_ids(session, type(obj), obj.id)
+
+
+@event.listens_for(db.session, "after_flush")
+def collect_cast_changes(session, flush_context):
+    recount = session.info.setdefault("recount", {Actor: set(), Movie: set()})
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, TRACKED_MODELS):
+            continue
+        key, other = ("movies", Movie) if isinstance(obj, Actor) else ("actors", Actor)
+        history = attributes.get_history(
+            obj, key, passive=attributes.PASSIVE_NO_INITIALIZE
+        )
+        linked = [
+            item.id for part in (history.added, history.deleted) for item in part or ()
+        ]
+        if linked:
+            recount[type(obj)].add(obj.id)
+            recount[other].update(linked)
+
+
+@event.listens_for(db.session, "after_flush_postexec")
+def recount_casts(session, flush_context):
+    recount = session.info.pop("recount", None)
+    if not recount:
+        return
+    changes = refresh_cast_counts(session, recount)
+    session.info.setdefault("pending_changes", []).extend(changes)
+
+
+"""
+Full-text search tables
+    On SQLite (tests, benchmarks) each searchable column is mirrored into an
+    external-content FTS5 table kept in sync by triggers. On Postgres the
+    trigram and tsvector indexes are created by the Alembic migration.
+"""
+
+
+def fts5_ddl(table, column):
+    fts = f"{table}_fts"
+    return [
+        f'CREATE VIRTUAL TABLE "{fts}" USING fts5({column}, '
+        f"content='{table}', content_rowid='id')",
+        f'CREATE TRIGGER "{fts}_ai" AFTER INSERT ON "{table}" BEGIN '
+        f'INSERT INTO "{fts}"(rowid, {column}) VALUES (new.id, new.{column}); END',
+        f'CREATE TRIGGER "{fts}_ad" AFTER DELETE ON "{table}" BEGIN '
+        f'INSERT INTO "{fts}"("{fts}", rowid, {column}) '
+        f"VALUES ('delete', old.id, old.{column}); END",
+        f'CREATE TRIGGER "{fts}_au" AFTER UPDATE ON "{table}" BEGIN '
+        f'INSERT INTO "{fts}"("{fts}", rowid, {column}) '
+        f"VALUES ('delete', old.id, old.{column}); "
+        f'INSERT INTO "{fts}"(rowid, {column}) VALUES (new.id, new.{column}); END',
+    ]
+
+
+for model, column in ((Actor, "name"), (Movie, "title")):
+    for statement in fts5_ddl(model.__tablename__, column):
+        event.listen(
+            model.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+        )
+    event.listen(
+        model.__table__,
+        "before_drop",
+        DDL(f'DROP TABLE IF EXISTS "{model.__tablename__}_fts"').execute_if(
+            dialect="sqlite"
+        ),
+    )
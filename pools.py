@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+"""
+pools
+    connection pools of the database engines
+
+    pool_options() turns the DB_POOL_* settings (app config, else the
+    environment) into the create_engine() options of the engines that pool
+    connections: the Postgres primary and replicas, while SQLite keeps
+    Flask-SQLAlchemy's pools. Their pool is an InstrumentedQueuePool (or
+    InstrumentedAsyncQueuePool for the asyncio engine of asgi.py), which
+    records how long each checkout waited; pool_stats() reports that
+    histogram with the in-use and overflow gauges, under db_pool in /metrics.
+
+    DB_PGBOUNCER=1 is for a PgBouncer in transaction mode in front of the
+    database: connections are pre-pinged, and drivers that prepare
+    statements on the server (asyncpg) don't, as the transactions of one
+    client connection may run on different server connections.
+"""
+
+
+def _flag(value):
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+# Setting: (parser, default)
+SETTINGS = {
+    "DB_POOL_SIZE": (int, 5),
+    "DB_MAX_OVERFLOW": (int, 10),
+    "DB_POOL_TIMEOUT": (float, 30),
+    # Seconds after which a connection is replaced, -1 for never
+    "DB_POOL_RECYCLE": (int, -1),
+    "DB_POOL_PRE_PING": (_flag, False),
+    "DB_PGBOUNCER": (_flag, False),
+}
+
+# Drivers of the asyncio engines
+ASYNC_DRIVERS = ("asyncpg", "aiosqlite")
+
+# Upper bounds of the checkout wait buckets, in milliseconds
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+def pool_settings(config):
+    settings = {}
+    for name, (parse, default) in SETTINGS.items():
+        value = config.get(name, os.getenv(name))
+        settings[name] = default if value in (None, "") else parse(value)
+    return settings
+
+
+def pool_options(config, drivername):
+    """create_engine() options of a pooled engine of `drivername`"""
+    settings = pool_settings(config)
+    is_async = drivername.partition("+")[2] in ASYNC_DRIVERS
+    options = {
+        "poolclass": InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        "pool_size": settings["DB_POOL_SIZE"],
+        "max_overflow": settings["DB_MAX_OVERFLOW"],
+        "pool_timeout": settings["DB_POOL_TIMEOUT"],
+        "pool_recycle": settings["DB_POOL_RECYCLE"],
+        "pool_pre_ping": settings["DB_POOL_PRE_PING"] or settings["DB_PGBOUNCER"],
+    }
+    if settings["DB_PGBOUNCER"] and drivername.endswith("+asyncpg"):
+        options["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+        }
+    return options
+
+
+class WaitHistogram:
+    """Histogram of checkout waits, cumulative like Prometheus' buckets"""
+
+    def __init__(self, buckets=WAIT_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, timed_out=False):
+        ms = seconds * 1000
+        with self._lock:
+            self.counts[bisect_left(self.buckets, ms)] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+            if timed_out:
+                self.timeouts += 1
+
+    def stats(self):
+        with self._lock:
+            counts = list(self.counts)
+            stats = {
+                "count": self.count,
+                "sum_ms": round(self.total_ms, 3),
+                "max_ms": round(self.max_ms, 3),
+                "timeouts": self.timeouts,
+            }
+        buckets = {}
+        seen = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            seen += count
+            buckets["le_{}".format(bound)] = seen
+        stats["buckets"] = buckets
+        return stats
+
+
+class CheckoutTiming:
+    """Times the checkouts of a QueuePool"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = WaitHistogram()
+
+    def _do_get(self):
+        # The wait includes opening a connection when the pool has room for one
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self.waits.observe(time.perf_counter() - started, timed_out)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.waits = self.waits
+        return pool
+
+    def stats(self):
+        return {
+            "size": self.size(),
+            "in_use": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": max(self.overflow(), 0),
+            "waits": self.waits.stats(),
+        }
+
+
+class InstrumentedQueuePool(CheckoutTiming, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(CheckoutTiming, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_stats(engines):
+    """Gauges and checkout waits of the instrumented pools of `engines`, by name"""
+    return {
+        name: engine.pool.stats()
+        for name, engine in engines.items()
+        if isinstance(engine.pool, CheckoutTiming)
+    }
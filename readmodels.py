@@ -0,0 +1,129 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from sqlalchemy import lambda_stmt, select
+
+from models import db, Actor, Movie
+
+"""
+readmodels
+    lightweight read path of the list, detail and search endpoints
+
+    Reads are Core select() statements on the tables, whose rows become
+    ActorRow / MovieRow named tuples: the columns of the table as plain
+    attributes, and the same to_dict() as the mapped classes, so views and
+    templates take either. No mapped instance, identity map entry or
+    instrumented attribute is built, and a row costs one tuple.
+
+    Statements of a fixed shape (a row by id, rows by ids) are lambda
+    statements: they are built and compiled once, and only their bound
+    values change from call to call. Writes stay on the ORM.
+"""
+
+_ACTOR_COLUMNS = tuple(column.key for column in Actor.__table__.c)
+_MOVIE_COLUMNS = tuple(column.key for column in Movie.__table__.c)
+
+
+class ActorRow(
+    namedtuple("ActorRow", _ACTOR_COLUMNS, defaults=(None,) * len(_ACTOR_COLUMNS))
+):
+    __slots__ = ()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "age": self.age,
+            "gender": self.gender,
+            "image_link": self.image_link,
+            "movie_count": self.movie_count,
+        }
+
+
+class MovieRow(
+    namedtuple("MovieRow", _MOVIE_COLUMNS, defaults=(None,) * len(_MOVIE_COLUMNS))
+):
+    __slots__ = ()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "release_date": (
+                self.release_date.isoformat() if self.release_date else None
+            ),
+            "image_link": self.image_link,
+            "actor_count": self.actor_count,
+        }
+
+
+ROW_TYPES = {Actor: ActorRow, Movie: MovieRow}
+
+
+def select_rows(model, fields=None, extra=()):
+    """
+    Core select of the table of `model`: every column, or only those of
+    `fields` plus the `extra` columns (e.g. a sort key)
+    """
+    table = model.__table__
+    if fields is None:
+        return select(table)
+    columns = [table.c[name] for name in fields]
+    columns.extend(column for column in extra if column.key not in fields)
+    return select(*columns)
+
+
+@lru_cache(maxsize=None)
+def _row_factory(model, keys):
+    """Builds the rows of a result with these column keys"""
+    row_type = ROW_TYPES[model]
+    if keys == row_type._fields:
+        return row_type._make
+    # A projection: the columns left out are None
+    return lambda row: row_type(**dict(zip(keys, row)))
+
+
+def iter_rows(model, statement, batch_size=None):
+    """
+    Yields the rows of a statement as row types. With `batch_size`, they
+    are read through a server-side cursor, that many at a time.
+    """
+    if batch_size is not None:
+        statement = statement.execution_options(stream_results=True)
+    result = db.session.connection().execute(statement)
+    if batch_size is not None:
+        result = result.yield_per(batch_size)
+    make_row = _row_factory(model, tuple(result.keys()))
+    for row in result:
+        yield make_row(row)
+
+
+def fetch_rows(model, statement):
+    return list(iter_rows(model, statement))
+
+
+def make_rows(model, result):
+    """The rows of a result already read, e.g. on an asyncio connection"""
+    make_row = _row_factory(model, tuple(result.keys()))
+    return [make_row(row) for row in result]
+
+
+def row_statement(model, item_id):
+    table = model.__table__
+    return lambda_stmt(lambda: select(table).where(table.c.id == item_id))
+
+
+def get_row(model, item_id):
+    """The row of `item_id`, or None"""
+    rows = fetch_rows(model, row_statement(model, item_id))
+    return rows[0] if rows else None
+
+
+def get_rows(model, ids):
+    """The rows of `ids`, in id order"""
+    table = model.__table__
+    ids = list(ids)
+    statement = lambda_stmt(
+        lambda: select(table).where(table.c.id.in_(ids)).order_by(table.c.id)
+    )
+    return fetch_rows(model, statement)
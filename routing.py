@@ -0,0 +1,258 @@
+import hashlib
+import itertools
+import math
+import os
+import threading
+import time
+
+from flask import request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm, text
+
+import metrics
+
+"""
+routing
+    read replicas for the requests that only read
+
+    RoutingSession is the class of db.session: while a replica engine is
+    set on the session (session.info["replica"]), its queries go to that
+    replica and its flushes still go to the primary. Replicas sets one for
+    GET / HEAD / OPTIONS requests and for the views marked read_only (the
+    search POSTs), round robin over the replicas that passed their last
+    health check. A replica that can't be reached, or whose replay is more
+    than max_lag seconds behind the primary, is left out until it passes a
+    check again; with none left, reads go to the primary.
+
+    A client that just wrote reads from the primary for sticky_seconds, so
+    it sees its own writes: within a worker clients are told apart by their
+    Authorization header (or address), across workers by a cookie.
+"""
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+STICKY_SECONDS = 5
+MAX_LAG = 10
+CHECK_INTERVAL = 10
+STICKY_COOKIE = "read_primary_until"
+# Past this many clients, expired stickiness is pruned
+MAX_STICKY_CLIENTS = 10000
+
+# Seconds a Postgres standby's replay is behind, 0 once it replayed all it received
+LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get("replica")
+        if replica is not None and not self._flushing:
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class Replicas:
+    def __init__(
+        self,
+        sticky_seconds=STICKY_SECONDS,
+        max_lag=MAX_LAG,
+        check_interval=CHECK_INTERVAL,
+    ):
+        self.sticky_seconds = sticky_seconds
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.app = None
+        self.db = None
+        self.keys = ()
+        self.healthy = ()
+        self.lag = {}
+        self.read_only_endpoints = set()
+        self.routed = 0
+        self.primary_reads = 0
+        self.dropped = 0
+        self._engines = {}
+        self._sticky = {}
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._checking = False
+
+    def init_app(self, app, db, urls=()):
+        """Registers `urls` as the replicas of the app's database, as binds replica_<n>"""
+        self.app = app
+        self.db = db
+        self.keys = tuple("replica_{}".format(i) for i in range(len(urls)))
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds.update(zip(self.keys, urls))
+        app.config["SQLALCHEMY_BINDS"] = binds
+        for name, default in (
+            ("sticky_seconds", STICKY_SECONDS),
+            ("max_lag", MAX_LAG),
+            ("check_interval", CHECK_INTERVAL),
+        ):
+            setting = "REPLICA_" + name.upper()
+            value = app.config.get(setting, os.getenv(setting, default))
+            setattr(self, name, float(value))
+
+        self.healthy = ()
+        self.lag = {}
+        self._engines = {}
+        self._sticky = {}
+        self._checked_at = None
+        if "replicas" not in app.extensions:
+            app.extensions["replicas"] = self
+            app.before_request(self._route)
+            app.after_request(self._stick)
+        metrics.register("replicas", self.stats)
+
+    def read_only(self, f):
+        """Marks a view that only reads, though not with a safe method"""
+        self.read_only_endpoints.add(f.__name__)
+        return f
+
+    def _engine(self, key):
+        engine = self._engines.get(key)
+        if engine is None:
+            engine = self.db.get_engine(self.app, bind=key)
+
+            @event.listens_for(engine, "handle_error")
+            def drop_on_disconnect(context):
+                if context.is_disconnect:
+                    self._drop(key)
+
+            self._engines[key] = engine
+        return engine
+
+    def _drop(self, key):
+        with self._lock:
+            if key in self.healthy:
+                self.healthy = tuple(k for k in self.healthy if k != key)
+                self.dropped += 1
+
+    def check(self):
+        """Checks every replica, keeping those reachable and within max_lag"""
+        healthy = []
+        lag = {}
+        for key in self.keys:
+            try:
+                with self._engine(key).connect() as connection:
+                    if connection.dialect.name == "postgresql":
+                        seconds = connection.execute(LAG_QUERY).scalar()
+                    else:
+                        seconds = connection.execute(text("SELECT 0")).scalar()
+            except Exception:
+                lag[key] = None
+                continue
+            lag[key] = float(seconds or 0)
+            if lag[key] <= self.max_lag:
+                healthy.append(key)
+
+        with self._lock:
+            self.dropped += len(set(self.healthy) - set(healthy))
+            self.healthy = tuple(healthy)
+            self.lag = lag
+
+    def _maybe_check(self):
+        now = time.monotonic()
+        if self._checked_at is None:
+            # The first request waits for the first check
+            self._checked_at = now
+            self.check()
+            return
+        if self._checking or now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        self._checking = True
+
+        def run():
+            try:
+                self.check()
+            finally:
+                self._checking = False
+
+        threading.Thread(target=run, name="replica-check", daemon=True).start()
+
+    def pick(self):
+        """The engine of a healthy replica, or None to use the primary"""
+        self._maybe_check()
+        healthy = self.healthy
+        if not healthy:
+            return None
+        return self._engine(healthy[next(self._round_robin) % len(healthy)])
+
+    def _client(self):
+        identity = request.headers.get("Authorization") or request.remote_addr or ""
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+    def _reads_only(self):
+        return (
+            request.method in SAFE_METHODS
+            or request.endpoint in self.read_only_endpoints
+        )
+
+    def _is_sticky(self):
+        now = time.time()
+        try:
+            if float(request.cookies.get(STICKY_COOKIE, 0)) > now:
+                return True
+        except ValueError:
+            pass
+        return self._sticky.get(self._client(), 0) > now
+
+    def _route(self):
+        if not self.keys or not self._reads_only():
+            return
+        engine = None if self._is_sticky() else self.pick()
+        if engine is None:
+            self.primary_reads += 1
+            return
+        self.db.session.info["replica"] = engine
+        self.routed += 1
+
+    def _stick(self, response):
+        """After a write, keeps the client's reads on the primary for a while"""
+        if (
+            not self.keys
+            or self.sticky_seconds <= 0
+            or self._reads_only()
+            or response.status_code >= 400
+        ):
+            return response
+        until = time.time() + self.sticky_seconds
+        with self._lock:
+            if len(self._sticky) >= MAX_STICKY_CLIENTS:
+                now = time.time()
+                self._sticky = {
+                    client: expiry
+                    for client, expiry in self._sticky.items()
+                    if expiry > now
+                }
+            self._sticky[self._client()] = until
+        response.set_cookie(
+            STICKY_COOKIE,
+            "{:.3f}".format(until),
+            max_age=math.ceil(self.sticky_seconds),
+            httponly=True,
+        )
+        return response
+
+    def stats(self):
+        return {
+            "replicas": len(self.keys),
+            "healthy": len(self.healthy),
+            "lag_seconds": dict(self.lag),
+            "routed": self.routed,
+            "primary_reads": self.primary_reads,
+            "dropped": self.dropped,
+            "sticky_clients": len(self._sticky),
+        }
+
+
+replicas = Replicas()
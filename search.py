@@ -0,0 +1,129 @@
+import re
+
+from sqlalchemy import (
+    column as sql_column,
+    func,
+    literal_column,
+    or_,
+    select,
+    table,
+    text,
+)
+
+from models import db, Actor, Movie
+from readmodels import fetch_rows, select_rows
+
+"""
+search
+    ranked, index-backed search over actor names and movie titles
+
+    - Postgres: ILIKE and `%` similarity served by the pg_trgm GIN index, plus
+      a tsvector match; ranked by similarity and ts_rank
+    - SQLite: the FTS5 table created alongside the model, ranked by bm25
+    - anything else (or a missing extension / FTS table): plain ILIKE
+    Matches are read as readmodels rows, not mapped instances.
+"""
+
+SEARCH_COLUMNS = {Actor: "name", Movie: "title"}
+SEARCH_ITEMS_PER_PAGE = 20
+MAX_SEARCH_ITEMS_PER_PAGE = 100
+
+_capabilities = {}
+
+
+def _capability(connection, key, sql, **params):
+    """Runs a catalog probe once per database and remembers the answer"""
+    key = (str(connection.engine.url), key)
+    if key not in _capabilities:
+        row = connection.execute(text(sql), params).first()
+        _capabilities[key] = row is not None
+    return _capabilities[key]
+
+
+def _like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return "%{}%".format(escaped)
+
+
+def _postgres_search(connection, model, column, term):
+    document = func.to_tsvector(
+        literal_column("'simple'::regconfig"), func.coalesce(column, "")
+    )
+    tsquery = func.plainto_tsquery(literal_column("'simple'::regconfig"), term)
+    conditions = [
+        column.ilike(_like_pattern(term), escape="\\"),
+        document.op("@@")(tsquery),
+    ]
+    rank = func.ts_rank(document, tsquery)
+
+    has_trgm = _capability(
+        connection, "pg_trgm", "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+    )
+    if has_trgm:
+        conditions.append(column.op("%")(term))
+        rank = rank + func.similarity(column, term)
+
+    query = select_rows(model).where(or_(*conditions))
+    return query, [rank.desc(), model.__table__.c.id]
+
+
+def _sqlite_search(connection, model, column, term):
+    fts = "{}_fts".format(model.__tablename__)
+    has_fts = _capability(
+        connection,
+        fts,
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name",
+        name=fts,
+    )
+    tokens = re.findall(r"\w+", term)
+    if not has_fts or not tokens:
+        return _like_search(model, column, term)
+
+    match = " ".join('"{}"*'.format(token) for token in tokens)
+    fts_table = table(fts, sql_column("rowid"))
+    id_column = model.__table__.c.id
+    query = (
+        select_rows(model)
+        .join(fts_table, fts_table.c.rowid == id_column)
+        .where(text('"{}" MATCH :match'.format(fts)).bindparams(match=match))
+    )
+    return query, [text('bm25("{}")'.format(fts)), id_column]
+
+
+def _like_search(model, column, term):
+    query = select_rows(model).where(column.ilike(_like_pattern(term), escape="\\"))
+    return query, [model.__table__.c.id]
+
+
+def search_statements(connection, model, term, limit=SEARCH_ITEMS_PER_PAGE, page=1):
+    """
+    Returns the statements of a search on `connection`'s database: one
+    page of the rows matching `term`, most relevant first, and the count of
+    all the matching rows
+    """
+    limit = max(1, min(limit, MAX_SEARCH_ITEMS_PER_PAGE))
+    page = max(1, page)
+    column = model.__table__.c[SEARCH_COLUMNS[model]]
+    dialect = connection.dialect.name
+
+    if dialect == "postgresql":
+        query, order_by = _postgres_search(connection, model, column, term)
+    elif dialect == "sqlite":
+        query, order_by = _sqlite_search(connection, model, column, term)
+    else:
+        query, order_by = _like_search(model, column, term)
+
+    counted = select(func.count()).select_from(query.order_by(None).subquery())
+    page_rows = query.order_by(*order_by).limit(limit).offset((page - 1) * limit)
+    return page_rows, counted
+
+
+def search(model, term, limit=SEARCH_ITEMS_PER_PAGE, page=1):
+    """
+    Returns (rows, total): one page of the rows matching `term` as to_dict()
+    dicts, most relevant first, and the number of matching rows.
+    """
+    connection = db.session.connection()
+    page_rows, counted = search_statements(connection, model, term, limit, page)
+    total = connection.execute(counted).scalar()
+    return [item.to_dict() for item in fetch_rows(model, page_rows)], total
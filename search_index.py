@@ -0,0 +1,341 @@
+import heapq
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+
+import metrics
+from models import db, change_count, on_change
+from readmodels import iter_rows, select_rows
+from search import SEARCH_COLUMNS
+
+"""
+search_index
+    in-memory indexes over actor names and movie titles
+
+    - search_engine: inverted trigram indexes answering /actors/search and
+      /movies/search when SEARCH_ENGINE=memory, built when the app starts
+    - suggest_index: sorted-array prefix indexes behind the autocomplete
+      endpoints, built on first use
+
+    Both are kept up to date from the commit-time change notifications of
+    models.py and resynced from the database whenever the table's change
+    counter moves past them (e.g. writes made by another worker).
+"""
+
+SIMILARITY_THRESHOLD = 0.3
+
+# Index entries looked at per autocomplete lookup
+MAX_SUGGEST_SCAN = 500
+
+
+def normalize(text):
+    """Lower-cases and strips accents, so 'Zoë' and 'zoe' index alike"""
+    text = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def trigrams(text):
+    """pg_trgm style trigrams: every word padded with two blanks before, one after"""
+    grams = set()
+    for word in re.findall(r"\w+", normalize(text)):
+        padded = "  " + word + " "
+        for i in range(len(padded) - 2):
+            grams.add(padded[i : i + 3])
+    return grams
+
+
+def deep_sizeof(obj, seen=None):
+    """Approximate memory held by a structure of dicts, sets, tuples and strings"""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+class TrigramIndex:
+    def __init__(self, model):
+        self.model = model
+        self.column = SEARCH_COLUMNS[model]
+        self.watermark = None
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._postings = defaultdict(set)
+
+    def build(self, rows, watermark=None):
+        """Replaces the whole index with the given to_dict() rows"""
+        docs, postings = {}, defaultdict(set)
+        for data in rows:
+            grams = frozenset(trigrams(data[self.column]))
+            docs[data["id"]] = (normalize(data[self.column]), grams, data)
+            for gram in grams:
+                postings[gram].add(data["id"])
+
+        with self._lock:
+            self._docs, self._postings = docs, postings
+            self.watermark = watermark
+
+    def add(self, data):
+        with self._lock:
+            self._remove(data["id"])
+            grams = frozenset(trigrams(data[self.column]))
+            self._docs[data["id"]] = (normalize(data[self.column]), grams, data)
+            for gram in grams:
+                self._postings[gram].add(data["id"])
+
+    def remove(self, item_id):
+        with self._lock:
+            self._remove(item_id)
+
+    def _remove(self, item_id):
+        doc = self._docs.pop(item_id, None)
+        if doc is None:
+            return
+        for gram in doc[1]:
+            ids = self._postings.get(gram)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self._postings[gram]
+
+    def search(self, term, limit, page=1):
+        """
+        Returns (rows, total): one page of the rows containing `term` or
+        similar enough to it, best match first.
+        """
+        query = normalize(term).strip()
+        query_grams = trigrams(term)
+        if not query_grams:
+            return [], 0
+
+        with self._lock:
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self._postings.get(gram, ()))
+
+            matches = []
+            for item_id, count in shared.items():
+                text, grams, data = self._docs[item_id]
+                similarity = count / (len(query_grams) + len(grams) - count)
+                contains = query in text
+                if contains or similarity >= SIMILARITY_THRESHOLD:
+                    matches.append((similarity + contains, -item_id, data))
+
+        top = heapq.nlargest(limit * page, matches, key=lambda match: match[:2])
+        return [data for _, _, data in top[(page - 1) * limit :]], len(matches)
+
+    def stats(self):
+        with self._lock:
+            memory = deep_sizeof(self._docs) + deep_sizeof(self._postings)
+            return {
+                "documents": len(self._docs),
+                "trigrams": len(self._postings),
+                "memory_bytes": memory,
+            }
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index for autocomplete: one (key, id) entry per word
+    of a label, the key running from that word to the end of the label.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.column = SEARCH_COLUMNS[model]
+        self.watermark = None
+        self._lock = threading.Lock()
+        self._keys = []
+        self._ids = array("q")
+        self._labels = {}
+
+    @staticmethod
+    def _normalize(label):
+        return " ".join(re.findall(r"\w+", normalize(label)))
+
+    @staticmethod
+    def _word_keys(text):
+        starts = [0] + [i + 1 for i, char in enumerate(text) if char == " "]
+        return [text[start:] for start in starts] if text else []
+
+    def build(self, rows, watermark=None):
+        """Replaces the whole index with the given to_dict() rows"""
+        entries, labels = [], {}
+        for data in rows:
+            text = self._normalize(data[self.column])
+            labels[data["id"]] = (data[self.column], text)
+            entries.extend((key, data["id"]) for key in self._word_keys(text))
+        entries.sort()
+
+        with self._lock:
+            self._keys = [key for key, _ in entries]
+            self._ids = array("q", (item_id for _, item_id in entries))
+            self._labels = labels
+            self.watermark = watermark
+
+    def add(self, data):
+        with self._lock:
+            self._remove(data["id"])
+            text = self._normalize(data[self.column])
+            self._labels[data["id"]] = (data[self.column], text)
+            for key in self._word_keys(text):
+                i = bisect_right(self._keys, key)
+                self._keys.insert(i, key)
+                self._ids.insert(i, data["id"])
+
+    def remove(self, item_id):
+        with self._lock:
+            self._remove(item_id)
+
+    def _remove(self, item_id):
+        label = self._labels.pop(item_id, None)
+        if label is None:
+            return
+        for key in self._word_keys(label[1]):
+            i = bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i] == key:
+                if self._ids[i] == item_id:
+                    del self._keys[i]
+                    del self._ids[i]
+                    break
+                i += 1
+
+    def suggest(self, prefix, limit):
+        """
+        Returns up to `limit` {id, label} dicts whose label has a word starting
+        with `prefix`; labels that start with it come first, then shorter ones.
+        """
+        prefix = self._normalize(prefix)
+        if not prefix:
+            return []
+
+        with self._lock:
+            matches = {}
+            i = bisect_left(self._keys, prefix)
+            end = min(len(self._keys), i + MAX_SUGGEST_SCAN)
+            while i < end and self._keys[i].startswith(prefix):
+                item_id = self._ids[i]
+                if item_id not in matches:
+                    label, text = self._labels[item_id]
+                    matches[item_id] = (not text.startswith(prefix), len(text), label)
+                i += 1
+
+        top = heapq.nsmallest(limit, matches.items(), key=lambda match: match[1])
+        return [{"id": item_id, self.column: rank[2]} for item_id, rank in top]
+
+    def stats(self):
+        with self._lock:
+            memory = (
+                deep_sizeof(self._keys)
+                + sys.getsizeof(self._ids)
+                + deep_sizeof(self._labels)
+            )
+            return {
+                "documents": len(self._labels),
+                "entries": len(self._keys),
+                "memory_bytes": memory,
+            }
+
+
+class IndexSet:
+    """
+    Holds one in-memory index per model and keeps it in step with the
+    database. With lazy=True an index is built on its first use instead of
+    when the app starts.
+    """
+
+    def __init__(self, index_class, name, resync_interval=60, lazy=False):
+        self.name = name
+        self.resync_interval = resync_interval
+        self.lazy = lazy
+        self.indexes = {model: index_class(model) for model in SEARCH_COLUMNS}
+        self.app = None
+        self._built = set()
+        self._checked_at = 0.0
+        self._resyncing = False
+
+    def init_app(self, app):
+        self.app = app
+        if not self.lazy:
+            with app.app_context():
+                for model in self.indexes:
+                    self.rebuild(model)
+        self._checked_at = time.monotonic()
+        on_change(self.apply)
+        metrics.register(self.name, self.stats)
+
+    def get(self, model):
+        """Returns the index of `model`, building it first if needed"""
+        if model not in self._built:
+            self.rebuild(model)
+        self._maybe_resync()
+        return self.indexes[model]
+
+    def watermark(self, model):
+        return change_count(model)
+
+    def rebuild(self, model):
+        watermark = self.watermark(model)
+        rows = (item.to_dict() for item in iter_rows(model, select_rows(model), 1000))
+        self.indexes[model].build(rows, watermark)
+        self._built.add(model)
+
+    def resync(self):
+        """Rebuilds every index whose table moved since it was built"""
+        with self.app.app_context():
+            for model, index in self.indexes.items():
+                if model in self._built and self.watermark(model) != index.watermark:
+                    self.rebuild(model)
+            db.session.remove()
+
+    def _maybe_resync(self):
+        now = time.monotonic()
+        if self._resyncing or now - self._checked_at < self.resync_interval:
+            return
+        self._checked_at = now
+        self._resyncing = True
+
+        def run():
+            try:
+                self.resync()
+            finally:
+                self._resyncing = False
+
+        threading.Thread(target=run, name=self.name + "-resync", daemon=True).start()
+
+    def apply(self, changes):
+        for change in changes:
+            if change.model not in self._built:
+                continue
+            index = self.indexes[change.model]
+            if change.action == "delete":
+                index.remove(change.id)
+            else:
+                index.add(change.data)
+            index.watermark = self._advance(index.watermark, change)
+
+    @staticmethod
+    def _advance(watermark, change):
+        """Moves a change counter watermark past a change made by this worker"""
+        return None if watermark is None else watermark + 1
+
+    def stats(self):
+        return {
+            model.__tablename__: index.stats()
+            for model, index in self.indexes.items()
+            if model in self._built
+        }
+
+
+search_engine = IndexSet(TrigramIndex, "search_index")
+suggest_index = IndexSet(PrefixIndex, "suggest_index", lazy=True)
@@ -0,0 +1,144 @@
+import json
+
+from flask import current_app
+from flask.json import JSONEncoder as FlaskJSONEncoder
+
+import metrics
+from cache import LRUBackend
+from models import on_change
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+serialization
+    JSON encoding of the responses
+
+    JSONEncoder is the app's json_encoder (Flask 1.1's extension point for
+    jsonify): it encodes with orjson when the package is installed, and
+    with the standard library otherwise. Values orjson can't encode itself
+    (dates, or objects with __html__) go through Flask's default(), so both
+    produce the same documents.
+
+    Fragments caches the encoded bytes of each row along with its version:
+    a write bumps the version, so the fragment no longer matches and is
+    encoded again; a delete drops it. List pages are assembled from the
+    fragments with json_response() instead of encoding every row again.
+"""
+
+FRAGMENT_CACHE_BYTES = 16 * 1024 * 1024
+# Entries are checked against the row version, so they just expire eventually
+FRAGMENT_TTL = 24 * 3600
+
+
+def _orjson_options(sort_keys):
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if sort_keys:
+        options |= orjson.OPT_SORT_KEYS
+    return options
+
+
+class JSONEncoder(FlaskJSONEncoder):
+    def encode(self, o):
+        # orjson only writes compact documents; indented ones (debug) stay on json
+        if orjson is None or self.indent is not None:
+            return super().encode(o)
+        try:
+            encoded = orjson.dumps(
+                o, default=self.default, option=_orjson_options(self.sort_keys)
+            )
+        except TypeError:
+            # e.g. integers past 64 bits
+            return super().encode(o)
+        return encoded.decode("utf-8")
+
+
+def dumps(obj):
+    """Compact JSON bytes of obj, keys sorted like jsonify"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=_orjson_options(True))
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+
+class Encoded(bytes):
+    """A value already encoded as JSON, written as is by json_response()"""
+
+
+def encode_document(document):
+    """
+    The JSON bytes of `document`, a dict whose values are either plain
+    values or Encoded bytes, with its keys sorted like jsonify
+    """
+    parts = [
+        dumps(key) + b":" + (value if isinstance(value, Encoded) else dumps(value))
+        for key, value in sorted(document.items())
+    ]
+    return b"{" + b",".join(parts) + b"}\n"
+
+
+def json_response(document):
+    """A JSON response of encode_document(document)"""
+    return current_app.response_class(
+        encode_document(document), mimetype=current_app.config["JSONIFY_MIMETYPE"]
+    )
+
+
+class Fragments:
+    def __init__(self, max_bytes=FRAGMENT_CACHE_BYTES):
+        self.backend = LRUBackend(max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        on_change(self.invalidate)
+        metrics.register("json_fragments", self.stats)
+
+    @staticmethod
+    def _key(model, item_id):
+        return "{}:{}".format(model.__tablename__, item_id)
+
+    def encode(self, model, row):
+        """The JSON bytes of row.to_dict(), from the cache when the version matches"""
+        key = self._key(model, row.id)
+        version = str(row.version).encode("ascii")
+        entry = self.backend.get(key)
+        if entry is not None:
+            cached_version, fragment = entry.split(b"\n", 1)
+            if cached_version == version:
+                self.hits += 1
+                return fragment
+        self.misses += 1
+        fragment = dumps(row.to_dict())
+        self.backend.set(key, version + b"\n" + fragment, FRAGMENT_TTL)
+        return fragment
+
+    def encode_list(self, model, rows):
+        return Encoded(b"[" + b",".join(self.encode(model, row) for row in rows) + b"]")
+
+    def invalidate(self, changes):
+        """Drops the fragments of deleted rows"""
+        for change in changes:
+            if change.action == "delete":
+                self.backend.delete(self._key(change.model, change.id))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "orjson": orjson is not None,
+        }
+        stats.update(self.backend.stats())
+        return stats
+
+
+fragments = Fragments()
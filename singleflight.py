@@ -0,0 +1,158 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+"""
+singleflight
+    request coalescing for the read endpoints
+
+    SingleFlight.do(key, fn) runs fn once per key at a time: callers arriving
+    while a call for the same key is in flight wait for it and share its
+    result instead of running the same query and serialization again.
+
+    FileSingleFlight also coalesces the calls for a key across worker
+    processes. The worker that runs fn leaves a marker file for the key
+    while it runs; workers that find a fresh marker wait until it is gone,
+    then find the result in the shared response cache (RESPONSE_CACHE=redis)
+    instead of computing it again. Markers are checked, written and removed
+    under an flock() of one of LOCK_STRIPES lock files, which is never held
+    while fn runs, so a slow call doesn't hold up other keys. The directory
+    holds the stripes plus a marker per call in flight. A marker older than
+    the timeout is left by a worker that died, and is taken over.
+"""
+
+# Seconds a caller waits for the call in flight before running fn itself
+SINGLE_FLIGHT_TIMEOUT = 10
+
+# Lock files are shared by keys hashing alike, to bound their number
+LOCK_STRIPES = 256
+
+# Seconds between checks of a marker left by another worker
+MARKER_POLL_INTERVAL = 0.02
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self.flights = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        Returns (result, shared): the result of fn, and whether it came from
+        a call made by another caller. Errors of that call are raised too.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.flights += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                self.timeouts += 1
+                return fn(), False
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            "flights": self.flights,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "in_flight": in_flight,
+        }
+
+
+class FileSingleFlight(SingleFlight):
+    def __init__(self, directory=None, timeout=SINGLE_FLIGHT_TIMEOUT):
+        super().__init__(timeout)
+        self.directory = directory or os.path.join(
+            tempfile.gettempdir(), "casting-agency-flights"
+        )
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _paths(self, key):
+        """The stripe lock file and the marker of `key`"""
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        stripe = int(digest[:8], 16) % LOCK_STRIPES
+        return (
+            os.path.join(self.directory, "{:03d}.lock".format(stripe)),
+            os.path.join(self.directory, "{}.flight".format(digest)),
+        )
+
+    def _locked(self, lock_path, action):
+        with open(lock_path, "a") as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                return action()
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _claim(self, marker, token):
+        """Writes the marker unless another worker's fresh one is there"""
+        try:
+            if time.time() - os.stat(marker).st_mtime < self.timeout:
+                return False
+        except FileNotFoundError:
+            pass
+        with open(marker, "w") as handle:
+            handle.write(token)
+        return True
+
+    def _release(self, marker, token):
+        # A worker that took over a stale marker owns it now
+        try:
+            with open(marker) as handle:
+                if handle.read() != token:
+                    return
+            os.unlink(marker)
+        except FileNotFoundError:
+            pass
+
+    def do(self, key, fn):
+        def flight():
+            lock_path, marker = self._paths(key)
+            token = uuid.uuid4().hex
+            if not self._locked(lock_path, lambda: self._claim(marker, token)):
+                deadline = time.monotonic() + self.timeout
+                while os.path.exists(marker) and time.monotonic() < deadline:
+                    time.sleep(MARKER_POLL_INTERVAL)
+                return fn()
+            try:
+                return fn()
+            finally:
+                self._locked(lock_path, lambda: self._release(marker, token))
+
+        return super().do(key, flight)
@@ -1,12 +1,40 @@
 import os
 import unittest
+import itertools
 import json
+import sqlite3
+import tempfile
+import threading
+import time
+from flask import Flask, jsonify, request
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwt
+from jose.utils import long_to_base64
 
 from app import create_app
-from models import setup_db, Actor, Movie
+from sqlalchemy import create_engine, event, inspect
+from models import db, setup_db, row_count, Actor, Movie, Change, TableCount
+from auth.jwks import JWKSStore, JWKSUnavailableError
+from auth.auth import token_cache
+from auth.token_cache import TokenCache
+from routing import replicas
+from pools import InstrumentedQueuePool
+from readmodels import ActorRow, fetch_rows, get_row, select_rows
+from serialization import Fragments, fragments
+from cache import LRUBackend, ResponseCache, SharedBackend, response_cache
+from singleflight import LOCK_STRIPES, FileSingleFlight, SingleFlight
+from search_index import PrefixIndex, TrigramIndex
 import ssl
 
+try:
+    from starlette.testclient import TestClient
+    from asgi import create_asgi_app
+except ImportError:  # starlette and aiosqlite are optional
+    create_asgi_app = None
+
 ssl._create_default_https_context = ssl._create_unverified_context
 
 # Get token from env
@@ -46,6 +74,19 @@ class CastingAgencyTestCase(unittest.TestCase):
         """Executed after reach test"""
         pass
 
+    def test_metrics_report_pool(self):
+        """
+        Test the pool gauges and checkout waits of the primary in /metrics
+        """
+        self.client().get("/actors", headers=self.AUTH_HEADER)
+        res = self.client().get("/metrics")
+        pool = json.loads(res.data)["db_pool"]["primary"]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(pool["waits"]["count"], 0)
+        self.assertEqual(pool["waits"]["buckets"]["le_+Inf"], pool["waits"]["count"])
+        self.assertIn("in_use", pool)
+
     def test_home_page_200(self):
         """
         Test getting home page successfully
@@ -65,6 +106,167 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(data["actors"])
 
+    def test_get_actors_paginated_200(self):
+        """
+        Test walking the actors list with a keyset cursor
+        """
+        res = self.client().get("/actors?limit=2", headers=self.AUTH_HEADER)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["actors"]), 2)
+        self.assertTrue(data["next_cursor"])
+
+        res = self.client().get(
+            "/actors?limit=2&after={}".format(data["next_cursor"]),
+            headers=self.AUTH_HEADER,
+        )
+        next_page = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(next_page["actors"][0]["id"], data["actors"][-1]["id"])
+
+    def test_get_actors_bad_cursor_400(self):
+        """
+        Test getting actors with a malformed cursor
+        """
+        res = self.client().get("/actors?after=not-a-cursor", headers=self.AUTH_HEADER)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
+    def test_get_movies_filtered_sorted_200(self):
+        """
+        Test walking a date-filtered movies list sorted by release date
+        """
+        url = "/movies?limit=2&released_after=2020-01-01&sort=-release_date"
+        res = self.client().get(url, headers=self.AUTH_HEADER)
+        data = json.loads(res.data)
+        movies = data["movies"]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("X-Total-Count", res.headers)
+        while data["next_cursor"]:
+            res = self.client().get(
+                url + "&after=" + data["next_cursor"], headers=self.AUTH_HEADER
+            )
+            data = json.loads(res.data)
+            movies.extend(data["movies"])
+
+        dates = [movie["release_date"] for movie in movies]
+        self.assertTrue(dates)
+        self.assertTrue(all(day >= "2020-01-01" for day in dates))
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        self.assertEqual(len(movies), len({movie["id"] for movie in movies}))
+
+    def test_get_actors_filtered_400(self):
+        """
+        Test filtering and sorting actors with malformed values
+        """
+        for query in ("min_age=old", "sort=image_link", "sort=-"):
+            res = self.client().get("/actors?" + query, headers=self.AUTH_HEADER)
+
+            self.assertEqual(res.status_code, 400)
+
+        res = self.client().get(
+            "/actors?gender=Male&min_age=62&max_age=64", headers=self.AUTH_HEADER
+        )
+        ages = [actor["age"] for actor in json.loads(res.data)["actors"]]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(ages)
+        self.assertTrue(all(62 <= age <= 64 for age in ages))
+
+    def test_get_movies_sparse_fields_200(self):
+        """
+        Test getting only some fields of movies, paged and streamed
+        """
+        res = self.client().get(
+            "/movies?limit=2&fields=title,release_date&sort=-release_date",
+            headers=self.AUTH_HEADER,
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(data["movies"][0]), {"id", "title", "release_date"})
+        self.assertTrue(data["next_cursor"])
+
+        headers = dict(self.AUTH_HEADER, Accept="application/x-ndjson")
+        res = self.client().get("/movies?fields=title", headers=headers)
+        movies = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertTrue(movies)
+        self.assertTrue(all(set(movie) == {"id", "title"} for movie in movies))
+
+        res = self.client().get("/movies?fields=budget", headers=self.AUTH_HEADER)
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_actors_ndjson_200(self):
+        """
+        Test streaming every actor as newline-delimited JSON
+        """
+        headers = dict(self.AUTH_HEADER, Accept="application/x-ndjson")
+        res = self.client().get("/actors", headers=headers)
+        actors = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertTrue(actors)
+        self.assertEqual(actors, sorted(actors, key=lambda actor: actor["id"]))
+
+    def test_get_movies_stream_200(self):
+        """
+        Test streaming every movie as a single JSON document
+        """
+        res = self.client().get("/movies?stream=1", headers=self.AUTH_HEADER)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertTrue(data["movies"])
+
+    def test_actors_total_count(self):
+        """
+        Test the maintained actor count follows creates and bulk creates
+        """
+        headers = dict(self.AUTH_HEADER, **{"Content-Type": "application/json"})
+        res = self.client().get("/actors", headers=headers)
+        total = int(res.headers["X-Total-Count"])
+
+        self.assertEqual(res.status_code, 200)
+
+        actors = [{"name": "Counted Actor", "age": 30, "gender": "Male"}] * 2
+        self.client().post("/actors/bulk", json=actors, headers=self.AUTH_HEADER)
+        res = self.client().post(
+            "/actors/create", json=actors[0], headers=self.AUTH_HEADER
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(data["total"], total + 3)
+
+        res = self.client().get("/actors", headers=headers)
+
+        self.assertEqual(res.headers["X-Total-Count"], str(total + 3))
+
+    def test_row_count_seeds_apart_from_session(self):
+        """
+        Test seeding a missing counter leaves the session's transaction alone
+        """
+        with self.app.app_context():
+            TableCount.query.filter_by(table_name="Actor").delete()
+            db.session.commit()
+            total = Actor.query.count()
+            db.session.add(Actor(name="Uncommitted Actor", age=40, gender="Male"))
+            db.session.flush()
+
+            self.assertEqual(row_count(Actor), total)
+
+            db.session.rollback()
+
+            self.assertEqual(Actor.query.count(), total)
+            self.assertEqual(db.session.get(TableCount, "Actor").row_count, total)
+
     def test_get_actors_401(self):
         """
         Test getting actors without authorization
@@ -96,6 +298,28 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data["message"]["code"], "authorization_header_missing")
 
+    def test_suggest_actors_200(self):
+        """
+        Test autocompleting actor names
+        """
+        res = self.client().get("/actors/suggest?q=tom", headers=self.AUTH_HEADER)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertTrue(data["actors"])
+        self.assertTrue(data["actors"][0]["name"].lower().startswith("tom"))
+
+    def test_suggest_movies_401(self):
+        """
+        Test autocompleting movie titles without authorization
+        """
+        res = self.client().get("/movies/suggest?q=ave", headers="")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(data["message"]["code"], "authorization_header_missing")
+
     def test_get_actor_by_id_200(self):
         """
         Test getting actor by id successfully
@@ -107,6 +331,192 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(data["actor"])
 
+    def test_get_actor_by_id_304(self):
+        """
+        Test revalidating an actor with its ETag
+        """
+        headers = dict(self.AUTH_HEADER, **{"Content-Type": "application/json"})
+        res = self.client().get("/actors/3", headers=headers)
+        etag = res.headers["ETag"]
+
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get(
+            "/actors/3", headers=dict(headers, **{"If-None-Match": etag})
+        )
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], etag)
+        self.assertEqual(res.data, b"")
+
+    def test_get_movies_304(self):
+        """
+        Test revalidating the movie list until a movie is added
+        """
+        headers = dict(self.AUTH_HEADER, **{"Content-Type": "application/json"})
+        etag = self.client().get("/movies", headers=headers).headers["ETag"]
+        headers["If-None-Match"] = etag
+
+        res = self.client().get("/movies", headers=headers)
+
+        self.assertEqual(res.status_code, 304)
+
+        info = {"title": "ETag movie", "release_date": "2023", "image_link": ""}
+        self.client().post("/movies/create", json=info, headers=self.AUTH_HEADER)
+        res = self.client().get("/movies", headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+
+    def test_get_actor_by_id_422(self):
+        headers = dict(self.AUTH_HEADER, **{"Content-Type": "application/json"})
+        res = self.client().get("/actors/999999", headers=headers)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(json.loads(res.data)["message"], "unprocessable")
+
+    def test_get_actor_by_id_cached(self):
+        """
+        Test a cached actor is served until the actor is edited
+        """
+        headers = dict(self.AUTH_HEADER, **{"Content-Type": "application/json"})
+        self.client().get("/actors/5", headers=headers)
+        hits = response_cache.hits
+        res = self.client().get("/actors/5", headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(response_cache.hits, hits + 1)
+
+        info = {"name": "Tom Cruise 5 (cached)", "age": 65, "gender": "Male"}
+        self.client().post("/actors/5/edit", json=info, headers=headers)
+        data = json.loads(self.client().get("/actors/5", headers=headers).data)
+
+        self.assertEqual(data["actor"]["name"], "Tom Cruise 5 (cached)")
+
+    def test_cast_counts(self):
+        """
+        Test cast counts follow the cast links of an actor
+        """
+        headers = dict(self.AUTH_HEADER, **{"Content-Type": "application/json"})
+        with self.app.app_context():
+            actor = Actor(name="Cast Actor", age="40", gender="Female")
+            actor.movies = Movie.query.filter(Movie.id.in_([3, 4])).all()
+            actor.insert()
+            actor_id = actor.id
+            counts = {movie.id: movie.actor_count for movie in actor.movies}
+
+        data = json.loads(
+            self.client().get("/actors/{}".format(actor_id), headers=headers).data
+        )
+
+        self.assertEqual(data["actor"]["movie_count"], 2)
+
+        with self.app.app_context():
+            actor = Actor.query.get(actor_id)
+            actor.movies = actor.movies[:1]
+            actor.update()
+            movie = Movie.query.get(4)
+
+            self.assertEqual(movie.actor_count, counts[4] - 1)
+
+            actor.delete()
+
+            self.assertEqual(Movie.query.get(3).actor_count, counts[3] - 1)
+
+    def count_queries(self, path):
+        """Returns the response of a GET and the number of SQL statements it ran"""
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+
+        headers = dict(self.AUTH_HEADER, **{"Content-Type": "application/json"})
+        with self.app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            res = self.client().get(path, headers=headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        return res, len(statements)
+
+    def test_get_movies_include_actors(self):
+        """
+        Test movies with their actors, loaded with one query per page
+        """
+        with self.app.app_context():
+            actor = Actor(name="Included Actor", age="33", gender="Male")
+            actor.movies = Movie.query.filter(Movie.id.in_([3, 4])).all()
+            actor.insert()
+            actor_id = actor.id
+
+        res, small_page = self.count_queries("/movies?limit=2&include=actors")
+        res, large_page = self.count_queries("/movies?limit=4&include=actors")
+        data = json.loads(res.data)
+        actors = {movie["id"]: movie["actors"] for movie in data["movies"]}
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(small_page, large_page)
+        self.assertIn(actor_id, [actor["id"] for actor in actors[3]])
+
+        res, _ = self.count_queries("/actors/{}?include=movies".format(actor_id))
+        data = json.loads(res.data)
+
+        self.assertEqual([movie["id"] for movie in data["actor"]["movies"]], [3, 4])
+
+    def test_get_movies_include_400(self):
+        res, _ = self.count_queries("/movies?include=directors")
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_costars_and_path(self):
+        """
+        Test co-star queries on a chain of three actors and two movies
+        """
+        with self.app.app_context():
+            actors = [
+                Actor(name="Graph Actor {}".format(i), age="30", gender="Male")
+                for i in range(3)
+            ]
+            first = Movie(title="Graph movie 1", actors=actors[:2])
+            second = Movie(title="Graph movie 2", actors=actors[1:])
+            db.session.add_all([first, second])
+            db.session.commit()
+            ids = [actor.id for actor in actors]
+            movie_ids = [first.id, second.id]
+
+        res = self.client().get(
+            "/actors/{}/costars".format(ids[1]), headers=self.AUTH_HEADER
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            sorted(costar["id"] for costar in data["costars"]), [ids[0], ids[2]]
+        )
+        self.assertEqual(data["costars"][0]["shared_movies"], 1)
+
+        res = self.client().get(
+            "/actors/{}/path/{}".format(ids[0], ids[2]), headers=self.AUTH_HEADER
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["degrees"], 2)
+        self.assertEqual([actor["id"] for actor in data["actors"]], ids)
+        self.assertEqual([movie["id"] for movie in data["movies"]], movie_ids)
+
+        self.client().delete(
+            "/movies/{}/cast".format(movie_ids[1]),
+            json=[ids[2]],
+            headers=self.AUTH_HEADER,
+        )
+        res = self.client().get(
+            "/actors/{}/path/{}".format(ids[0], ids[2]), headers=self.AUTH_HEADER
+        )
+
+        self.assertEqual(res.status_code, 404)
+
     def test_get_actor_by_id_401(self):
         """
         Test getting actor by id without authorization
@@ -128,6 +538,20 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(data["movie"])
 
+    def test_read_rows_match_models(self):
+        """
+        Test the read model rows serialize like the mapped instances
+        """
+        with self.app.app_context():
+            movies = Movie.query.order_by(Movie.id).all()
+            rows = fetch_rows(Movie, select_rows(Movie).order_by(Movie.id))
+
+            self.assertEqual(
+                [row.to_dict() for row in rows], [movie.to_dict() for movie in movies]
+            )
+            self.assertEqual(get_row(Movie, movies[0].id), rows[0])
+            self.assertIsNone(get_row(Movie, -1))
+
     def test_get_movie_by_id_401(self):
         """
         Test getting movie by id without authorization
@@ -153,6 +577,22 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(len(data["actors"]))
 
+    def test_search_actors_paginated_200(self):
+        """
+        Test paging through ranked search results
+        """
+        search_data = {"search_term": "Tom", "limit": 1, "page": 2}
+
+        res = self.client().post(
+            "/actors/search", headers=self.AUTH_HEADER, json=search_data
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["page"], 2)
+        self.assertEqual(len(data["actors"]), 1)
+        self.assertGreater(data["total"], 1)
+
     def test_search_actors_401(self):
         """
         Test searching for actor without authorization
@@ -248,6 +688,61 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data["message"]["code"], "authorization_header_missing")
 
+    def test_bulk_create_actors_200(self):
+        actors = [
+            {"name": "Bulk Actor 1", "age": 30, "gender": "Male", "image_link": ""},
+            {"name": "", "age": "thirty", "gender": "Male"},
+            {"name": "Bulk Actor 2", "age": "41", "gender": "Female"},
+        ]
+
+        res = self.client().post("/actors/bulk", json=actors, headers=self.AUTH_HEADER)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["created"], 2)
+        self.assertEqual(len(data["ids"]), 2)
+        self.assertEqual(data["errors"][0]["index"], 1)
+        self.assertIn("name", data["errors"][0]["errors"])
+
+    def test_bulk_create_actors_without_age_200(self):
+        actors = [
+            {"name": "NoAge", "gender": "Male"},
+            {"name": "Listed Age", "age": ["30"], "gender": "Female"},
+        ]
+
+        res = self.client().post("/actors/bulk", json=actors, headers=self.AUTH_HEADER)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["created"], 2)
+        self.assertEqual(data["errors"], [])
+
+        res = self.client().get(
+            "/actors/{}".format(data["ids"][0]), headers=self.AUTH_HEADER
+        )
+        self.assertIsNone(json.loads(res.data)["actor"]["age"])
+
+    def test_bulk_create_movies_ndjson_200(self):
+        body = "\n".join(
+            json.dumps({"title": "Bulk movie {}".format(i), "release_date": "2023"})
+            for i in range(3)
+        )
+        headers = dict(self.AUTH_HEADER, **{"Content-Type": "application/x-ndjson"})
+
+        res = self.client().post("/movies/bulk", data=body, headers=headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["created"], 3)
+        self.assertEqual(data["errors"], [])
+
+    def test_bulk_create_actors_400(self):
+        res = self.client().post(
+            "/actors/bulk", json={"name": "Not a list"}, headers=self.AUTH_HEADER
+        )
+
+        self.assertEqual(res.status_code, 400)
+
     def test_update_actor_200(self):
         info = {
             "name": "Tom Cruise 1",
@@ -262,6 +757,68 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(data["actor"])
 
+    def test_update_actor_412(self):
+        """
+        Test an edit based on a stale read is refused
+        """
+        headers = dict(self.AUTH_HEADER, **{"Content-Type": "application/json"})
+        etag = self.client().get("/actors/4", headers=headers).headers["ETag"]
+        info = {"name": "Tom Cruise 4", "age": 64, "gender": "Male"}
+
+        res = self.client().post(
+            "/actors/4/edit", json=info, headers=dict(headers, **{"If-Match": etag})
+        )
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+
+        res = self.client().post(
+            "/actors/4/edit", json=info, headers=dict(headers, **{"If-Match": etag})
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 412)
+        self.assertEqual(data["success"], False)
+
+    def test_patch_and_delete_actor(self):
+        """
+        Test partial updates, their preconditions, and deleting the row
+        """
+        info = {"name": "Michelle Yeoh", "age": 61, "gender": "Female"}
+        res = self.client().post("/actors/create", json=info, headers=self.AUTH_HEADER)
+        actor = json.loads(res.data)["actor"]
+        url = "/actors/{}".format(actor["id"])
+
+        res = self.client().patch(url, json={"age": "62"}, headers=self.AUTH_HEADER)
+        patched = json.loads(res.data)["actor"]
+        etag = res.headers["ETag"]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(patched["age"], 62)
+        self.assertEqual(patched["name"], "Michelle Yeoh")
+
+        stale = dict(self.AUTH_HEADER, **{"If-Match": etag})
+        res = self.client().patch(url, json={"name": "M. Yeoh"}, headers=stale)
+        self.assertEqual(res.status_code, 200)
+        res = self.client().patch(url, json={"name": "Yeoh"}, headers=stale)
+        self.assertEqual(res.status_code, 412)
+        res = self.client().patch(url, json={"height": 1}, headers=self.AUTH_HEADER)
+        self.assertEqual(res.status_code, 400)
+        res = self.client().patch(url, json={"age": ""}, headers=self.AUTH_HEADER)
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNone(json.loads(res.data)["actor"]["age"])
+
+        res = self.client().delete(url, headers=self.AUTH_HEADER)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["actor"]["name"], "M. Yeoh")
+        self.assertEqual(
+            self.client().delete(url, headers=self.AUTH_HEADER).status_code, 404
+        )
+        res = self.client().patch(url, json={"age": 1}, headers=self.AUTH_HEADER)
+        self.assertEqual(res.status_code, 404)
+
     def test_update_actor_405(self):
         info = {
             "name": "Tom Cruise 1",
@@ -302,6 +859,56 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 405)
         self.assertEqual(data["message"], "method not allowed")
 
+    def test_update_movie_cast_200(self):
+        res = self.client().post(
+            "/movies/5/cast", json=[1, 3, 999], headers=self.AUTH_HEADER
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["added"], [1, 3])
+        count = data["actor_count"]
+
+        res = self.client().post(
+            "/movies/5/cast", json={"actor_ids": [1, 4]}, headers=self.AUTH_HEADER
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(data["added"], [4])
+        self.assertEqual(data["actor_count"], count + 1)
+
+        res = self.client().delete(
+            "/movies/5/cast", json=[3, 4, 5], headers=self.AUTH_HEADER
+        )
+        data = json.loads(res.data)
+
+        self.assertEqual(data["removed"], [3, 4])
+        self.assertEqual(data["actor_count"], count - 1)
+
+        res = self.client().get("/movies/5", headers=self.AUTH_HEADER)
+        headers = dict(self.AUTH_HEADER, **{"If-Match": res.headers["ETag"]})
+        res = self.client().post("/movies/5/cast", json=[3], headers=headers)
+
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().post("/movies/5/cast", json=[4], headers=headers)
+
+        self.assertEqual(res.status_code, 412)
+        res = self.client().delete("/movies/5/cast", json=[3], headers=self.AUTH_HEADER)
+        self.assertEqual(json.loads(res.data)["actor_count"], count - 1)
+
+    def test_update_movie_cast_400(self):
+        res = self.client().post(
+            "/movies/5/cast", json=["one"], headers=self.AUTH_HEADER
+        )
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_update_movie_cast_404(self):
+        res = self.client().post("/movies/999/cast", json=[1], headers=self.AUTH_HEADER)
+
+        self.assertEqual(res.status_code, 404)
+
     def test_delete_actor_401(self):
         res = self.client().delete("/actors/2", headers="")
         data = json.loads(res.data)
@@ -333,6 +940,616 @@ class CastingAgencyTestCase(unittest.TestCase):
         self.assertEqual(data["movie_id"], "2")
 
 
+def make_jwks(*kids):
+    """Generates an RSA key per kid, returns (jwks document, {kid: private key})"""
+    keys, private_keys = [], {}
+    for kid in kids:
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        numbers = private_key.public_key().public_numbers()
+        keys.append(
+            {
+                "kty": "RSA",
+                "kid": kid,
+                "use": "sig",
+                "alg": "RS256",
+                "n": long_to_base64(numbers.n).decode(),
+                "e": long_to_base64(numbers.e).decode(),
+            }
+        )
+        private_keys[kid] = private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    return {"keys": keys}, private_keys
+
+
+class JWKSStoreTestCase(unittest.TestCase):
+    """This class represents the JWKS store test case"""
+
+    def setUp(self):
+        self.jwks, self.private_keys = make_jwks("key-1")
+        self.jwks_file = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+        json.dump(self.jwks, self.jwks_file)
+        self.jwks_file.close()
+
+    def tearDown(self):
+        os.unlink(self.jwks_file.name)
+
+    def test_get_key_from_local_file(self):
+        store = JWKSStore(path=self.jwks_file.name)
+        key = store.get_key("key-1")
+
+        self.assertIsNotNone(key)
+        self.assertIs(store.get_key("key-1"), key)
+        self.assertEqual(store.kids, {"key-1"})
+
+    def test_unknown_kid_refetches_once(self):
+        store = JWKSStore(path=self.jwks_file.name, min_refetch_interval=0)
+        store.get_key("key-1")
+
+        with open(self.jwks_file.name, "w") as f:
+            json.dump(make_jwks("key-2")[0], f)
+        self.assertIsNotNone(store.get_key("key-2"))
+
+        # Further unknown kids are rate limited
+        store.min_refetch_interval = 60
+        with open(self.jwks_file.name, "w") as f:
+            json.dump(make_jwks("key-3")[0], f)
+        self.assertIsNone(store.get_key("key-3"))
+        self.assertEqual(store.kids, {"key-2"})
+
+    def test_circuit_breaker_opens(self):
+        store = JWKSStore(path="/nonexistent/jwks.json", failure_threshold=2)
+
+        for _ in range(2):
+            with self.assertRaises(JWKSUnavailableError):
+                store.get_key("key-1")
+        self.assertTrue(store._circuit_open(store._last_attempt))
+
+    def test_decode_with_cached_key(self):
+        store = JWKSStore(path=self.jwks_file.name)
+        token = jwt.encode(
+            {"sub": "user"},
+            self.private_keys["key-1"],
+            algorithm="RS256",
+            headers={"kid": "key-1"},
+        )
+
+        payload = jwt.decode(token, store.get_key("key-1"), algorithms="RS256")
+        self.assertEqual(payload["sub"], "user")
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified-token cache test case"""
+
+    def setUp(self):
+        self.cache = TokenCache(maxsize=2)
+        self.payload = {
+            "exp": time.time() + 3600,
+            "permissions": ["get:actors", "get:movies"],
+        }
+
+    def test_hit_returns_permission_set(self):
+        self.assertIsNone(self.cache.get("token-1"))
+        self.cache.put("token-1", "key-1", self.payload)
+        payload, permissions = self.cache.get("token-1")
+
+        self.assertEqual(payload, self.payload)
+        self.assertEqual(permissions, frozenset(["get:actors", "get:movies"]))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_expired_token_is_a_miss(self):
+        self.cache.put("token-1", "key-1", dict(self.payload, exp=time.time() - 1))
+
+        self.assertIsNone(self.cache.get("token-1"))
+
+    def test_lru_eviction(self):
+        for token in ("token-1", "token-2", "token-3"):
+            self.cache.put(token, "key-1", self.payload)
+
+        self.assertIsNone(self.cache.get("token-1"))
+        self.assertIsNotNone(self.cache.get("token-3"))
+
+    def test_rotated_key_evicts_entries(self):
+        jwks, _ = make_jwks("key-1", "key-2")
+        store = JWKSStore()
+        store.add_rotation_listener(self.cache.evict_kids)
+        store.load(jwks)
+        self.cache.put("token-1", "key-1", self.payload)
+        self.cache.put("token-2", "key-2", self.payload)
+
+        store.load({"keys": jwks["keys"][1:]})
+
+        self.assertIsNone(self.cache.get("token-1"))
+        self.assertIsNotNone(self.cache.get("token-2"))
+
+
+class LocalRedis:
+    """Stand-in for the subset of the Redis client used by SharedBackend"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode("ascii")
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """This class represents the response cache test case"""
+
+    def test_lru_evicts_by_size(self):
+        backend = LRUBackend(max_bytes=100)
+        backend.set("a", b"x" * 40, ttl=60)
+        backend.set("b", b"x" * 40, ttl=60)
+        backend.get("a")
+        backend.set("c", b"x" * 40, ttl=60)
+
+        self.assertIsNotNone(backend.get("a"))
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.stats()["evictions"], 1)
+        self.assertLessEqual(backend.stats()["bytes"], 100)
+
+    def test_expired_entry_is_a_miss(self):
+        backend = LRUBackend()
+        backend.set("a", b"x", ttl=-1)
+
+        self.assertIsNone(backend.get("a"))
+
+    def test_writes_bump_generations(self):
+        for backend in (LRUBackend(), SharedBackend(LocalRedis())):
+            cache = ResponseCache()
+            cache.backend = backend
+            cache.invalidate(
+                [
+                    Change(Actor, "insert", 7, {}),
+                    Change(Actor, "update", 3, {}),
+                ]
+            )
+
+            self.assertEqual(
+                backend.get_counters(["gen:Actor", "gen:Actor:3", "gen:Actor:7"]),
+                [1, 1, 0],
+            )
+
+
+class FragmentsTestCase(unittest.TestCase):
+    """This class represents the encoded row fragments test case"""
+
+    def setUp(self):
+        self.fragments = Fragments()
+
+    def test_fragment_follows_version(self):
+        row = ActorRow(id=1, name="Tom Cruise", age=61, gender="Male", version=1)
+        first = self.fragments.encode(Actor, row)
+
+        self.assertEqual(json.loads(first), row.to_dict())
+        self.assertEqual(self.fragments.encode(Actor, row), first)
+        self.assertEqual(self.fragments.hits, 1)
+
+        renamed = row._replace(name="Tom", version=2)
+        self.assertEqual(
+            json.loads(self.fragments.encode(Actor, renamed))["name"], "Tom"
+        )
+        self.assertEqual(self.fragments.misses, 2)
+
+        self.fragments.invalidate([Change(Actor, "delete", 1, renamed.to_dict())])
+        self.assertIsNone(self.fragments.backend.get("Actor:1"))
+
+    def test_encoded_list_is_json(self):
+        rows = [ActorRow(id=i, name=str(i), version=1) for i in range(3)]
+        encoded = self.fragments.encode_list(Actor, rows)
+
+        self.assertEqual(json.loads(encoded), [row.to_dict() for row in rows])
+        self.assertEqual(json.loads(self.fragments.encode_list(Actor, [])), [])
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    """This class represents the request coalescing test case"""
+
+    def run_concurrently(self, flight, callers=8):
+        started, calls, results = threading.Event(), [], []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            time.sleep(0.2)
+            return "result"
+
+        def caller():
+            results.append(flight.do("movies", compute))
+
+        threads = [threading.Thread(target=caller) for _ in range(callers)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return calls, results
+
+    def test_concurrent_calls_are_coalesced(self):
+        flight = SingleFlight()
+        calls, results = self.run_concurrently(flight)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 7)
+        self.assertEqual(flight.stats()["coalesced"], 7)
+        self.assertEqual(flight.stats()["in_flight"], 0)
+
+    def test_errors_are_shared(self):
+        flight = SingleFlight()
+
+        def fail():
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            flight.do("movies", fail)
+        self.assertEqual(flight.do("movies", lambda: 1), (1, False))
+
+    def test_file_flight(self):
+        with tempfile.TemporaryDirectory() as directory:
+            flight = FileSingleFlight(directory)
+            calls, results = self.run_concurrently(flight, callers=3)
+
+            self.assertEqual(len(calls), 1)
+            for i in range(1000):
+                flight.do("movies?page={}".format(i), lambda: i)
+
+            # Only the stripes stay behind: markers go with their call
+            files = os.listdir(directory)
+            self.assertLessEqual(len(files), LOCK_STRIPES)
+            self.assertTrue(all(name.endswith(".lock") for name in files))
+
+    def test_file_flight_across_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Two workers sharing the lock directory
+            first, second = FileSingleFlight(directory), FileSingleFlight(directory)
+            started, events = threading.Event(), []
+
+            def slow():
+                started.set()
+                time.sleep(0.2)
+                events.append("first done")
+
+            thread = threading.Thread(target=first.do, args=("movies", slow))
+            thread.start()
+            started.wait()
+            second.do("movies", lambda: events.append("second ran"))
+            thread.join()
+
+            self.assertEqual(events, ["first done", "second ran"])
+
+    def test_file_flight_stripe_not_held(self):
+        with tempfile.TemporaryDirectory() as directory:
+            slow, fast = FileSingleFlight(directory), FileSingleFlight(directory)
+            # Another key sharing the stripe of "movies"
+            stripe = slow._paths("movies")[0]
+            key = next(
+                "actors-{}".format(i)
+                for i in itertools.count()
+                if slow._paths("actors-{}".format(i))[0] == stripe
+            )
+            started, release = threading.Event(), threading.Event()
+
+            def hold():
+                started.set()
+                release.wait(5)
+
+            thread = threading.Thread(target=slow.do, args=("movies", hold))
+            thread.start()
+            started.wait()
+            try:
+                began = time.monotonic()
+                self.assertEqual(fast.do(key, lambda: 1), (1, False))
+                self.assertLess(time.monotonic() - began, 1)
+            finally:
+                release.set()
+                thread.join()
+
+
+class TrigramIndexTestCase(unittest.TestCase):
+    """This class represents the in-memory trigram index test case"""
+
+    def setUp(self):
+        self.index = TrigramIndex(Actor)
+        self.index.build(
+            [
+                {"id": 1, "name": "Tom Cruise"},
+                {"id": 2, "name": "Tom Hanks"},
+                {"id": 3, "name": "Zoë Saldaña"},
+            ]
+        )
+
+    def test_substring_and_accent_insensitive(self):
+        rows, total = self.index.search("tom", 10)
+        self.assertEqual(total, 2)
+        self.assertEqual(sorted(row["id"] for row in rows), [1, 2])
+
+        rows, total = self.index.search("zoe saldana", 10)
+        self.assertEqual([row["id"] for row in rows], [3])
+
+    def test_misspelled_term(self):
+        rows, total = self.index.search("tom crusie", 10)
+
+        self.assertEqual(rows[0]["id"], 1)
+
+    def test_incremental_updates(self):
+        self.index.add({"id": 2, "name": "Thomas Hanks"})
+        self.index.remove(1)
+        rows, total = self.index.search("tom", 10)
+
+        self.assertEqual(total, 0)
+        self.assertEqual(self.index.stats()["documents"], 2)
+
+
+class PrefixIndexTestCase(unittest.TestCase):
+    """This class represents the autocomplete prefix index test case"""
+
+    def setUp(self):
+        self.index = PrefixIndex(Movie)
+        self.index.build(
+            [
+                {"id": 1, "title": "The Avengers"},
+                {"id": 2, "title": "Avengers: Endgame"},
+                {"id": 3, "title": "Kung Fu Panda"},
+            ]
+        )
+
+    def test_label_prefix_ranks_first(self):
+        suggestions = self.index.suggest("aven", 10)
+
+        self.assertEqual([s["id"] for s in suggestions], [2, 1])
+        self.assertEqual(suggestions[0]["title"], "Avengers: Endgame")
+
+    def test_limit_and_no_match(self):
+        self.assertEqual(len(self.index.suggest("aven", 1)), 1)
+        self.assertEqual(self.index.suggest("zzz", 10), [])
+        self.assertEqual(self.index.suggest("", 10), [])
+
+    def test_incremental_updates(self):
+        self.index.add({"id": 3, "title": "Kung Fu Panda 2"})
+        self.index.add({"id": 4, "title": "Kung Fury"})
+        self.index.remove(2)
+
+        self.assertEqual([s["id"] for s in self.index.suggest("kung f", 10)], [4, 3])
+        self.assertEqual([s["id"] for s in self.index.suggest("aven", 10)], [1])
+
+
+class InstrumentedQueuePoolTestCase(unittest.TestCase):
+    """This class represents the instrumented connection pool test case"""
+
+    def test_gauges_and_timeouts(self):
+        pool = InstrumentedQueuePool(
+            lambda: sqlite3.connect(":memory:"),
+            pool_size=1,
+            max_overflow=0,
+            timeout=0.05,
+        )
+        connection = pool.connect()
+
+        self.assertEqual(pool.stats()["in_use"], 1)
+        with self.assertRaises(PoolTimeoutError):
+            pool.connect()
+        connection.close()
+
+        stats = pool.stats()
+        self.assertEqual((stats["in_use"], stats["idle"]), (0, 1))
+        self.assertEqual((stats["waits"]["count"], stats["waits"]["timeouts"]), (2, 1))
+        self.assertGreaterEqual(stats["waits"]["max_ms"], 50)
+
+
+class BootModeTestCase(unittest.TestCase):
+    """This class represents the boot mode test case"""
+
+    def boot(self, path, mode):
+        app = Flask(__name__)
+        app.config["BOOT_MODE"] = mode
+        setup_db(app, path, [])
+        with app.app_context():
+            tables = inspect(db.engine).get_table_names()
+            db.engine.dispose()
+        return app, tables
+
+    def test_production_boot_leaves_schema_to_alembic(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = "sqlite:///" + os.path.join(tmp, "boot.db")
+
+            app, tables = self.boot(path, "production")
+            self.assertEqual(tables, [])
+            self.assertNotIn("migrate", app.extensions)
+
+            app, tables = self.boot(path, "development")
+            self.assertIn("Actor", tables)
+            self.assertIn("migrate", app.extensions)
+
+
+@unittest.skipIf(create_asgi_app is None, "starlette or aiosqlite not installed")
+class AsgiTestCase(unittest.TestCase):
+    """This class represents the async read endpoints test case"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        url = "sqlite:///" + os.path.join(self.tmp.name, "asgi.db")
+        engine = create_engine(url)
+        db.Model.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(
+                Actor.__table__.insert(),
+                [
+                    {
+                        "name": "Async Actor {}".format(i),
+                        "age": 30 + i,
+                        "gender": "Male",
+                    }
+                    for i in range(3)
+                ],
+            )
+        engine.dispose()
+        # Rows of other test databases share these ids and versions
+        fragments.clear()
+        self.client = TestClient(create_asgi_app(url))
+        self.client.__enter__()
+        self.AUTH_HEADER = {"Authorization": "Bearer {}".format(PRODUCER_TOKEN)}
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        self.tmp.cleanup()
+
+    def test_list_pages_and_filters(self):
+        res = self.client.get("/actors?limit=2", headers=self.AUTH_HEADER)
+        data = res.json()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["X-Total-Count"], "3")
+        self.assertEqual([a["age"] for a in data["actors"]], [30, 31])
+
+        res = self.client.get(
+            "/actors?fields=name&after=" + data["next_cursor"],
+            headers=self.AUTH_HEADER,
+        )
+        self.assertEqual(res.json()["actors"], [{"id": 3, "name": "Async Actor 2"}])
+
+        res = self.client.get("/actors?min_age=old", headers=self.AUTH_HEADER)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json()["message"], "bad request")
+
+    def test_detail_search_and_auth(self):
+        res = self.client.get("/actors/2", headers=self.AUTH_HEADER)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()["actor"]["name"], "Async Actor 1")
+        self.assertEqual(res.headers["ETag"], '"actor-2-1"')
+        # A missing row is answered as by app.py's views
+        res = self.client.get("/actors/99", headers=self.AUTH_HEADER)
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(res.json()["message"], "unprocessable")
+
+        headers = dict(self.AUTH_HEADER, **{"If-None-Match": '"actor-2-1"'})
+        res = self.client.get("/actors/2", headers=headers)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], '"actor-2-1"')
+
+        res = self.client.post(
+            "/actors/search", json={"search_term": "actor 2"}, headers=self.AUTH_HEADER
+        )
+        self.assertEqual(res.json()["total"], 1)
+        self.assertEqual(res.json()["actors"][0]["id"], 3)
+
+        res = self.client.get("/actors")
+        self.assertEqual(res.status_code, 401)
+
+    def test_token_miss_counted_once(self):
+        token_cache.clear()
+        misses, hits = token_cache.misses, token_cache.hits
+        self.client.get("/actors/1", headers=self.AUTH_HEADER)
+        self.client.get("/actors/1", headers=self.AUTH_HEADER)
+
+        self.assertEqual(token_cache.misses - misses, 1)
+        self.assertEqual(token_cache.hits - hits, 1)
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """This class represents the read replica routing test case"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        primary = "sqlite:///" + os.path.join(self.tmp.name, "primary.db")
+        replica = "sqlite:///" + os.path.join(self.tmp.name, "replica.db")
+        self.app = Flask(__name__)
+        self.app.config["REPLICA_STICKY_SECONDS"] = 60
+        setup_db(self.app, primary, [replica])
+
+        @self.app.route("/first", methods=["GET", "POST"])
+        def first():
+            if request.method == "POST":
+                db.session.add(Actor(name="Written", age=20, gender="Male"))
+                db.session.commit()
+                return "", 201
+            return Actor.query.order_by(Actor.id).first().name
+
+        with self.app.app_context():
+            db.session.add(Actor(name="On primary", age=30, gender="Female"))
+            db.session.commit()
+            replica_engine = db.get_engine(self.app, bind="replica_0")
+            db.Model.metadata.create_all(replica_engine)
+            with replica_engine.begin() as connection:
+                connection.execute(
+                    Actor.__table__.insert().values(
+                        name="On replica", age=40, gender="Male"
+                    )
+                )
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.session.remove()
+            for bind in (None, "replica_0"):
+                db.get_engine(self.app, bind=bind).dispose()
+        self.tmp.cleanup()
+
+    def get_first(self, token):
+        res = self.app.test_client().get("/first", headers={"Authorization": token})
+        return res.data.decode("utf-8")
+
+    def test_reads_go_to_replica_and_writes_to_primary(self):
+        self.assertEqual(self.get_first("Bearer a"), "On replica")
+
+        res = self.app.test_client().post(
+            "/first", headers={"Authorization": "Bearer a"}
+        )
+
+        self.assertEqual(res.status_code, 201)
+        self.assertIn("read_primary_until", res.headers["Set-Cookie"])
+        with self.app.app_context():
+            names = [actor.name for actor in Actor.query.order_by(Actor.id)]
+        self.assertEqual(names, ["On primary", "Written"])
+        # The writer reads its writes from the primary, other clients don't
+        self.assertEqual(self.get_first("Bearer a"), "On primary")
+        self.assertEqual(self.get_first("Bearer b"), "On replica")
+
+    def test_replica_reads_are_not_cached(self):
+        cache = ResponseCache()
+        cache.init_app(self.app, LRUBackend())
+
+        @cache.cached(Actor)
+        def first_name(jwt):
+            return jsonify({"name": Actor.query.order_by(Actor.id).first().name})
+
+        self.app.add_url_rule("/cached", "cached", lambda: first_name({}))
+        client = self.app.test_client()
+        headers = {"Authorization": "Bearer a"}
+
+        self.assertEqual(
+            client.get("/cached", headers=headers).json["name"], "On replica"
+        )
+        self.assertEqual(cache.backend.stats()["entries"], 0)
+
+        # Sticky to the primary after a write: that read is stored
+        client.post("/first", headers=headers)
+        self.assertEqual(
+            client.get("/cached", headers=headers).json["name"], "On primary"
+        )
+        self.assertEqual(cache.backend.stats()["entries"], 1)
+        self.assertEqual(cache.stats()["replica_reads"], 1)
+
+    def test_lagging_replica_is_dropped(self):
+        self.assertEqual(self.get_first("Bearer a"), "On replica")
+
+        replicas.max_lag = -1
+        replicas.check()
+
+        self.assertEqual(self.get_first("Bearer a"), "On primary")
+        stats = replicas.stats()
+        self.assertEqual((stats["healthy"], stats["dropped"]), (0, 1))
+
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,135 @@
+from sqlalchemy import select
+
+from models import (
+    db,
+    Actor,
+    Movie,
+    CAST_COUNTS,
+    Change,
+    adjust_row_count,
+    cast,
+    parse_age,
+    parse_date,
+    refresh_cast_counts,
+)
+from readmodels import ROW_TYPES, get_row
+
+"""
+writes
+    single-statement writes of the PATCH and DELETE endpoints
+
+    - Postgres: UPDATE ... RETURNING, and DELETE ... RETURNING in a CTE
+      that also reads the row's cast links, so the row written comes back
+      in the same round trip as the write
+    - other databases: the same UPDATE / DELETE, plus a SELECT of the row
+    The UPDATE bumps the version itself, and the versions allowed by
+    If-Match are part of the WHERE clause: a write based on a stale read
+    matches no row. Changes are reported and the table counters adjusted
+    as for ORM writes, and a deleted row's cast counterparts recounted.
+    The caller commits.
+"""
+
+# Fields a PATCH may set, with the parser of the typed ones
+PATCH_FIELDS = {
+    Actor: {"name": None, "age": parse_age, "gender": None, "image_link": None},
+    Movie: {"title": None, "release_date": parse_date, "image_link": None},
+}
+
+
+def read_patch(model, body):
+    """The column values of a PATCH body; ValueError on unknown or malformed fields"""
+    if not isinstance(body, dict) or not body:
+        raise ValueError("Expected a JSON object of fields.")
+    values = {}
+    for name, value in body.items():
+        if name not in PATCH_FIELDS[model]:
+            raise ValueError("Unknown field {}.".format(name))
+        parse = PATCH_FIELDS[model][name]
+        if parse is not None and value == "":
+            # Clears a typed column, as an empty form field does
+            value = None
+        elif parse is not None and value is not None:
+            value = parse(value)
+            if value is None:
+                raise ValueError("Invalid {}.".format(name))
+        values[name] = value
+    return values
+
+
+def _report(model, action, row, delta):
+    adjust_row_count(db.session.connection(), model, delta, 1)
+    # Reported with the other changes of the transaction once it commits
+    db.session.info.setdefault("pending_changes", []).append(
+        Change(model, action, row.id, row.to_dict())
+    )
+
+
+def update_row(model, item_id, values, versions=None):
+    """
+    Sets `values` on the row of item_id, if its version is one of
+    `versions` (any version when None); returns the updated row, or None
+    when no row matched
+    """
+    table = model.__table__
+    statement = (
+        table.update()
+        .where(table.c.id == item_id)
+        .values(version=table.c.version + 1, **values)
+    )
+    if versions is not None:
+        statement = statement.where(table.c.version.in_(versions))
+
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        row = connection.execute(statement.returning(*table.c)).first()
+        row = ROW_TYPES[model]._make(row) if row is not None else None
+    else:
+        updated = connection.execute(statement).rowcount
+        row = get_row(model, item_id) if updated else None
+
+    if row is not None:
+        _report(model, "update", row, 0)
+    return row
+
+
+def delete_row(model, item_id, versions=None):
+    """
+    Deletes the row of item_id, if its version is one of `versions` (any
+    version when None), with its cast links; returns the deleted row, or
+    None when no row matched
+    """
+    table = model.__table__
+    _, own_key, other_key = CAST_COUNTS[model]
+    other = Movie if model is Actor else Actor
+    statement = table.delete().where(table.c.id == item_id)
+    if versions is not None:
+        statement = statement.where(table.c.version.in_(versions))
+
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        # The CTE's SELECT still sees the cast links the delete cascades to
+        deleted = statement.returning(*table.c).cte("deleted")
+        rows = connection.execute(
+            select(deleted, other_key).select_from(
+                deleted.outerjoin(cast, own_key == deleted.c.id)
+            )
+        ).all()
+        if not rows:
+            return None
+        row = ROW_TYPES[model]._make(rows[0][:-1])
+        linked = {row[-1] for row in rows if row[-1] is not None}
+    else:
+        row = get_row(model, item_id)
+        if row is None or (versions is not None and row.version not in versions):
+            return None
+        linked = set(
+            connection.execute(select(other_key).where(own_key == item_id)).scalars()
+        )
+        connection.execute(cast.delete().where(own_key == item_id))
+        connection.execute(statement)
+
+    _report(model, "delete", row, -1)
+    if linked:
+        changes = refresh_cast_counts(db.session, {other: linked})
+        db.session.info.setdefault("pending_changes", []).extend(changes)
+    return row